@@ -2,13 +2,20 @@
 Tools for aligning microscopy label volumes.
 """
 
+import asyncio
+import functools
+import json
+import math
+import threading
 import numpy as np
+from scipy import ndimage
 from . import operations3d
 import H5Gizmos as gz
 from . import colorizers
 from . import color_list
-from jp_doodle import gz_aircraft_axes
-from jp_doodle import gz_slider
+from . import render_scheduler
+from . import registration
+from . import caches
 
 class Volume3D:
 
@@ -27,6 +34,10 @@ class Volume3D:
         shape = np.array(array.shape)
         self.cubic = (shape.min() == shape.max())
 
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
     def nonzeros(self):
         slicing = operations3d.positive_slicing(self.array)
         mins = slicing[:, 0]
@@ -66,15 +77,43 @@ class Volume3D:
     def index_xyz(self, xyz):
         return ((xyz - self.corner000) / self.dxdydz).astype(np.int32)
     
-    def rotatable(self):
-        assert self.rectified, "rectify before constructing rotatable: " + repr(self.dxdydz)
+    def rotatable(self, dvoxel=None, roll=0, pitch=0, yaw=0):
+        """
+        Cubic volume of dvoxel sized voxels (default the voxels of a rectified volume) centered
+        on this one and large enough to rotate it.  A volume with other voxels is sampled
+        (nearest voxel) straight from its own grid, with the voxel spacing and optionally the
+        rotation folded into one affine, so no upsampled rectified copy is made.
+        """
+        if dvoxel is None:
+            assert self.rectified, "dvoxel is needed for anisotropic volumes: " + repr(self.dxdydz)
+            dvoxel = self.dxdydz[0]
         centroid = self.centroid()
-        dxdydz = self.dxdydz
-        buffer = operations3d.rotation_buffer(self.array)
-        buffer_corner = centroid - 0.5 * (np.array(buffer.shape) * dxdydz)
-        return Volume3D(buffer, buffer_corner, dxdydz, self.dtype)
+        dxdydz = self.dxdydz.astype(np.float64)
+        rotated = (roll, pitch, yaw) != (0, 0, 0)
+        if np.allclose(dxdydz, dvoxel) and not rotated:
+            buffer = operations3d.rotation_buffer(self.array)
+            buffer_corner = centroid - 0.5 * (np.array(buffer.shape) * dvoxel)
+            return Volume3D(buffer, buffer_corner, (dvoxel,) * 3, self.dtype)
+        extent = np.array(self.array.shape) * dxdydz / dvoxel
+        N = math.ceil(np.sqrt((extent ** 2).sum()))
+        buffer_corner = centroid - 0.5 * N * dvoxel
+        # buffer voxel o is centered at buffer_corner + (o + 0.5) * dvoxel,
+        # source voxel u at corner000 + (u + 0.5) * dxdydz.
+        scale = dvoxel / dxdydz
+        offset = (buffer_corner - self.corner000) / dxdydz + 0.5 * scale - 0.5
+        if not rotated:
+            buffer = scaled_buffer(self.array, scale, offset, N)
+        else:
+            # rotate about the buffer center as rotate3d does: o -> R (o - N/2) + N/2.
+            R = registration.volume_rotation_matrix(roll, pitch, yaw)
+            matrix = scale[:, None] * R.T
+            offset = offset + scale * (0.5 * N - R.T @ np.full(3, 0.5 * N))
+            buffer = ndimage.affine_transform(
+                self.array, matrix, offset, output_shape=(N, N, N), order=0, mode="constant", cval=0)
+        return Volume3D(buffer, buffer_corner, (dvoxel,) * 3, self.dtype)
     
     def rotate(self, roll, pitch, yaw):
+        "Rotate a rotatable volume in its buffer."
         #assert self.cubic, "only rotate cubic volume: " + repr(self.array.shape)
         buffer = operations3d.rotate3d(self.array, roll, -pitch, - yaw)
         return Volume3D(buffer, self.corner000, self.dxdydz, self.dtype)
@@ -83,14 +122,34 @@ class Volume3D:
         txyz = np.array(txyz, dtype=self.dtype)
         return Volume3D(self.array, self.corner000 + txyz, self.dxdydz, self.dtype)
     
-    def speckle(self, ratio, stride=1):
+    def speckle(self, ratio, stride=1, seed=None):
         array = self.array
         if stride > 1:
             array = array[::stride, ::stride, ::stride]
-        speckled = operations3d.speckle(array, ratio)
+        speckled = operations3d.speckle(array, ratio, seed)
         return Volume3D(speckled, self.corner000, self.dxdydz, self.dtype)
+
+    def coarsen(self, factor):
+        "Strided view with factor times larger voxels covering the same region (for previews)."
+        if factor <= 1:
+            return self
+        array = self.array[::factor, ::factor, ::factor]
+        return Volume3D(array, self.corner000, self.dxdydz * factor, self.dtype)
     
-    def combine_nonzeros(self, other):
+    def correlate_translation(self, moving, factor=1, method="cross", max_shift=None):
+        "Translation of the moving volume that best overlaps this one (see registration.correlation_translation)."
+        assert self.rectified and moving.rectified, "rectify volumes before correlating."
+        assert np.allclose(self.dxdydz, moving.dxdydz), "only correlate volumes with similar voxels."
+        (translation, _) = registration.correlation_translation(
+            self.array, moving.array, float(self.dxdydz[0]), self.corner000, moving.corner000,
+            factor=factor, method=method, max_shift=max_shift)
+        return translation
+
+    def combine_nonzeros(self, other, canvas=None):
+        """
+        Volume covering both volumes with the nonzeros of other over those of self.
+        With a CombinationCanvas the result is a view into its reused buffer.
+        """
         dxdydz = self.dxdydz
         #dtype = self.dtype
         #assert dtype == other.dtype, "only combine same dtypes."
@@ -101,13 +160,16 @@ class Volume3D:
         maxes = np.maximum(self.maxxyz(), other.maxxyz())
         extent = (maxes - mins) + dxdydz  # extra space
         combined_shape = (extent / dxdydz).astype(np.int32)
-        buffer = np.zeros(combined_shape, dtype=dtype)
+        if canvas is None:
+            buffer = np.zeros(combined_shape, dtype=dtype)
+        else:
+            buffer = canvas.array(combined_shape, dtype)
         result = Volume3D(buffer, mins, dxdydz, self.dtype)
-        result.embed_positive(self)
-        result.embed_positive(other)
+        result.embed_positive(self, canvas)
+        result.embed_positive(other, canvas)
         return result
     
-    def embed_positive(self, other):
+    def embed_positive(self, other, canvas=None):
         m = self.minxyz()
         M = self.maxxyz()
         m0 = other.minxyz()
@@ -118,15 +180,95 @@ class Volume3D:
         [I, J, K] = other.array.shape
         sarray = self.array
         oarray = other.array
-        positive = (oarray > 0)
-        sarray[i:i+I, j:j+J, k:k+K] = np.where(positive, oarray, sarray[i:i+I, j:j+J, k:k+K])
+        region = sarray[i:i+I, j:j+J, k:k+K]
+        if canvas is not None:
+            canvas.written.append((slice(i, i+I), slice(j, j+J), slice(k, k+K)))
+        # masked assignment in place, a slab at a time to keep the mask small.
+        slab = CombinationCanvas.slab
+        for start in range(0, I, slab):
+            source = oarray[start:start+slab]
+            if canvas is not None:
+                mask = canvas.mask_for(source.shape)
+            else:
+                mask = np.empty(source.shape, dtype=bool)
+            np.greater(source, 0, out=mask)
+            np.copyto(region[start:start+slab], source, where=mask)
+
+def scaled_buffer(array, scale, offset, N):
+    """
+    N**3 buffer whose voxel o holds the nearest voxel of array to scale * o + offset (0 outside).
+    The sampling is separable, so each source layer is resized once and written to the layers
+    that use it, without a full size temporary.
+    """
+    buffer = np.zeros((N, N, N), dtype=array.dtype)
+    ranges = []
+    for (n, s, o) in zip(array.shape, scale, offset):
+        index = np.floor(np.arange(N) * s + o + 0.5).astype(np.int64)
+        (valid,) = np.nonzero((index >= 0) & (index < n))
+        if len(valid) == 0:
+            return buffer
+        ranges.append((slice(valid[0], valid[-1] + 1), index[valid[0]:valid[-1] + 1]))
+    ((islice, iindex), (jslice, jindex), (kslice, kindex)) = ranges
+    target = buffer[islice, jslice, kslice]
+    for i in np.unique(iindex):
+        target[iindex == i] = array[i][np.ix_(jindex, kindex)]
+    return buffer
+
+class CombinationCanvas:
+
+    """
+    Reusable buffer for Volume3D.combine_nonzeros.  Results are views into one
+    buffer that only grows; before each combination just the boxes written by the
+    previous combination are cleared.  A result is valid until the next combination.
+    """
+
+    slab = 16
+
+    def __init__(self, shape=None, dtype=np.uint8):
+        self.buffer = None
+        self.mask = None
+        self.written = []
+        if shape is not None:
+            self.reserve(shape, dtype)
+
+    def reserve(self, shape, dtype=np.uint8):
+        "Make sure the buffer can hold shape (growing, never shrinking, it if needed)."
+        shape = tuple(int(n) for n in shape)
+        buffer = self.buffer
+        if buffer is not None and buffer.dtype == dtype:
+            if all(b >= n for (b, n) in zip(buffer.shape, shape)):
+                return
+            shape = tuple(max(b, n) for (b, n) in zip(buffer.shape, shape))
+        self.buffer = np.zeros(shape, dtype=dtype)
+        self.mask = np.empty((self.slab,) + shape[1:], dtype=bool)
+        self.written = []
+
+    def array(self, shape, dtype=np.uint8):
+        "A zeroed view of the given shape into the buffer."
+        self.reserve(shape, dtype)
+        buffer = self.buffer
+        for box in self.written:
+            buffer[box] = 0
+        self.written = []
+        (I, J, K) = shape
+        return buffer[:I, :J, :K]
+
+    def mask_for(self, shape):
+        "Scratch boolean array of shape (at most slab x buffer shape)."
+        (I, J, K) = shape
+        return self.mask[:I, :J, :K]
 
 
 class VolumeSequence:
 
-    def __init__(self, dIJK, get_volume_for_ts):
+    def __init__(self, dIJK, get_volume_for_ts, get_path_for_ts=None):
+        """
+        get_path_for_ts optionally gives the file a timestamp's volume is read from,
+        so batch runs can tell when saved alignments are out of date.
+        """
         self.dIJK = np.array(dIJK, dtype=np.float64)
         self.get_volume_for_ts = get_volume_for_ts
+        self.get_path_for_ts = get_path_for_ts
 
     def get_volume(self, for_ts, dvoxel, marker=None):
         volume_array = self.get_volume_for_ts(for_ts)
@@ -138,7 +280,11 @@ class VolumeSequence:
 
 class TimeStampVolume:
 
-    def __init__(self, ts_num, from_sequence, volume_array, dvoxel):
+    def __init__(self, ts_num, from_sequence, volume_array, dvoxel, cache_bytes=512 * 2**20):
+        """
+        Rectified and speckled versions of the volume are kept in an LRU cache
+        (at most cache_bytes) so returning to an earlier setting is instant.
+        """
         self.ts_num = ts_num
         self.from_sequence = from_sequence
         #self.volume_array = volume_array
@@ -147,6 +293,8 @@ class TimeStampVolume:
         (self.sliced, self.slicing) = unsliced.nonzeros()
         self.width = self.sliced.width()
         self.dvoxel = dvoxel
+        self.coarse_cache = None
+        self.derived = caches.LRUCache(max_bytes=cache_bytes)
         self.rectify(dvoxel)
 
     def json_parameters(self):
@@ -158,9 +306,9 @@ class TimeStampVolume:
         )
 
     def rectify(self, dvoxel):
+        "Make the cubic rotatable volume with voxels of size dvoxel (sampled straight from the source grid)."
         self.dvoxel = dvoxel
-        self.rectified = self.sliced.rectify(dvoxel)
-        self.rotatable = self.rectified.rotatable()
+        self.rotatable = self.derived.get_or_compute(("rotatable", dvoxel), lambda: self.sliced.rotatable(dvoxel))
         self.rotated = self.rotatable
         self.translated = self.rotatable
         self.speckled = self.rotatable
@@ -169,14 +317,22 @@ class TimeStampVolume:
         self.rotated = self.speckled.rotate(roll, pitch, yaw)
         self.translated = self.rotated.translate(txyz)
 
-    def combined(self, other):
-        return self.translated.combine_nonzeros(other.translated)
+    def combined(self, other, canvas=None):
+        return self.translated.combine_nonzeros(other.translated, canvas)
     
-    def speckle(self, ratio, stride=1):
-        self.speckled = self.rotatable.speckle(ratio, stride)
+    def speckle(self, ratio, stride=1, seed=0):
+        key = ("speckled", self.dvoxel, ratio, stride, seed)
+        self.speckled = self.derived.get_or_compute(key, lambda: self.rotatable.speckle(ratio, stride, seed))
         self.rotated = self.speckled
         self.translated = self.speckled
 
+    def coarse(self, factor):
+        "Preview resolution version of the speckled volume, cached until it is resampled."
+        cached = self.coarse_cache
+        if cached is None or cached[0] is not self.speckled or cached[1] != factor:
+            cached = self.coarse_cache = (self.speckled, factor, self.speckled.coarsen(factor))
+        return cached[2]
+
 class TimeStampPair:
 
 
@@ -194,20 +350,64 @@ class TimeStampPair:
 
     shadow_index_map = np.array([0,3,4,5,6,7,8], dtype=np.uint8)
 
-    def __init__(self, ts_volume1, ts_volume2, from_sequence, dvoxel):
+    def __init__(self, ts_volume1, ts_volume2, from_sequence, dvoxel, preview_factor=2, refine_delay=0.3):
+        """
+        While controls are being dragged, previews are rendered from volumes strided
+        by preview_factor; full resolution follows after refine_delay idle seconds.
+        """
         self.volume1 = from_sequence.get_volume(ts_volume1, dvoxel, marker=1)
         self.volume2 = from_sequence.get_volume(ts_volume2, dvoxel, marker=2)
         self.from_sequence = from_sequence
         self.dvoxel = dvoxel
         self.width = self.volume2.width
+        self.sampling = None
+        # alignment found by auto_align; the controls adjust relative to it.
+        self.initial = (0.0, 0.0, 0.0, (0.0, 0.0, 0.0))
+        (self.roll, self.pitch, self.yaw, self.translation) = self.initial
+        self.preview_factor = preview_factor
+        # combination buffers reused by every frame, sized for the translation slider range.
+        self.canvas = CombinationCanvas()
+        self.coarse_canvas = CombinationCanvas()
+        self.reserve_canvases()
+        # overlap metrics of the current transform, shown with the status message.
+        self.metrics_engine = None
+        self.metrics_lock = threading.Lock()
+        # (transform, metrics) most recently computed, reused while the transform is unchanged.
+        self.last_metrics = None
+        self.metrics = None
+        self.status = None
+        self.renderer = render_scheduler.ProgressiveScheduler(
+            self.compute_image, self.show_image, refine_delay=refine_delay)
+
+    def reserve_canvases(self, slider_steps=10):
+        """
+        Preallocate the combination canvases for translations within the slider range (from the start).
+        Once the display is live only the render worker touches the canvases (see compute_image).
+        """
+        volume1 = self.volume1.rotatable
+        volume2 = self.volume2.rotatable
+        dvoxel = volume1.dxdydz
+        self.canvas_start = self.initial[3]
+        reach = slider_steps * self.width * 0.01 + np.abs(np.array(self.canvas_start))
+        mins = np.minimum(volume1.minxyz(), volume2.minxyz() - reach)
+        maxes = np.maximum(volume1.maxxyz(), volume2.maxxyz() + reach)
+        shape = np.ceil((maxes - mins) / dvoxel).astype(np.int64) + 2
+        dtype = np.result_type(volume1.array.dtype, volume2.array.dtype)
+        self.canvas.reserve(shape, dtype)
+        self.coarse_canvas.reserve(-(-shape // self.preview_factor) + 1, dtype)
 
     async def link(self):
         dashboard = self.make_dashboard()
         await dashboard.link()
         self.sample_arrays()
+        # build the metrics engine once, before the first frame needs it.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.renderer.get_executor(), self.get_metrics_engine)
 
     def make_dashboard(self, width=700):
         """Basic graphic layout."""
+        # jp_doodle is only needed for the interactive display.
+        from jp_doodle import gz_aircraft_axes
         ratios = "1 0.5 0.1 0.05 0.02 0.01".split()
         strides = "1 2 3 4 5".split()
         self.select_ratio = gz.DropDownSelect(ratios, selected_value="0.05", on_click=self.dropdown_callback,)
@@ -219,6 +419,9 @@ class TimeStampPair:
         self.info_area = gz.Text("Overlayed segmentation")
         self.translation_area = gz.Text("translation: (0,0,0)")
         self.reset_button = gz.Button("Reset", on_click=self.reset_translations)
+        self.auto_button = gz.Button("Auto align", on_click=self.auto_align_click)
+        self.snap_button = gz.Button("Snap translation", on_click=self.snap_click)
+        self.moment_button = gz.Button("Principal axes", on_click=self.moment_click)
         self.rotations = gz_aircraft_axes.AircraftAxes(on_change=self.draw_image)
         self.rotations1 = gz_aircraft_axes.AircraftAxes(on_change=self.draw_image, )
         default_path = "alignment_%s_%s.json" % (
@@ -275,7 +478,7 @@ class TimeStampPair:
                     #self.z_slider,
                 ]
             ],
-            [self.reset_button, self.translation_area],
+            [self.reset_button, self.moment_button, self.auto_button, self.snap_button, self.translation_area],
             [self.path_input.label_container, self.save_button],
         ])
         dash.css({"background-color": "#ddd"})
@@ -294,14 +497,17 @@ class TimeStampPair:
         self.ratio = float(ratio_str)
         [stride_str] = self.select_stride.selected_values
         self.stride = int(stride_str)
-        self.sample_arrays()
+        # the render worker resamples before drawing.
         self.draw_image()
 
-    def sample_arrays(self, *ignored):
-        ratio = self.ratio
-        stride = self.stride
-        self.volume1.speckle(ratio, stride)
-        self.volume2.speckle(ratio, stride)
+    def sample_arrays(self, sampling=None):
+        if sampling is None:
+            sampling = (self.ratio, self.stride)
+        (ratio, stride) = sampling
+        # different seeds so the two volumes are not sampled at the same voxels.
+        self.volume1.speckle(ratio, stride, seed=1)
+        self.volume2.speckle(ratio, stride, seed=2)
+        self.sampling = sampling
 
     def draw_image(self, *ignored):
         """After gizmo is live, compute the image display."""
@@ -309,24 +515,206 @@ class TimeStampPair:
         roll = self.rotations.roll
         yaw = self.rotations.yaw
         pitch = self.rotations.pitch
-        roll1 = self.roll = self.rotations1.roll
-        yaw1 = self.yaw = self.rotations1.yaw
-        pitch1 = self.pitch = self.rotations1.pitch
-        dx = dwidth * self.x_slider.value
-        dy = - dwidth * self.y_slider.value
-        dz = dwidth * self.z_slider.value
+        (roll0, pitch0, yaw0, translation0) = self.initial
+        roll1 = self.roll = roll0 + self.rotations1.roll
+        yaw1 = self.yaw = yaw0 + self.rotations1.yaw
+        pitch1 = self.pitch = pitch0 + self.rotations1.pitch
+        dx = translation0[0] + dwidth * self.x_slider.value
+        dy = translation0[1] - dwidth * self.y_slider.value
+        dz = translation0[2] + dwidth * self.z_slider.value
         translation = (dx, dy, dz)
         self.translation = translation
         self.translation_area.text("translation: " + repr(translation))
-        self.volume2.transform(roll1, pitch1, yaw1, translation)
-        combined_volume = self.volume2.combined(self.volume1)
+        sampling = (self.ratio, self.stride)
+        self.renderer.request((roll, pitch, yaw, roll1, pitch1, yaw1, translation, sampling))
+
+    def compute_image(self, request):
+        "Transform, combine and project the full or preview volumes (in the render worker thread)."
+        (parameters, coarse) = request
+        (roll, pitch, yaw, roll1, pitch1, yaw1, translation, sampling) = parameters
+        if self.canvas_start != self.initial[3]:
+            # a new alignment moved the slider range.
+            self.reserve_canvases()
+        if sampling != self.sampling:
+            self.sample_arrays(sampling)
+        if coarse:
+            factor = self.preview_factor
+            coarse2 = self.volume2.coarse(factor).rotate(roll1, pitch1, yaw1).translate(translation)
+            combined_volume = coarse2.combine_nonzeros(self.volume1.coarse(factor), self.coarse_canvas)
+        else:
+            self.volume2.transform(roll1, pitch1, yaw1, translation)
+            combined_volume = self.volume2.combined(self.volume1, self.canvas)
         rotated = combined_volume.rotate(roll, pitch, yaw)
         shadowed = operations3d.shadow3d(rotated.array, self.shadow_index_map, axis=2)
         shadowed1 = operations3d.shadow3d(shadowed, self.shadow_index_map, axis=1)
         projected = operations3d.extrude0(shadowed1)
         #print("dtype", projected.dtype, projected.max(), projected.min(), projected.shape)
         colored = colorizers.colorize_array(projected, self.colors)
+        metrics = self.overlap_metrics(roll1, pitch1, yaw1, translation)
+        return (colored, metrics)
+
+    def show_image(self, result):
+        (colored, metrics) = result
         self.labels_display.change_array(colored)
+        self.metrics = metrics
+        self.show_info()
+
+    def get_metrics_engine(self):
+        "The registration.OverlapMetrics of the full volumes, built once by whichever thread asks first."
+        with self.metrics_lock:
+            if self.metrics_engine is None:
+                fixed = self.volume1.rotatable
+                moving = self.volume2.rotatable
+                self.metrics_engine = registration.OverlapMetrics(
+                    fixed.array, moving.array, self.dvoxel, fixed.corner000, moving.corner000)
+            return self.metrics_engine
+
+    def overlap_metrics(self, roll=None, pitch=None, yaw=None, translation=None):
+        """
+        Dice, IoU and surface distances of the full volumes for a transform of volume2 (default current).
+        The metrics of the last transform asked for are reused.
+        """
+        if roll is None:
+            (roll, pitch, yaw, translation) = (self.roll, self.pitch, self.yaw, self.translation)
+        transform = (roll, pitch, yaw, tuple(translation))
+        last = self.last_metrics
+        if last is not None and last[0] == transform:
+            return last[1]
+        metrics = self.get_metrics_engine()(roll, pitch, yaw, translation)
+        self.last_metrics = (transform, metrics)
+        return metrics
+
+    def set_status(self, message):
+        self.status = message
+        self.show_info()
+
+    def show_info(self):
+        "Show the status message and the overlap metrics in the info area."
+        parts = []
+        if self.status:
+            parts.append(self.status)
+        metrics = self.metrics
+        if metrics is not None:
+            parts.append("Dice %.3f, IoU %.3f, surface distance mean %.4g, 95%% %.4g" % (
+                metrics["dice"], metrics["iou"],
+                metrics["mean_surface_distance"], metrics["surface_distance_95"]))
+        self.info_area.text(" | ".join(parts))
+
+    def auto_align(self, from_moments=False, **options):
+        """
+        Search for the rotation and translation of volume2 that best overlaps volume1
+        (see find_alignment).  The result becomes the starting point of the interactive
+        controls.  Returns the json parameters.
+        """
+        self.use_alignment(self.find_alignment(from_moments, **options))
+        return self.json_parameters()
+
+    def find_alignment(self, from_moments=False, **options):
+        """
+        Search for the alignment of volume2 onto volume1 (see registration.RigidAlignment for
+        options, e.g. workers), starting from the principal axes alignment if from_moments is set.
+        Returns the found alignment without changing the controls.
+        """
+        fixed = self.volume1.rotatable
+        moving = self.volume2.rotatable
+        start = (0, 0, 0, 0, 0, 0)
+        if from_moments:
+            found = self.moment_estimate()
+            start = (found["roll"], found["pitch"], found["yaw"]) + tuple(found["translation"])
+        search = registration.RigidAlignment(
+            fixed.array, moving.array, self.dvoxel, fixed.corner000, moving.corner000, **options)
+        return search.search(start)
+
+    def moment_estimate(self, **options):
+        "Principal axes alignment of the volumes (see registration.moment_alignment)."
+        fixed = self.volume1.rotatable
+        moving = self.volume2.rotatable
+        return registration.moment_alignment(
+            fixed.array, moving.array, self.dvoxel, fixed.corner000, moving.corner000, **options)
+
+    def moment_align(self, **options):
+        "Start the controls from the principal axes alignment.  Returns the json parameters."
+        self.use_alignment(self.moment_estimate(**options))
+        return self.json_parameters()
+
+    def use_alignment(self, found):
+        "Make a found alignment the starting point of the controls."
+        translation = tuple(found["translation"])
+        self.initial = (found["roll"], found["pitch"], found["yaw"], translation)
+        (self.roll, self.pitch, self.yaw, self.translation) = self.initial
+        self.overlap = found["overlap"]
+
+    def snap_translation(self, factor=1, method="cross", max_shift=None):
+        """
+        Replace the translation by the one that best overlaps the volumes at the
+        current rotation (see find_translation).  Returns the translation.
+        """
+        translation = self.find_translation(self.roll, self.pitch, self.yaw, factor, method, max_shift)
+        self.use_translation(translation)
+        return translation
+
+    def find_translation(self, roll, pitch, yaw, factor=1, method="cross", max_shift=None):
+        """
+        The translation that best overlaps the volumes with volume2 at the given rotation,
+        from an FFT cross correlation (see registration.correlation_translation).
+        """
+        moving = self.volume2.rotatable.rotate(roll, pitch, yaw)
+        translation = self.volume1.rotatable.correlate_translation(moving, factor, method, max_shift)
+        return tuple(float(t) for t in translation)
+
+    def use_translation(self, translation):
+        "Make translation current, keeping the slider offsets relative to the start of the controls."
+        controls = np.array(self.translation) - np.array(self.initial[3])
+        self.initial = self.initial[:3] + (tuple((np.array(translation) - controls).tolist()),)
+        self.translation = translation
+
+    def run_in_background(self, message, work, done):
+        """
+        Run work() in the render worker thread (so it never overlaps a frame), then
+        done(result) on the event loop, reporting in the info area.  work only computes:
+        the pair is changed by done, on the event loop.
+        """
+        self.set_status(message)
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self.renderer.get_executor(), work)
+        def finish(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                self.set_status("Failed: " + repr(e))
+                raise
+            done(result)
+            self.draw_image()
+        future.add_done_callback(finish)
+
+    def show_alignment(self, label, found):
+        "Start the controls from found and report its overlap."
+        self.use_alignment(found)
+        self.set_status("%s: %d%% overlap" % (label, round(100 * self.overlap)))
+
+    def show_translation(self, translation):
+        self.use_translation(translation)
+        self.set_status("Translation snapped to " + repr(self.translation))
+
+    def auto_align_click(self, *ignored):
+        "Search for the alignment in the background and redraw from its result."
+        self.run_in_background(
+            "Searching for alignment...",
+            self.find_alignment,
+            lambda found: self.show_alignment("Aligned", found))
+
+    def moment_click(self, *ignored):
+        "Start the controls from the principal axes alignment and redraw."
+        self.run_in_background(
+            "Aligning principal axes...",
+            self.moment_estimate,
+            lambda found: self.show_alignment("Principal axes aligned", found))
+
+    def snap_click(self, *ignored):
+        "Snap the translation at the current rotation and redraw."
+        # the rotation is read here, on the event loop, not by the worker.
+        work = functools.partial(self.find_translation, self.roll, self.pitch, self.yaw)
+        self.run_in_background("Correlating volumes...", work, self.show_translation)
 
     def json_parameters(self):
         return dict(
@@ -337,10 +725,10 @@ class TimeStampPair:
             pitch = self.pitch,
             yaw = self.yaw,
             translation = list(self.translation),
+            metrics = self.overlap_metrics(),
         )
     
     def save_json(self, to_path):
-        import json
         ob = self.json_parameters()
         f = open(to_path, "w")
         json.dump(ob, f, indent=4)
@@ -349,5 +737,66 @@ class TimeStampPair:
     def save_click(self, *ignored):
         path = self.path_input.value
         self.save_json(path)
-        self.info_area.text("Parameters saved to: " + repr(path))
+        self.set_status("Parameters saved to: " + repr(path))
+
+def align_pair(from_sequence, ts_volume1, ts_volume2, dvoxel, to_path=None, **options):
+    """
+    Automatically align two timestamps of a sequence without the interactive display,
+    optionally saving the alignment json to to_path.  Returns the json parameters.
+    """
+    pair = TimeStampPair(ts_volume1, ts_volume2, from_sequence, dvoxel)
+    parameters = pair.auto_align(**options)
+    if to_path is not None:
+        pair.save_json(to_path)
+    return parameters
 
+def source_frame(array, dIJK, dvoxel):
+    """
+    (origin, spacing, center) placing the source voxels of array where TimeStampVolume
+    puts them: the center of voxel v (an index triple) lies at origin + v * spacing, and
+    the volume rotates about center.
+    """
+    slicing = operations3d.positive_slicing(array)
+    start = slicing[:, 0].astype(np.float64)
+    shape = (slicing[:, 1] - slicing[:, 0]).astype(np.float64)
+    # voxel sizes as Volume3D stores them.
+    dIJK = np.array(dIJK, dtype=np.float32).astype(np.float64)
+    corner = start * dIJK
+    if np.allclose(dIJK, dvoxel):
+        # copied into the rotation buffer: placement rounded to whole voxels.
+        N = math.ceil(np.sqrt((shape ** 2).sum()))
+        embedded = np.array([round(0.5 * (N - n)) for n in shape])
+        buffer_corner = corner + 0.5 * (shape - N) * dvoxel
+        origin = buffer_corner + (embedded + 0.5 - start) * dvoxel
+    else:
+        # sampled into the rotation buffer at the source voxel positions.
+        extent = shape * dIJK / dvoxel
+        N = math.ceil(np.sqrt((extent ** 2).sum()))
+        buffer_corner = corner + 0.5 * (extent - N) * dvoxel
+        origin = 0.5 * dIJK
+    center = buffer_corner + (0.5 * N + 0.5) * dvoxel
+    return (origin, dIJK, center)
+
+def alignment_affine(parameters, array1, array2):
+    """
+    4x4 matrix taking homogeneous (i, j, k, 1) voxel indices of array1 to the (continuous)
+    voxel indices of array2 that the saved alignment parameters (TimeStampPair.json_parameters)
+    place at the same position.  array1 and array2 are the volumes the alignment was made
+    from: their nonzero extents fix the frames.
+    """
+    def frame(volume, array):
+        return source_frame(array, volume["source_dimensions"], volume["dvoxel"])
+    (origin1, spacing1, _) = frame(parameters["volume1"], array1)
+    (origin2, spacing2, center2) = frame(parameters["volume2"], array2)
+    def affine(linear, offset):
+        result = np.eye(4)
+        result[:3, :3] = linear
+        result[:3, 3] = offset
+        return result
+    to_position = affine(np.diag(spacing1), origin1)
+    # undo the translation and the rotation of volume2 about its center
+    R = registration.volume_rotation_matrix(parameters["roll"], parameters["pitch"], parameters["yaw"])
+    translation = np.array(parameters["translation"], dtype=np.float64)
+    unmove = affine(R.T, center2 - R.T @ (center2 + translation))
+    to_index = affine(np.diag(1.0 / spacing2), -origin2 / spacing2)
+    return to_index @ unmove @ to_position
@@ -0,0 +1,150 @@
+"""
+Apply a saved alignment (TimeStampPair.save_json) to full resolution volumes.
+
+A volume on the grid of the moving timestamp (its labels, or an intensity
+image of the same shape) is resampled onto the grid of the fixed timestamp
+through the single affine of align_volumes.alignment_affine, which composes
+the rectification, rotation and translation of the alignment viewer.
+Labels are sampled from the nearest voxel, intensities linearly.
+
+The output is computed a tile at a time from just the block of the source
+that tile maps to, and can be written into a .npy file opened as a memory
+map.  Tiles are slabs of layers, split further along their longest side
+until the tile and its source block fit the memory budget, so peak memory
+stays within the budget however far the grids are rotated.  Sources in
+.npy files are memory mapped; volumes in .npz files cannot be, and are
+loaded whole.
+"""
+
+import json
+import numpy as np
+from scipy import ndimage
+from . import align_volumes
+from . import volume_colorizers
+
+def load_alignment(path):
+    "The alignment parameters saved by TimeStampPair.save_json."
+    with open(path) as f:
+        return json.load(f)
+
+def load_volume(path, key=None):
+    """
+    A .npy volume (memory mapped) or a volume from a .npz file (key defaults to the first array).
+    .npz volumes are loaded into memory whole.
+    """
+    if path.endswith(".npz"):
+        data = np.load(path)
+        if key is None:
+            key = data.files[0]
+        return data[key]
+    return np.load(path, mmap_mode="r")
+
+class AlignmentResampler:
+
+    def __init__(self, parameters, fixed_labels, moving_labels, memory_budget=256 * 2**20):
+        """
+        Resample volumes shaped like moving_labels onto the grid of fixed_labels following
+        saved alignment parameters.  fixed_labels and moving_labels must be the volumes the
+        alignment was made from: their nonzero extents fix where the alignment puts them.
+        """
+        self.affine = align_volumes.alignment_affine(parameters, fixed_labels, moving_labels)
+        self.shape = tuple(fixed_labels.shape)
+        self.source_shape = tuple(moving_labels.shape)
+        self.memory_budget = memory_budget
+
+    def tiles(self, itemsize):
+        """
+        Output boxes ((i1, i2), (j1, j2), (k1, k2)), in order, such that each box and the
+        source block it maps to together take at most memory_budget bytes (itemsize per voxel),
+        unless a single voxel already takes more.
+        """
+        depth = volume_colorizers.slab_depth(self.shape, self.memory_budget, 1, 2 * itemsize)
+        (D, J, K) = self.shape
+        pending = [((start, min(D, start + depth)), (0, J), (0, K)) for start in range(0, D, depth)]
+        pending.reverse()
+        tiles = []
+        while pending:
+            box = pending.pop()
+            sizes = [high - low for (low, high) in box]
+            if max(sizes) > 1 and self.tile_bytes(box, itemsize) > self.memory_budget:
+                # halve the longest side (rotations make the source block of a slab deep).
+                axis = int(np.argmax(sizes))
+                (low, high) = box[axis]
+                middle = (low + high) // 2
+                for part in ((middle, high), (low, middle)):
+                    pending.append(box[:axis] + (part,) + box[axis + 1:])
+            else:
+                tiles.append(box)
+        return tiles
+
+    def tile_bytes(self, box, itemsize):
+        "Memory to resample an output box: the box and its source block."
+        voxels = int(np.prod([high - low for (low, high) in box]))
+        block = self.source_block(box)
+        if block is not None:
+            voxels += int(np.prod(block[1] - block[0]))
+        return voxels * itemsize
+
+    def source_block(self, box):
+        "Source index (low, high) bounds needed for an output box, or None if it misses the source."
+        corners = np.array([(i, j, k)
+            for i in (box[0][0], box[0][1] - 1)
+            for j in (box[1][0], box[1][1] - 1)
+            for k in (box[2][0], box[2][1] - 1)])
+        mapped = corners @ self.affine[:3, :3].T + self.affine[:3, 3]
+        # one voxel margin so interpolation never sees the block edge inside the source.
+        low = np.maximum(np.floor(mapped.min(axis=0)).astype(np.int64) - 1, 0)
+        high = np.minimum(np.ceil(mapped.max(axis=0)).astype(np.int64) + 2, self.source_shape)
+        if np.any(high <= low):
+            return None
+        return (low, high)
+
+    def resample_tile(self, source, box, order):
+        "The output box resampled from the block of source it maps to."
+        shape = tuple(high - low for (low, high) in box)
+        block = self.source_block(box)
+        if block is None:
+            return np.zeros(shape, dtype=source.dtype)
+        (low, high) = block
+        array = np.asarray(source[low[0]:high[0], low[1]:high[1], low[2]:high[2]])
+        matrix = self.affine[:3, :3]
+        corner = np.array([first for (first, _) in box])
+        offset = matrix @ corner + self.affine[:3, 3] - low
+        return ndimage.affine_transform(
+            array, matrix, offset, output_shape=shape, order=order,
+            mode="constant", cval=0, prefilter=False)
+
+    def allocate(self, dtype, path=None):
+        "Output volume in memory, or memory mapped to a .npy file at path."
+        if path is None:
+            return np.empty(self.shape, dtype=dtype)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=self.shape)
+
+    def resample(self, source, labels=True, path=None, verbose=False):
+        """
+        Resample source (shaped like the moving labels, may be memory mapped) onto the fixed grid:
+        nearest voxel for labels, linear interpolation otherwise.  Returns the output volume.
+        """
+        assert tuple(source.shape) == self.source_shape, (
+            "source shape should match the moving labels: " + repr((source.shape, self.source_shape)))
+        dtype = source.dtype
+        out = self.allocate(dtype, path)
+        order = 0 if labels else 1
+        tiles = self.tiles(dtype.itemsize)
+        for (n, box) in enumerate(tiles):
+            out[tuple(slice(low, high) for (low, high) in box)] = self.resample_tile(source, box, order)
+            if verbose:
+                print("resampled tile", n + 1, "of", len(tiles), repr(box))
+        if path is not None:
+            out.flush()
+        return out
+
+def apply_alignment(alignment_path, fixed_labels, moving_labels, source=None, labels=True, to_path=None, **options):
+    """
+    Resample source (default moving_labels) onto the grid of fixed_labels with the alignment
+    saved at alignment_path, optionally into a .npy file at to_path.  Returns the output volume.
+    """
+    resampler = AlignmentResampler(load_alignment(alignment_path), fixed_labels, moving_labels, **options)
+    if source is None:
+        source = moving_labels
+    return resampler.resample(source, labels, to_path)
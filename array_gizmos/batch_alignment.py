@@ -0,0 +1,159 @@
+"""
+Headless batch alignment of many timestamp pairs of a VolumeSequence.
+
+Each pair is aligned with align_volumes.align_pair and saved to its own
+JSON file in the format of TimeStampPair.save_json.  Pairs run in a
+process pool (the sequence, including its get_volume_for_ts function, must
+then be picklable: use a module level function, not a lambda).  A rerun
+skips pairs whose output is newer than their input files.
+"""
+
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import align_volumes
+
+def consecutive_pairs(timestamps):
+    "[(t0, t1), (t1, t2), ...] for a list of timestamps."
+    timestamps = list(timestamps)
+    return list(zip(timestamps[:-1], timestamps[1:]))
+
+def output_path(directory, ts1, ts2):
+    "Path of the alignment file for a pair (same name the dashboard suggests)."
+    return os.path.join(directory, "alignment_%s_%s.json" % (ts1, ts2))
+
+def up_to_date(sequence, ts1, ts2, path):
+    """
+    True if the alignment file exists and is newer than both input files.
+    Without sequence.get_path_for_ts any existing output counts as up to date.
+    """
+    if not os.path.exists(path):
+        return False
+    saved = os.path.getmtime(path)
+    if sequence.get_path_for_ts is None:
+        return True
+    for ts in (ts1, ts2):
+        if os.path.getmtime(sequence.get_path_for_ts(ts)) >= saved:
+            return False
+    return True
+
+def limit_memory(max_bytes):
+    "Cap the address space of a worker process so an oversized pair fails instead of swapping."
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+def align_one(sequence, ts1, ts2, dvoxel, path, options):
+    "Align one pair and save it; returns the elapsed seconds (runs in a worker)."
+    start = time.time()
+    temporary = path + ".partial"
+    try:
+        align_volumes.align_pair(sequence, ts1, ts2, dvoxel, temporary, **options)
+        # an interrupted run never leaves a complete looking output behind.
+        os.replace(temporary, path)
+    finally:
+        # nor, when it fails, a partial file.
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return time.time() - start
+
+class BatchAligner:
+
+    def __init__(
+            self,
+            sequence,
+            dvoxel,
+            directory=".",
+            workers=4,
+            memory_per_worker=None,
+            force=False,
+            verbose=True,
+            **options):
+        """
+        Align pairs of sequence at cubic voxel size dvoxel, writing json files to directory.
+        memory_per_worker (bytes) caps each worker process.  force reruns up to date pairs.
+        Other options go to registration.RigidAlignment (each pair runs single process).
+        """
+        self.sequence = sequence
+        self.dvoxel = dvoxel
+        self.directory = directory
+        self.workers = workers
+        self.memory_per_worker = memory_per_worker
+        self.force = force
+        self.verbose = verbose
+        self.options = options
+
+    def report(self, done, total, record):
+        if not self.verbose:
+            return
+        (ts1, ts2) = record["pair"]
+        if record["status"] == "aligned":
+            detail = "aligned in %.1fs" % record["seconds"]
+        else:
+            detail = record["status"]
+        print("%d/%d pair %s-%s %s" % (done, total, ts1, ts2, detail))
+
+    def run(self, pairs):
+        """
+        Align the pairs, reporting progress.  Returns a list of records
+        dict(pair, path, status, seconds) in the order of pairs; status is
+        "aligned", "skipped" or "failed: ...".  Failed records also hold the
+        formatted traceback (from the worker process when there is a pool),
+        which is printed to stderr.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        pairs = list(pairs)
+        total = len(pairs)
+        records = []
+        todo = []
+        for (ts1, ts2) in pairs:
+            path = output_path(self.directory, ts1, ts2)
+            record = dict(pair=(ts1, ts2), path=path, status="skipped", seconds=0.0)
+            records.append(record)
+            if self.force or not up_to_date(self.sequence, ts1, ts2, path):
+                todo.append(record)
+        done = total - len(todo)
+        if self.verbose and done:
+            print("%d/%d pairs up to date" % (done, total))
+        def arguments(record):
+            (ts1, ts2) = record["pair"]
+            return (self.sequence, ts1, ts2, self.dvoxel, record["path"], self.options)
+        def finish(record, seconds=None, error=None):
+            if error is None:
+                record["status"] = "aligned"
+                record["seconds"] = seconds
+            else:
+                record["status"] = "failed: " + repr(error)
+                # a pool re-raises the worker's exception with its traceback as the cause.
+                record["traceback"] = "".join(traceback.format_exception(error))
+                print(record["traceback"], file=sys.stderr)
+            return record
+        if self.workers is None or self.workers <= 1:
+            for record in todo:
+                try:
+                    finish(record, align_one(*arguments(record)))
+                except Exception as e:
+                    finish(record, error=e)
+                done += 1
+                self.report(done, total, record)
+            return records
+        initializer = initargs = None
+        if self.memory_per_worker is not None:
+            (initializer, initargs) = (limit_memory, (self.memory_per_worker,))
+        with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=initializer, initargs=initargs or ()) as executor:
+            futures = {executor.submit(align_one, *arguments(record)): record for record in todo}
+            for future in as_completed(futures):
+                record = futures[future]
+                try:
+                    finish(record, future.result())
+                except Exception as e:
+                    finish(record, error=e)
+                done += 1
+                self.report(done, total, record)
+        return records
+
+def align_sequence(sequence, timestamps, dvoxel, directory=".", **options):
+    "Align every consecutive pair of timestamps (see BatchAligner for options)."
+    return BatchAligner(sequence, dvoxel, directory, **options).run(consecutive_pairs(timestamps))
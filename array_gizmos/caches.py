@@ -0,0 +1,82 @@
+"""
+Small in memory caches for rendered frames and derived arrays.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+def nbytes(value):
+    "Approximate memory held by a cached value (arrays, or tuples/lists/dicts of arrays)."
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return getattr(value, "nbytes", 0)
+
+class LRUCache:
+
+    """
+    Least recently used cache limited by number of entries and/or total bytes.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, size=nbytes):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = size
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key][0]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.discard(key)
+        size = self.size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # too big to ever fit: don't evict everything else for it.
+            return value
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        self.evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        "Cached value for key, computing and storing compute() on a miss."
+        entries = self.entries
+        if key in entries:
+            return self.get(key)
+        self.misses += 1
+        return self.put(key, compute())
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def evict(self):
+        entries = self.entries
+        while entries and (
+            (self.max_items is not None and len(entries) > self.max_items) or
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            (_, (_, size)) = entries.popitem(last=False)
+            self.total_bytes -= size
@@ -3,20 +3,42 @@ Helpers for colorizing array displays.
 """
 
 from . import color_list
+from . import caches
 import numpy as np
+import weakref
 from scipy import signal
 
-def speckle_background(colorImage, sourceImage):
+speckle_seed = 0
+speckle_grey = 128
+
+# bit packed speckle patterns keyed by (shape, ratio, seed), for the most recently used shapes.
+speckle_masks = caches.LRUCache(max_items=16, max_bytes=64 * 2**20)
+
+def speckle_mask(shape, ratio=0.5, seed=speckle_seed):
+    """
+    Deterministic boolean speckle pattern for an image shape.
+    The pattern is generated once and cached bit packed, so repeated redraws
+    of the same shape see the same speckles.
+    """
+    shape = tuple(shape)
+    key = (shape, ratio, seed)
+    packed = speckle_masks.get(key)
+    if packed is None:
+        rng = np.random.default_rng(seed)
+        packed = speckle_masks.put(key, np.packbits(rng.random(shape) < ratio))
+    size = int(np.prod(shape))
+    return np.unpackbits(packed, count=size).view(bool).reshape(shape)
+
+def speckle_background(colorImage, sourceImage, copy=True):
     """
     Add speckles to the background of a color image.
+    Use copy=False to modify a freshly computed colorImage in place.
     """
-    colorImage = colorImage.copy()
-    r = sourceImage.ravel()
-    rZeroIndices = np.where(r==0)[0]
-    choice = np.where(np.random.random(len(rZeroIndices)) > 0.5)
-    specIndices = rZeroIndices[choice]
-    cravel = colorImage.reshape([-1,3])
-    cravel[specIndices] = np.array([[128, 128, 128]])
+    if copy:
+        colorImage = colorImage.copy()
+    mask = speckle_mask(sourceImage.shape)
+    mask &= (sourceImage == 0)
+    colorImage[mask] = speckle_grey
     return colorImage
 
 def colorize_array(a, color_mapping_array=None):
@@ -130,6 +152,158 @@ def scaleN(img, epsilon=1e-11, minimum=None, to_max=10000.0, dtype=np.int):
     scaled = (to_max * (img - m)) / D
     return scaled.astype(dtype)
 
+class VolumeNormalizer:
+
+    """
+    Map slices of a volume to uint8 using intensity limits computed once for the whole volume,
+    so every slice (and every view of the volume) gets the same brightness scale.
+    Small integer types use a lookup table, other integers a fused integer multiply-shift,
+    and floats a single float32 multiply.
+    """
+
+    # fixed point bits for the integer multiply-shift: 255 << shift must fit in int64.
+    shift = 40
+    # the multiply-shift needs integral limits at least 1 apart and a span whose
+    # differences fit in int64; otherwise the float path is used.
+    max_integer_span = 2**31
+
+    def __init__(self, volume=None, minimum=None, maximum=None, slab=None, stride=None, epsilon=1e-11):
+        """
+        Limits come from minimum/maximum if given, otherwise from the volume:
+        exactly, streamed slab by slab along axis 0 (for memory mapped volumes),
+        or estimated from a strided subsample.
+        """
+        self.epsilon = epsilon
+        self.minimum = minimum
+        self.maximum = maximum
+        self.dtype = None
+        if volume is not None:
+            self.dtype = volume.dtype
+            if minimum is None or maximum is None:
+                if stride is not None:
+                    self.update(volume[::stride, ::stride, ::stride])
+                elif slab is not None:
+                    for start in range(0, volume.shape[0], slab):
+                        self.update(volume[start:start+slab])
+                else:
+                    self.update(volume)
+                if minimum is not None:
+                    self.minimum = minimum
+                if maximum is not None:
+                    self.maximum = maximum
+        self.prepare()
+
+    def update(self, chunk):
+        "Fold the limits of another chunk of the volume into the streamed statistics."
+        chunk = np.asarray(chunk)
+        if self.dtype is None:
+            self.dtype = chunk.dtype
+        m = chunk.min()
+        M = chunk.max()
+        if self.minimum is None or m < self.minimum:
+            self.minimum = m
+        if self.maximum is None or M > self.maximum:
+            self.maximum = M
+        self.prepare()
+
+    def prepare(self):
+        self.lut = None
+        self.multiplier = None
+        if self.minimum is None:
+            return
+        m = float(self.minimum)
+        D = max(float(self.maximum) - m, self.epsilon)
+        self.scale = 255.0 / D
+        dtype = self.dtype
+        if dtype is not None and np.issubdtype(dtype, np.integer):
+            if np.dtype(dtype).itemsize <= 2:
+                info = np.iinfo(dtype)
+                values = np.arange(info.min, info.max + 1, dtype=np.float64)
+                self.lut = np.clip((values - m) * self.scale, 0, 255).astype(np.ubyte)
+                self.lut_offset = info.min
+            elif self.integer_span(D):
+                # inputs are clipped to the limits, so (value - minimum) * multiplier <= 255 << shift.
+                self.multiplier = int(round(self.scale * (1 << self.shift)))
+
+    def integer_span(self, D):
+        "True if the limits suit the integer multiply-shift (see max_integer_span)."
+        integral = float(self.minimum).is_integer() and float(self.maximum).is_integer()
+        signed_range = np.dtype(self.dtype).kind == "i" or np.dtype(self.dtype).itemsize < 8
+        return integral and signed_range and 1 <= D <= self.max_integer_span
+
+    def limits(self):
+        return (self.minimum, self.maximum)
+
+    def __call__(self, img):
+        "Map an image (slice) to uint8 using the volume limits."
+        img = np.asarray(img)
+        if self.lut is not None and img.dtype == self.dtype:
+            if self.lut_offset:
+                return self.lut[img.astype(np.int32) - self.lut_offset]
+            return self.lut[img]
+        if self.multiplier is not None and img.dtype == self.dtype:
+            scaled = img.astype(np.int64)
+            np.clip(scaled, int(self.minimum), int(self.maximum), out=scaled)
+            scaled -= int(self.minimum)
+            scaled *= self.multiplier
+            scaled >>= self.shift
+            np.clip(scaled, 0, 255, out=scaled)
+            return scaled.astype(np.ubyte)
+        scaled = img.astype(np.float32)
+        scaled -= np.float32(self.minimum)
+        scaled *= np.float32(self.scale)
+        np.clip(scaled, 0, 255, out=scaled)
+        return scaled.astype(np.ubyte)
+
+# normalizers shared by all views of a volume, keyed by id(volume)
+shared_normalizers = {}
+
+def shared_normalizer(volume, **parameters):
+    "Get (or create) the VolumeNormalizer shared by all views of volume."
+    key = id(volume)
+    entry = shared_normalizers.get(key)
+    if entry is not None:
+        (ref, normalizer) = entry
+        if ref() is volume:
+            return normalizer
+    normalizer = VolumeNormalizer(volume, **parameters)
+    ref = weakref.ref(volume, lambda ref, key=key: shared_normalizers.pop(key, None))
+    shared_normalizers[key] = (ref, normalizer)
+    return normalizer
+
+class ScaledVolume:
+
+    """
+    uint8 version of an image volume shared by the views that slice it.
+    Volumes up to max_bytes voxels are normalized once, slab by slab; larger
+    volumes are normalized one slice at a time on demand, keeping recent
+    slices in an LRU cache of max_bytes.
+    """
+
+    def __init__(self, volume, normalizer=None, max_bytes=256 * 2**20, slab=16):
+        if normalizer is None:
+            normalizer = shared_normalizer(volume)
+        self.volume = volume
+        self.normalizer = normalizer
+        self.scaled = None
+        self.slices = None
+        if volume.size <= max_bytes:
+            self.scaled = np.empty(volume.shape, dtype=np.ubyte)
+            for start in range(0, volume.shape[0], slab):
+                self.scaled[start:start+slab] = normalizer(volume[start:start+slab])
+        else:
+            self.slices = caches.LRUCache(max_bytes=max_bytes)
+
+    def get_slice(self, axis, index):
+        "The uint8 slice of the volume at index along axis (do not modify it)."
+        selection = [slice(None)] * self.volume.ndim
+        selection[axis] = index
+        selection = tuple(selection)
+        if self.scaled is not None:
+            return self.scaled[selection]
+        return self.slices.get_or_compute(
+            (axis, index), lambda: self.normalizer(self.volume[selection]))
+
 edge_array = np.array([
     [1,1,1],
     [1,-8,1],
@@ -176,15 +350,81 @@ def center_shapes(A1, A2):
 
 
 def overlay_color(img, mask, color, center=False):
+    "Overlay a single mask with color on a copy of img."
+    return overlay(img, [(mask, color)], center=center, copy=True)
+
+def overlay(img, layers, center=False, copy=False):
+    """
+    Paint a sequence of (selector, color) highlight layers onto an rgb image in place.
+    A selector is either a 2d boolean (or 0/1) mask or a 1d array of flat pixel indices.
+    A color is an rgb triple, an (n, 3) array of colors for the n selected pixels,
+    or an rgb image of the same shape as img.
+    Later layers paint over earlier ones.  A grey img is converted to a new rgb array.
+    With center=True img and masks of mismatched shapes are embedded in larger centered
+    arrays (which allocates only when the shapes actually differ).
+    """
     img = to_rgb(img, scaled=False)
-    if center:
-        (img, mask) = center_shapes(img, mask)
-        if hasattr(color, "shape"):
+    if copy or not img.flags.c_contiguous:
+        img = np.array(img)
+    for (selector, color) in layers:
+        selector = np.asarray(selector)
+        if hasattr(color, "shape") and color.ndim == 3 and center:
             (img, color) = center_shapes(img, color)
-    mask3 = np.zeros(mask.shape + (3,), dtype=np.ubyte)
-    mask3[:] = mask.reshape(mask.shape + (1,))
-    result = np.choose(mask3, [img, color])
-    return result
+        if selector.ndim == 2:
+            if center:
+                (img, selector) = center_shapes(img, selector)
+            assert selector.shape == img.shape[:2], "mask doesn't match img: " + repr([selector.shape, img.shape])
+            selector = selector.astype(bool, copy=False)
+            target = img
+        else:
+            target = img.reshape((-1, 3))
+        if hasattr(color, "shape") and color.ndim == 3:
+            assert color.shape == img.shape, "color shape doesn't match img: " + repr([color.shape, img.shape])
+            if selector.ndim == 2:
+                color = color[selector]
+            else:
+                color = color.reshape((-1, 3))[selector]
+        target[selector] = color
+    return img
+
+def label_overlay_layer(labels, label_colors):
+    """
+    Overlay layer (flat_indices, colors) coloring the pixels of several labels at once.
+    label_colors maps non-negative label -> rgb.  Uses one lookup pass over labels.
+    """
+    keys = np.array(sorted(label_colors.keys()), dtype=np.intp)
+    flat_labels = np.asarray(labels).ravel()
+    if len(keys) == 0:
+        return (np.zeros((0,), dtype=np.intp), np.zeros((0, 3), dtype=np.ubyte))
+    palette = np.zeros((len(keys) + 1, 3), dtype=np.ubyte)
+    palette[1:] = [label_colors[k] for k in keys]
+    # the extra final entry catches (clipped) labels larger than any key.
+    lookup = np.zeros((keys.max() + 2,), dtype=np.intp)
+    lookup[keys] = np.arange(1, len(keys) + 1)
+    which = np.take(lookup, flat_labels, mode="clip")
+    indices = np.flatnonzero(which)
+    return (indices, palette[which[indices]])
+
+def selected_boundaries(labels, selected):
+    """
+    Boundaries of several selected labels in one pass.
+    Returns an array like labels holding the adjacent selected label at pixels where the
+    3x3 neighborhood mixes a selected label with anything else, and 0 elsewhere.
+    """
+    labels = np.asarray(labels)
+    chosen = np.where(np.isin(labels, list(selected)), labels, 0)
+    padded = np.pad(chosen, 1, mode="edge")
+    (I, J) = chosen.shape
+    edge = np.zeros(chosen.shape, dtype=bool)
+    neighbor_max = chosen.copy()
+    for di in (0, 1, 2):
+        for dj in (0, 1, 2):
+            if di == 1 and dj == 1:
+                continue
+            neighbor = padded[di:di+I, dj:dj+J]
+            edge |= (neighbor != chosen)
+            np.maximum(neighbor_max, neighbor, out=neighbor_max)
+    return np.where(edge, neighbor_max, 0)
 
 def overlay_color_delete(img, mask, color, center=False):
     img = to_rgb(img, scaled=False)
@@ -224,6 +464,74 @@ def overlay_color_delete(img, mask, color, center=False):
     result = np.choose(mask3, [img, color])
     return result
 
+class FixedPointBlender:
+
+    """
+    Alpha blend uint8 label colors with a uint8 image using integer fixed point weights.
+    Output and scratch buffers are reused between calls with the same shape,
+    so the returned array is overwritten by the next blend.
+    """
+
+    bits = 8
+
+    def __init__(self):
+        self.shape = None
+        self.out = None
+        self.accumulator = None
+        self.scratch = None
+
+    def weights(self, lamda):
+        "Integer weights (for colors, for image) summing to 1 << bits."
+        one = 1 << self.bits
+        w = min(max(int(round(lamda * one)), 0), one)
+        return (w, one - w)
+
+    def buffers(self, shape):
+        if shape != self.shape:
+            self.out = np.empty(shape, dtype=np.ubyte)
+            self.accumulator = np.empty(shape, dtype=np.uint16)
+            self.scratch = np.empty(shape, dtype=np.uint16)
+            self.shape = shape
+        return (self.out, self.accumulator, self.scratch)
+
+    def blend(self, colors, image, lamda, mask=None):
+        """
+        Compute lamda * colors + (1 - lamda) * image as uint8.
+        colors should be (rows, cols, 3) uint8 and image uint8 of the same shape or grey (rows, cols).
+        If mask (rows, cols) is given, colors are assumed black outside the mask
+        and only the masked pixels are blended.
+        """
+        assert colors.dtype == np.ubyte, "colors should be uint8: " + repr(colors.dtype)
+        assert image.dtype == np.ubyte, "image should be uint8: " + repr(image.dtype)
+        if image.ndim == colors.ndim - 1:
+            image = image[..., np.newaxis]
+        assert image.shape[:2] == colors.shape[:2], "shapes don't match: " + repr([colors.shape, image.shape])
+        bits = self.bits
+        half = 1 << (bits - 1)
+        (wc, wi) = self.weights(lamda)
+        (out, accumulator, scratch) = self.buffers(colors.shape)
+        if mask is None:
+            np.multiply(colors, np.uint16(wc), out=accumulator)
+            np.multiply(image, np.uint16(wi), out=scratch)
+            accumulator += scratch
+            accumulator += half
+            accumulator >>= bits
+            np.copyto(out, accumulator, casting="unsafe")
+            return out
+        # unmasked pixels only see the weighted image.
+        image_lut = ((np.arange(256, dtype=np.uint16) * wi + half) >> bits).astype(np.ubyte)
+        out[...] = image_lut[image]
+        mask = np.asarray(mask, dtype=bool)
+        c = colors[mask].astype(np.uint16)
+        i = image[mask].astype(np.uint16)
+        c *= wc
+        i *= wi
+        c += i
+        c += half
+        c >>= bits
+        out[mask] = c
+        return out
+
 def to_rgb(arr, scaled=True):
     "Make into a 3 color array if needed and rescale if requested."
     s = arr.shape
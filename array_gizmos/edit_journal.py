@@ -0,0 +1,273 @@
+"""
+Undo/redo journal for edits to label volumes.
+
+Each edit is stored as a compact sparse diff instead of a snapshot of the
+volume: painted boxes keep their previous values run length encoded, and
+scattered edits keep flat indices with old and new values.  The journal
+can replay its edits onto a saved base volume, which makes cheap autosave
+of edit sessions possible.
+"""
+
+import numpy as np
+
+def rle_encode(values):
+    "Run length encode a 1d array as (run values, run lengths)."
+    values = np.asarray(values).ravel()
+    if len(values) == 0:
+        return (values.copy(), np.zeros((0,), dtype=np.int64))
+    starts = np.concatenate([[0], np.flatnonzero(values[1:] != values[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [len(values)]]))
+    return (values[starts], lengths)
+
+def rle_decode(runs, lengths):
+    return np.repeat(runs, lengths)
+
+def volume_index(volume, flat_indices):
+    """
+    Index tuple reaching the C order flat_indices of volume through its own strides,
+    so writes land in volume in place even when it is not contiguous.
+    """
+    return np.unravel_index(flat_indices, volume.shape)
+
+def smallest_index_dtype(size):
+    if size < 2**31:
+        return np.int32
+    return np.int64
+
+class Edit:
+
+    """
+    One reversible change to a volume: either a box set to a single value
+    (old values run length encoded) or values written at flat indices.
+    """
+
+    def __init__(self, box=None, indices=None, old=None, new=None):
+        self.box = box
+        self.indices = indices
+        self.old = old
+        self.new = new
+
+    def slices(self):
+        return tuple(slice(low, high) for (low, high) in self.box)
+
+    def bounds(self, shape):
+        "((low, high), ...) bounding box of the edit, for incremental redraws."
+        if self.box is not None:
+            return self.box
+        ijk = np.unravel_index(self.indices, shape)
+        return tuple((int(c.min()), int(c.max()) + 1) for c in ijk)
+
+    def nbytes(self):
+        total = 0
+        for part in (self.indices, self.new) + tuple(self.old):
+            total += getattr(part, "nbytes", 0)
+        return total + 64
+
+    def changes(self, shape):
+        "(flat indices, old values, new values) arrays of the edit over a volume of shape."
+        if self.box is not None:
+            ijk = np.meshgrid(*[np.arange(low, high) for (low, high) in self.box], indexing="ij")
+            indices = np.ravel_multi_index(tuple(ijk), shape).ravel()
+        else:
+            indices = np.asarray(self.indices).ravel()
+        old = rle_decode(*self.old)
+        new = np.broadcast_to(np.asarray(self.new, dtype=old.dtype), indices.shape)
+        return (indices, old, new)
+
+    def apply(self, volume):
+        if self.box is not None:
+            volume[self.slices()] = self.new
+        else:
+            volume[volume_index(volume, self.indices)] = self.new
+
+    def revert(self, volume):
+        if self.box is not None:
+            region = volume[self.slices()]
+            region[...] = rle_decode(*self.old).reshape(region.shape)
+        else:
+            volume[volume_index(volume, self.indices)] = rle_decode(*self.old)
+
+class EditJournal:
+
+    def __init__(self, volume, max_bytes=64 * 2**20):
+        """
+        Journal edits of volume (modified in place, any memory layout: flat
+        indices are C order over volume.shape).
+        When the history exceeds max_bytes the oldest edits are forgotten.
+        """
+        self.volume = volume
+        self.max_bytes = max_bytes
+        self.done = []
+        self.undone = []
+        self.total_bytes = 0
+        # number of forgotten edits: replay needs a base that already includes them.
+        self.forgotten = 0
+        # edit count (including forgotten edits) at begin_group, or None outside a group.
+        self.group_start = None
+
+    def paint_box(self, box, value):
+        """
+        Set volume[box] = value, where box is ((i1, i2), (j1, j2), (k1, k2)), and record it.
+        Returns the edit (None if nothing changed).
+        """
+        box = tuple((int(low), int(high)) for (low, high) in box)
+        edit = Edit(box=box)
+        region = self.volume[edit.slices()]
+        if region.size == 0 or np.all(region == value):
+            return None
+        edit.old = rle_encode(region)
+        edit.new = self.volume.dtype.type(value)
+        return self.record(edit)
+
+    def paint_indices(self, flat_indices, values):
+        """
+        Set volume.flat[flat_indices] = values and record it.  Indices that
+        would not change are dropped from the diff.  Returns the edit (None if nothing changed).
+        """
+        indices = np.asarray(flat_indices).ravel()
+        values = np.broadcast_to(np.asarray(values, dtype=self.volume.dtype), indices.shape)
+        # keep the last value written to each index
+        (indices, last) = np.unique(indices[::-1], return_index=True)
+        values = values[::-1][last]
+        old = self.volume[volume_index(self.volume, indices)]
+        changed = (old != values)
+        if not np.any(changed):
+            return None
+        new = values[changed]
+        if np.all(new == new[0]):
+            new = new[0]
+        edit = Edit(
+            indices=indices[changed].astype(smallest_index_dtype(self.volume.size)),
+            old=rle_encode(old[changed]),
+            new=new)
+        return self.record(edit)
+
+    def record(self, edit):
+        edit.apply(self.volume)
+        self.done.append(edit)
+        self.total_bytes += edit.nbytes()
+        # a new edit invalidates the redo history.
+        for undone in self.undone:
+            self.total_bytes -= undone.nbytes()
+        self.undone = []
+        self.limit()
+        return edit
+
+    def begin_group(self):
+        "Start collecting the following edits into a single edit, closed by end_group."
+        self.group_start = len(self.done) + self.forgotten
+
+    def end_group(self):
+        """
+        Replace the edits made since begin_group by one sparse edit of the voxels they
+        changed, so that they undo and redo together.  Returns that edit (None if nothing changed).
+        """
+        if self.group_start is None:
+            return None
+        start = min(max(self.group_start - self.forgotten, 0), len(self.done))
+        self.group_start = None
+        edits = self.done[start:]
+        if len(edits) < 2:
+            return edits[0] if edits else None
+        changes = [edit.changes(self.volume.shape) for edit in edits]
+        (indices, old, new) = [np.concatenate(parts) for parts in zip(*changes)]
+        # the first recorded old value and the last written new value of each index.
+        (first_indices, first) = np.unique(indices, return_index=True)
+        (_, last) = np.unique(indices[::-1], return_index=True)
+        old = old[first]
+        new = new[::-1][last]
+        changed = (old != new)
+        for edit in edits:
+            self.total_bytes -= edit.nbytes()
+        del self.done[start:]
+        if not np.any(changed):
+            return None
+        new = new[changed]
+        if np.all(new == new[0]):
+            new = new[0]
+        merged = Edit(
+            indices=first_indices[changed].astype(smallest_index_dtype(self.volume.size)),
+            old=rle_encode(old[changed]),
+            new=new)
+        self.done.append(merged)
+        self.total_bytes += merged.nbytes()
+        self.limit()
+        return merged
+
+    def limit(self):
+        while self.total_bytes > self.max_bytes and len(self.done) > 1:
+            oldest = self.done.pop(0)
+            self.total_bytes -= oldest.nbytes()
+            self.forgotten += 1
+
+    def can_undo(self):
+        return len(self.done) > 0
+
+    def can_redo(self):
+        return len(self.undone) > 0
+
+    def undo(self):
+        "Revert the last edit; return it (for its bounds) or None if there is nothing to undo."
+        if not self.done:
+            return None
+        edit = self.done.pop()
+        edit.revert(self.volume)
+        self.undone.append(edit)
+        return edit
+
+    def redo(self):
+        "Reapply the last undone edit; return it or None if there is nothing to redo."
+        if not self.undone:
+            return None
+        edit = self.undone.pop()
+        edit.apply(self.volume)
+        self.done.append(edit)
+        return edit
+
+    def replay(self, base):
+        "Apply the (not undone) edits in order to base, a copy of the volume as of the oldest kept edit."
+        assert base.shape == self.volume.shape, "base shape mismatch: " + repr([base.shape, self.volume.shape])
+        for edit in self.done:
+            edit.apply(base)
+        return base
+
+    def save(self, path):
+        "Save the done edits to an npz file (for autosave), to be replayed with load_edits."
+        arrays = dict(
+            shape=np.array(self.volume.shape),
+            forgotten=np.array(self.forgotten),
+            count=np.array(len(self.done)),
+        )
+        for (n, edit) in enumerate(self.done):
+            prefix = "e%d_" % n
+            if edit.box is not None:
+                arrays[prefix + "box"] = np.array(edit.box)
+            else:
+                arrays[prefix + "indices"] = edit.indices
+            arrays[prefix + "new"] = np.asarray(edit.new)
+            arrays[prefix + "old_runs"] = edit.old[0]
+            arrays[prefix + "old_lengths"] = edit.old[1]
+        np.savez_compressed(path, **arrays)
+
+def load_edits(path):
+    "Read the edits saved by EditJournal.save as a list of Edit objects."
+    data = np.load(path)
+    edits = []
+    for n in range(int(data["count"])):
+        prefix = "e%d_" % n
+        old = (data[prefix + "old_runs"], data[prefix + "old_lengths"])
+        new = data[prefix + "new"]
+        if new.ndim == 0:
+            new = new[()]
+        if prefix + "box" in data:
+            box = tuple(tuple(int(x) for x in pair) for pair in data[prefix + "box"])
+            edits.append(Edit(box=box, old=old, new=new))
+        else:
+            edits.append(Edit(indices=data[prefix + "indices"], old=old, new=new))
+    return edits
+
+def replay_edits(base, path):
+    "Apply the edits saved at path to the base volume in place."
+    for edit in load_edits(path):
+        edit.apply(base)
+    return base
@@ -0,0 +1,125 @@
+"""
+Overlaps between the labels of two label volumes, e.g. of consecutive
+timestamps for lineage tracking.
+
+The contingency table counts the voxels labelled a in the first volume and
+b in the second for every pair (a, b).  Each pair is encoded as the single
+integer key a * (max label of second + 1) + b, so the table is built without
+looping over labels: by bincount when the keys fit in max_bins, otherwise by
+sorting (unique) chunk by chunk and merging the chunk tables.  The second
+volume can first be resampled through a saved alignment.
+"""
+
+import numpy as np
+from scipy import sparse
+from . import align_volumes
+
+def merge_counts(keys, counts):
+    "Sum the counts of equal keys: (unique keys, totals)."
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return (keys.astype(np.int64), np.zeros((0,), dtype=np.int64))
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+    return (keys[starts], np.add.reduceat(np.asarray(counts, dtype=np.int64)[order], starts))
+
+class PairCounter:
+
+    """
+    Accumulates contingency counts of label pairs (first, second) given in chunks.
+    Labels must be non negative integers at most max1 and max2.
+    """
+
+    def __init__(self, max1, max2, include_zero=False, max_bins=2**24):
+        self.width = int(max2) + 1
+        nkeys = (int(max1) + 1) * self.width
+        assert nkeys < 2**63, "labels too large to encode pairs: " + repr((max1, max2))
+        self.include_zero = include_zero
+        self.totals = None
+        if nkeys <= max_bins:
+            self.totals = np.zeros((nkeys,), dtype=np.int64)
+        self.keys = []
+        self.counts = []
+
+    def add(self, first, second):
+        first = np.asarray(first).ravel()
+        second = np.asarray(second).ravel()
+        if not self.include_zero:
+            both = (first != 0) & (second != 0)
+            first = first[both]
+            second = second[both]
+        keys = first.astype(np.int64) * self.width + second
+        if self.totals is not None:
+            self.totals += np.bincount(keys, minlength=len(self.totals))
+        else:
+            (keys, counts) = np.unique(keys, return_counts=True)
+            self.keys.append(keys)
+            self.counts.append(counts)
+
+    def table(self):
+        "(first labels, second labels, counts) of the pairs seen, sorted by pair."
+        if self.totals is not None:
+            keys = np.flatnonzero(self.totals)
+            counts = self.totals[keys]
+        else:
+            (keys, counts) = merge_counts(
+                np.concatenate([np.zeros((0,), dtype=np.int64)] + self.keys),
+                np.concatenate([np.zeros((0,), dtype=np.int64)] + self.counts))
+        return (keys // self.width, keys % self.width, counts)
+
+def contingency(labels1, labels2, include_zero=False, chunk_size=2**24, max_bins=2**24):
+    """
+    Sparse label overlap table of two label volumes of the same shape:
+    (first, second, counts) arrays with one entry per pair of labels sharing voxels,
+    sorted by pair.  Pairs involving background (0) are left out unless include_zero.
+    The volumes are processed chunk_size voxels at a time.
+    """
+    assert labels1.shape == labels2.shape, "shapes differ: " + repr((labels1.shape, labels2.shape))
+    counter = PairCounter(labels1.max(), labels2.max(), include_zero, max_bins)
+    flat1 = labels1.reshape(-1)
+    flat2 = labels2.reshape(-1)
+    for start in range(0, flat1.size, chunk_size):
+        counter.add(flat1[start:start + chunk_size], flat2[start:start + chunk_size])
+    return counter.table()
+
+def aligned_contingency(labels1, labels2, parameters, include_zero=False, chunk_size=2**24, max_bins=2**24):
+    """
+    Like contingency, after moving labels2 onto labels1 with saved alignment parameters
+    (as written by TimeStampPair.save_json; see align_volumes.alignment_affine).  Counts are
+    over the voxels of labels1, each paired with the nearest voxel of labels2 (0 outside it).
+    """
+    affine = align_volumes.alignment_affine(parameters, labels1, labels2).astype(np.float32)
+    counter = PairCounter(labels1.max(), labels2.max(), include_zero, max_bins)
+    (I, J, K) = labels1.shape
+    bounds = labels2.shape
+    strides = (bounds[1] * bounds[2], bounds[2], 1)
+    flat2 = labels2.reshape(-1)
+    index_dtype = np.int32 if flat2.size < 2**31 else np.int64
+    # the affine is separable: a (J, K) plane of offsets per axis, plus a multiple of i.
+    (j, k) = np.ogrid[0:J, 0:K]
+    planes = [j * affine[axis, 1] + k * affine[axis, 2] + affine[axis, 3] for axis in range(3)]
+    slab = max(1, chunk_size // max(1, J * K))
+    for i0 in range(0, I, slab):
+        i = np.arange(i0, min(I, i0 + slab), dtype=np.float32)[:, None, None]
+        inside = np.ones((len(i), J, K), dtype=bool)
+        flat = np.zeros((len(i), J, K), dtype=index_dtype)
+        for axis in range(3):
+            position = planes[axis] + i * affine[axis, 0]
+            np.rint(position, out=position)
+            index = position.astype(index_dtype)
+            inside &= (index >= 0)
+            inside &= (index < bounds[axis])
+            index *= strides[axis]
+            flat += index
+        flat[~inside] = 0
+        second = flat2[flat]
+        second[~inside] = 0
+        counter.add(labels1[i0:i0 + slab], second)
+    return counter.table()
+
+def contingency_matrix(first, second, counts, shape=None):
+    "The table as a scipy.sparse CSR matrix indexed by [label1, label2]."
+    if shape is None:
+        shape = (int(first.max(initial=0)) + 1, int(second.max(initial=0)) + 1)
+    return sparse.csr_matrix((counts, (first, second)), shape=shape)
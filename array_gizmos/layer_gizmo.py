@@ -1,5 +1,8 @@
 from . import colorizers
 from . import operations3d
+from . import volume_colorizers
+from . import caches
+from . import render_scheduler
 import numpy as np
 from H5Gizmos import Stack, Slider, Image, CheckBoxes, Text, DropDownSelect
 
@@ -31,14 +34,56 @@ class ImageViewer:
             assert self.min >= 0 and self.max <= 255, "color intensities should be in range 0..255"
             self.colors = True
         (self.depth, self.width, self.height) = shape[:3]
+        self.precolorized = None
+        # projection caches are computed the first time a projection mode is used.
+        self.suffix_max = None
+        self.last_hits = None
+        self.frames = caches.LRUCache(max_items=64, max_bytes=256 * 2**20)
+        self.renderer = render_scheduler.RenderScheduler(self.compute_frame, self.show_frame)
+
+    def precolorize(self, path=None, memory_budget=256 * 2**20, workers=4):
+        """
+        Colorize all layers of a colorizable volume ahead of time
+        (memory mapped to a .npy file at path if given) so unprojected layer changes are slice lookups.
+        """
+        assert self.colorizable, "only integer label volumes can be precolorized."
+        colorizer = volume_colorizers.VolumeColorizer(
+            self.display_array,
+            speckle=speckle,
+            memory_budget=memory_budget,
+            workers=workers,
+        )
+        self.precolorized = colorizer.colorize(path)
+        return self.precolorized
 
     def get_image(self, layer, projection=None, colorize=False):
+        "Rendered frame for the parameters, from the frame cache if possible (don't modify it)."
+        if colorize and projection in (None, "none") and self.precolorized is not None:
+            return self.precolorized[layer]
+        key = (layer, projection, colorize)
+        return self.frames.get_or_compute(key, lambda: self.render_image(layer, projection, colorize))
+
+    def max_projection(self, layer):
+        "array3d[layer:].max(axis=0) by lookup in the precomputed suffix maxima."
+        if self.suffix_max is None:
+            self.suffix_max = operations3d.suffix_max(self.display_array)
+        return self.suffix_max[layer]
+
+    def extruded_projection(self, layer):
+        "operations3d.extrude0(array3d[layer:]) by lookup in the last nonzero hits."
+        array3d = self.display_array
+        if self.last_hits is None:
+            self.last_hits = operations3d.last_hits(array3d)
+        (index, value) = self.last_hits
+        return np.where(index >= layer, value, array3d[layer])
+
+    def render_image(self, layer, projection=None, colorize=False):
         array3d = self.display_array
         result = layer0 = array3d[layer]
         if projection == "max_value":
-            result = layer0 = array3d[layer:].max(axis=0)
+            result = layer0 = self.max_projection(layer)
         if projection == "extruded":
-            result = layer0 = operations3d.extrude0(array3d[layer:])
+            result = layer0 = self.extruded_projection(layer)
         if self.colors:
             if self.max <= 1.0:
                 # scale the colors
@@ -48,7 +93,7 @@ class ImageViewer:
                 #print("colorizing", layer0.shape)
                 cresult = colorizers.colorize_array(result)
                 if speckle:
-                    cresult = colorizers.speckle_background(cresult, result)
+                    cresult = colorizers.speckle_background(cresult, result, copy=False)
                 result = cresult
         return result
 
@@ -109,5 +154,12 @@ class ImageViewer:
             if self.colorize_checkbox.selected_values:
                 colorize = True
                 scale = False
-        image = self.get_image(layer, projection, colorize)
+        self.renderer.request((layer, projection, colorize, scale))
+
+    def compute_frame(self, parameters):
+        (layer, projection, colorize, scale) = parameters
+        return (self.get_image(layer, projection, colorize), scale)
+
+    def show_frame(self, frame):
+        (image, scale) = frame
         self.image_display.change_array(image, scale=scale, url=False)
@@ -107,15 +107,19 @@ def rectify(array, dI, dJ, dK, dside):
     return resample(array, new_shape)
 
 
-def speckle(array, speckle_ratio=0.03):
+def speckle(array, speckle_ratio=0.03, seed=None):
     """
-    Randomly select speckled subset of array nonzero elements.
+    Randomly select speckled subset of array nonzero elements
+    (reproducibly if seed is given).
     """
     if speckle_ratio == 1:
         return array.copy()
     assert speckle_ratio > 0 and speckle_ratio < 1, \
         "bad speckle ratio: " + repr(speckle_ratio)
-    r = np.random.random(array.shape)
+    if seed is None:
+        r = np.random.random(array.shape)
+    else:
+        r = np.random.default_rng(seed).random(array.shape)
     filter = (r < speckle_ratio)
     return np.where(filter, array, 0)
 
@@ -264,6 +268,26 @@ def extrude0(labels_array):
         #volume[i] = extruded
     return extruded
 
+def last_hits(labels_array):
+    """
+    For each position in the plane, the axis 0 index and value of the last positive entry
+    (index -1 and value 0 where there is none).
+    extrude0(labels_array[i:]) equals where(index >= i, value, labels_array[i])
+    for non-negative labels, so every suffix extrusion is a 2d lookup.
+    """
+    nz = (labels_array > 0)
+    I = labels_array.shape[0]
+    hit = nz.any(axis=0)
+    index = (I - 1) - np.argmax(nz[::-1], axis=0)
+    index[~hit] = -1
+    value = np.take_along_axis(labels_array, np.maximum(index, 0)[np.newaxis], axis=0)[0]
+    value[~hit] = 0
+    return (index, value)
+
+def suffix_max(array):
+    "suffix_max(array)[i] == array[i:].max(axis=0) for every i, in one pass."
+    return np.maximum.accumulate(array[::-1], axis=0)[::-1]
+
 def rotate3d(array, theta, phi, gamma=0):
     "Generalized rotation: rotate by theta in KJ and phi in IK."
     R1 = rotateKJ(array, theta) # KJ rotation
@@ -271,6 +295,19 @@ def rotate3d(array, theta, phi, gamma=0):
     R3 = rotateABC(R2, gamma, 1, 2, 0)  # IK rotation
     return R3
 
+def rotate3d_matrix(theta, phi, gamma=0):
+    """
+    3x3 matrix of the rotation done (approximately, by shearing) by rotate3d,
+    acting on index offsets (i, j, k) from the array center.
+    """
+    (c, s) = (np.cos(theta), np.sin(theta))
+    T = np.array([[1, 0, 0], [0, c, -s], [0, s, c]])  # KJ rotation
+    (c, s) = (np.cos(phi), np.sin(phi))
+    P = np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])  # IK rotation
+    (c, s) = (np.cos(gamma), np.sin(gamma))
+    G = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])  # IJ rotation
+    return G @ P @ T
+
 def rotation_buffer(arr3d):
     "Embed array in another array large enough to support rotations."
     (I, J, K) = arr3d.shape[:3]
@@ -0,0 +1,479 @@
+"""
+Automatic rigid alignment of label volumes.
+
+The fixed volume is not transformed.  The moving volume is rotated about
+its center following Volume3D.rotate (roll, pitch, yaw) and then
+translated, exactly like volume2 of a TimeStampPair.  The search maximizes
+the number of moving voxels that land on fixed voxels.
+
+The search runs coarse to fine.  At each level the fixed volume is
+reduced to an occupancy grid of factor**3 voxel blocks, and the moving
+volume to a sample of its nonzero voxel positions.  Scoring a candidate
+then costs one small matrix product and one gather, whatever the volume
+size.  Candidates are scored in a process pool when workers > 1.
+
+correlation_translation estimates just the translation, for volumes that
+are already rotated, with one FFT cross correlation.  moment_alignment
+estimates a gross initial orientation from the principal axes of the
+volumes.
+
+OverlapMetrics measures how well a transform fits (Dice, IoU and surface
+distances) from sampled voxel and surface positions, cheaply enough to
+run for every frame of the interactive viewer.
+"""
+
+import numpy as np
+from scipy import fft
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+from . import operations3d
+from . import transforms3d
+
+def volume_rotation_matrix(roll, pitch, yaw):
+    "Rotation done by Volume3D.rotate(roll, pitch, yaw), acting on xyz (= index order) offsets."
+    return operations3d.rotate3d_matrix(roll, -pitch, -yaw)
+
+def block_occupancy(array, factor):
+    "Boolean grid telling whether any voxel in each factor**3 block of array is nonzero."
+    occupied = (array != 0)
+    if factor <= 1:
+        return occupied
+    # or together the strided slices of one axis at a time (much faster than a reshaped any).
+    for axis in range(3):
+        def part(offset):
+            selection = [slice(None)] * 3
+            selection[axis] = slice(offset, None, factor)
+            return occupied[tuple(selection)]
+        reduced = part(0).copy()
+        for offset in range(1, factor):
+            shifted = part(offset)
+            selection = [slice(None)] * 3
+            selection[axis] = slice(0, shifted.shape[axis])
+            reduced[tuple(selection)] |= shifted
+        occupied = reduced
+    return occupied
+
+def nonzero_points(array, corner, dvoxel, max_points=None, rng=None):
+    "Physical positions of the nonzero voxel centers of array (a random subset of at most max_points)."
+    flat = np.flatnonzero(array)
+    if max_points is not None and len(flat) > max_points:
+        if rng is None:
+            rng = np.random.default_rng(0)
+        flat = rng.choice(flat, max_points, replace=False)
+    indices = np.stack(np.unravel_index(flat, array.shape), axis=-1)
+    return np.asarray(corner) + (indices + 0.5) * dvoxel
+
+def rotation_center(array, corner, dvoxel):
+    "Center used by rotate3d, in the voxel center coordinates of nonzero_points."
+    return np.asarray(corner) + (0.5 * np.array(array.shape[:3]) + 0.5) * dvoxel
+
+def rotation_angles(R):
+    "(roll, pitch, yaw) with volume_rotation_matrix(roll, pitch, yaw) == R."
+    # R = Rz(-yaw) Ry(-pitch) Rx(roll), so its transpose factors as Rx Ry Rz.
+    M = np.eye(4)
+    M[:3, :3] = R.T
+    (_, thetax, thetay, thetaz) = transforms3d.airplane_parameters(M)
+    return (-float(thetax), float(thetay), float(thetaz))
+
+def transform_points(points, center, roll, pitch, yaw, translation):
+    R = volume_rotation_matrix(roll, pitch, yaw)
+    return (points - center) @ R.T + (center + np.asarray(translation))
+
+class OverlapScorer:
+
+    """
+    Number of moving sample points that land on an occupied fixed grid cell
+    for candidate (roll, pitch, yaw, tx, ty, tz) parameters.
+    """
+
+    def __init__(self, grid, grid_corner, grid_voxel, points, center):
+        self.grid = grid
+        self.grid_corner = np.asarray(grid_corner, dtype=np.float64)
+        self.grid_voxel = float(grid_voxel)
+        self.points = points
+        self.center = center
+
+    def __call__(self, candidate):
+        (roll, pitch, yaw, tx, ty, tz) = candidate
+        moved = transform_points(self.points, self.center, roll, pitch, yaw, (tx, ty, tz))
+        indices = np.floor((moved - self.grid_corner) / self.grid_voxel).astype(np.int64)
+        inside = np.all((indices >= 0) & (indices < np.array(self.grid.shape)), axis=1)
+        indices = indices[inside]
+        return int(np.count_nonzero(self.grid[indices[:, 0], indices[:, 1], indices[:, 2]]))
+
+# scorer for the current level in process pool workers.
+worker_scorer = None
+
+def initialize_worker(scorer):
+    global worker_scorer
+    worker_scorer = scorer
+
+def score_in_worker(candidate):
+    return worker_scorer(candidate)
+
+class RigidAlignment:
+
+    """
+    Coarse to fine search for the (roll, pitch, yaw, translation) that moves the
+    moving volume onto the fixed volume.  Both arrays must have cubic voxels of
+    size dvoxel; corners are the physical positions of their [0, 0, 0] voxels.
+    """
+
+    def __init__(
+            self,
+            fixed,
+            moving,
+            dvoxel=1.0,
+            fixed_corner=(0, 0, 0),
+            moving_corner=(0, 0, 0),
+            factors=(4, 2, 1),
+            max_points=20000,
+            angle_range=np.pi / 6,
+            angle_step=np.pi / 12,
+            keep=4,
+            workers=None,
+            seed=0,
+            verbose=False,
+            ):
+        self.fixed = fixed
+        self.moving = moving
+        self.dvoxel = float(dvoxel)
+        self.fixed_corner = np.array(fixed_corner, dtype=np.float64)
+        self.moving_corner = np.array(moving_corner, dtype=np.float64)
+        self.factors = sorted(factors, reverse=True)
+        self.max_points = max_points
+        self.angle_range = angle_range
+        self.angle_step = angle_step
+        self.keep = keep
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.verbose = verbose
+        self.center = rotation_center(moving, moving_corner, dvoxel)
+        self.fixed_centroid = nonzero_points(fixed, fixed_corner, dvoxel, max_points, self.rng).mean(axis=0)
+        self.evaluations = 0
+
+    def scorer(self, factor):
+        "Scorer for one level: fixed blocks of factor voxels, fewer moving points when coarse."
+        grid = block_occupancy(self.fixed, factor)
+        npoints = max(1000, self.max_points // factor)
+        points = nonzero_points(self.moving, self.moving_corner, self.dvoxel, npoints, self.rng)
+        return OverlapScorer(grid, self.fixed_corner, factor * self.dvoxel, points, self.center)
+
+    def centering_translation(self, scorer, roll, pitch, yaw):
+        "Translation moving the centroid of the rotated moving points onto the fixed centroid."
+        moved = transform_points(scorer.points, self.center, roll, pitch, yaw, (0, 0, 0))
+        return self.fixed_centroid - moved.mean(axis=0)
+
+    def initial_candidates(self, scorer, start):
+        "Grid of rotations around start, each centered by translation, plus start itself."
+        (roll0, pitch0, yaw0) = start[:3]
+        offsets = np.arange(-self.angle_range, self.angle_range + 1e-9, self.angle_step)
+        candidates = [tuple(start)]
+        for droll in offsets:
+            for dpitch in offsets:
+                for dyaw in offsets:
+                    angles = (roll0 + droll, pitch0 + dpitch, yaw0 + dyaw)
+                    translation = self.centering_translation(scorer, *angles)
+                    candidates.append(angles + tuple(translation))
+        return candidates
+
+    def evaluate(self, scorer, candidates, executor):
+        self.evaluations += len(candidates)
+        if executor is None:
+            return [scorer(candidate) for candidate in candidates]
+        chunksize = max(1, len(candidates) // (4 * self.workers))
+        return list(executor.map(score_in_worker, candidates, chunksize=chunksize))
+
+    def best(self, scorer, candidates, executor, count):
+        scores = self.evaluate(scorer, candidates, executor)
+        order = np.argsort(scores)[::-1][:count]
+        return ([candidates[i] for i in order], [scores[i] for i in order])
+
+    def compass_search(self, scorer, candidates, scores, factor, executor):
+        """
+        Refine candidates by stepping each parameter up and down, halving the steps
+        when no step improves, until they are below the resolution of the level.
+        """
+        shift_step = 2.0 * factor * self.dvoxel
+        min_shift = 0.5 * factor * self.dvoxel
+        # angles that move the outer sample points about as far as the shift steps.
+        radius = max(self.dvoxel, np.sqrt(((scorer.points - self.center) ** 2).sum(axis=1)).max())
+        angle_ratio = 1.0 / radius
+        candidates = [np.array(c, dtype=np.float64) for c in candidates]
+        scores = list(scores)
+        while shift_step >= min_shift:
+            steps = np.array([shift_step * angle_ratio] * 3 + [shift_step] * 3)
+            trials = []
+            owners = []
+            for (n, candidate) in enumerate(candidates):
+                for axis in range(6):
+                    for sign in (1, -1):
+                        trial = candidate.copy()
+                        trial[axis] += sign * steps[axis]
+                        trials.append(tuple(trial))
+                        owners.append(n)
+            trial_scores = self.evaluate(scorer, trials, executor)
+            improved = False
+            for (trial, owner, score) in zip(trials, owners, trial_scores):
+                if score > scores[owner]:
+                    (candidates[owner], scores[owner]) = (np.array(trial), score)
+                    improved = True
+            if not improved:
+                shift_step *= 0.5
+        return ([tuple(c) for c in candidates], scores)
+
+    def search(self, start=(0, 0, 0, 0, 0, 0)):
+        """
+        Run the search from start (roll, pitch, yaw, tx, ty, tz).
+        Returns a dict with roll, pitch, yaw, translation and overlap, the fraction
+        of moving sample points on fixed voxels at full resolution.
+        """
+        candidates = None
+        scores = None
+        for factor in self.factors:
+            scorer = self.scorer(factor)
+            executor = None
+            if self.workers is not None and self.workers > 1:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=initialize_worker, initargs=(scorer,))
+            try:
+                if candidates is None:
+                    candidates = self.initial_candidates(scorer, start)
+                (candidates, scores) = self.best(scorer, candidates, executor, self.keep)
+                (candidates, scores) = self.compass_search(scorer, candidates, scores, factor, executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            if self.verbose:
+                print("factor", factor, "best score", max(scores), "of", len(scorer.points), "points")
+        n = int(np.argmax(scores))
+        (roll, pitch, yaw, tx, ty, tz) = candidates[n]
+        return dict(
+            roll=float(roll),
+            pitch=float(pitch),
+            yaw=float(yaw),
+            translation=[float(tx), float(ty), float(tz)],
+            overlap=scores[n] / len(scorer.points),
+        )
+
+def nonzero_crop(array):
+    "(cropped, start) where cropped = array restricted to the bounding box of its nonzeros."
+    nz = (array != 0)
+    if not nz.any():
+        return (array, np.zeros(array.ndim, dtype=np.int64))
+    bounds = []
+    for axis in range(array.ndim):
+        others = tuple(a for a in range(array.ndim) if a != axis)
+        (hits,) = np.nonzero(nz.any(axis=others))
+        bounds.append((hits[0], hits[-1] + 1))
+    start = np.array([low for (low, _) in bounds])
+    return (array[tuple(slice(low, high) for (low, high) in bounds)], start)
+
+def parabolic_offset(below, at, above):
+    "Sub-sample offset of the peak of a parabola through three equally spaced values."
+    curvature = below - 2 * at + above
+    if curvature >= 0:
+        return 0.0
+    return float(np.clip(0.5 * (below - above) / curvature, -0.5, 0.5))
+
+def correlation_translation(
+        fixed,
+        moving,
+        dvoxel=1.0,
+        fixed_corner=(0, 0, 0),
+        moving_corner=(0, 0, 0),
+        factor=1,
+        method="cross",
+        max_shift=None,
+        ):
+    """
+    Translation (physical units) of the moving volume that best overlaps the fixed
+    volume, from the peak of their FFT cross correlation with parabolic sub-voxel
+    refinement.  Label volumes are compared by their nonzero masks, grey volumes as is.
+    factor > 1 correlates block occupancy grids (a pyramid level) for speed.
+    method "phase" whitens the spectrum (phase correlation), which gives a sharper
+    peak for textured grey volumes.  max_shift limits the search radius (physical units).
+    Returns (translation, peak) where peak is the correlation at the best shift.
+    """
+    assert method in ("cross", "phase"), "unknown method: " + repr(method)
+    def prepare(array):
+        if factor > 1:
+            return block_occupancy(array, factor).astype(np.float32)
+        if np.issubdtype(array.dtype, np.floating):
+            return array.astype(np.float32)
+        return (array != 0).astype(np.float32)
+    voxel = dvoxel * factor
+    # correlate only the nonzero bounding boxes (rotation buffers are mostly empty).
+    (A, startA) = nonzero_crop(prepare(fixed))
+    (B, startB) = nonzero_crop(prepare(moving))
+    fixed_corner = np.asarray(fixed_corner, dtype=np.float64) + startA * voxel
+    moving_corner = np.asarray(moving_corner, dtype=np.float64) + startB * voxel
+    # pad so that every shift (-len(B) < s < len(A)) has its own correlation sample.
+    padded = [fft.next_fast_len(a + b - 1, real=True) for (a, b) in zip(A.shape, B.shape)]
+    FA = fft.rfftn(A, padded, workers=-1)
+    FB = fft.rfftn(B, padded, workers=-1)
+    product = FA * np.conj(FB)
+    if method == "phase":
+        product /= np.maximum(np.abs(product), 1e-12)
+    correlation = fft.irfftn(product, padded, workers=-1)
+    # correlation[s] = sum_f A[f] * B[f - s] (indices mod the padded shape)
+    shifts = [np.where(np.arange(p) < a, np.arange(p), np.arange(p) - p) for (p, a) in zip(padded, A.shape)]
+    corner_offset = (np.asarray(fixed_corner, dtype=np.float64) - np.asarray(moving_corner, dtype=np.float64))
+    search = correlation
+    if max_shift is not None:
+        # shift s moves the moving volume by corner_offset + s * voxel.
+        grids = np.meshgrid(*shifts, indexing="ij", sparse=True)
+        distance2 = sum((corner_offset[n] + grids[n] * voxel) ** 2 for n in range(3))
+        search = np.where(distance2 <= max_shift ** 2, correlation, -np.inf)
+    peak_index = np.unravel_index(np.argmax(search), correlation.shape)
+    peak = correlation[peak_index]
+    shift = np.zeros(3)
+    for axis in range(3):
+        below = list(peak_index)
+        above = list(peak_index)
+        below[axis] = (peak_index[axis] - 1) % padded[axis]
+        above[axis] = (peak_index[axis] + 1) % padded[axis]
+        refinement = parabolic_offset(correlation[tuple(below)], peak, correlation[tuple(above)])
+        shift[axis] = shifts[axis][peak_index[axis]] + refinement
+    translation = corner_offset + shift * voxel
+    return (translation, float(peak))
+
+def principal_axes(points):
+    "(centroid, axes) of a point cloud; the columns of axes are unit vectors by decreasing spread."
+    centroid = points.mean(axis=0)
+    centered = points - centroid
+    inertia = centered.T @ centered / len(points)
+    (_, vectors) = np.linalg.eigh(inertia)
+    return (centroid, vectors[:, ::-1])
+
+def moment_alignment(
+        fixed,
+        moving,
+        dvoxel=1.0,
+        fixed_corner=(0, 0, 0),
+        moving_corner=(0, 0, 0),
+        max_points=20000,
+        stride=1,
+        factor=2,
+        seed=0,
+        ):
+    """
+    Gross initial alignment from the centroids and principal axes of the nonzero voxels,
+    computed from at most max_points of them (optionally from arrays strided by stride).
+    The principal axes fix the rotation up to the directions of the axes; the proper
+    rotation among the four choices with the largest overlap (on a grid of factor**3 blocks)
+    wins.  Returns a dict like RigidAlignment.search, to seed the viewer or a search.
+    """
+    rng = np.random.default_rng(seed)
+    def points(array, corner):
+        if stride > 1:
+            array = array[::stride, ::stride, ::stride]
+        return nonzero_points(array, corner, dvoxel * stride, max_points, rng)
+    fixed_points = points(fixed, fixed_corner)
+    moving_points = points(moving, moving_corner)
+    (fixed_centroid, fixed_axes) = principal_axes(fixed_points)
+    (moving_centroid, moving_axes) = principal_axes(moving_points)
+    center = rotation_center(moving, moving_corner, dvoxel)
+    scorer = OverlapScorer(
+        block_occupancy(fixed, factor), fixed_corner, factor * dvoxel, moving_points, center)
+    best = None
+    for signs in ([1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]):
+        fixed_signed = fixed_axes * np.array(signs)
+        R = fixed_signed @ moving_axes.T
+        if np.linalg.det(R) < 0:
+            # make it a proper rotation by flipping the least significant axis.
+            fixed_signed[:, 2] *= -1
+            R = fixed_signed @ moving_axes.T
+        (roll, pitch, yaw) = rotation_angles(R)
+        R = volume_rotation_matrix(roll, pitch, yaw)
+        translation = fixed_centroid - ((moving_centroid - center) @ R.T + center)
+        candidate = (roll, pitch, yaw) + tuple(translation)
+        score = scorer(candidate)
+        if best is None or score > best[0]:
+            best = (score, candidate)
+    (score, (roll, pitch, yaw, tx, ty, tz)) = best
+    return dict(
+        roll=roll,
+        pitch=pitch,
+        yaw=yaw,
+        translation=[float(tx), float(ty), float(tz)],
+        overlap=score / len(moving_points),
+    )
+
+def surface_voxels(array, corner, dvoxel):
+    "Physical positions of the nonzero voxels of array with a zero (or outside) face neighbour."
+    (cropped, start) = nonzero_crop(array)
+    occupied = (cropped != 0)
+    surface = occupied & ~ndimage.binary_erosion(occupied, border_value=0)
+    return nonzero_points(surface, np.asarray(corner) + start * dvoxel, dvoxel)
+
+class OverlapMetrics:
+
+    """
+    Overlap of the moving volume, transformed as for RigidAlignment, with the fixed volume.
+
+    Dice and IoU come from the fraction of (at most max_points) sampled moving voxels
+    that land on fixed voxels.  Surface distances are from (at most surface_points)
+    sampled surface voxels of each volume to the whole surface of the other, using
+    k-d trees built once in each volume's own frame; the fixed samples are mapped into
+    the moving frame by the inverse transform, so no tree is rebuilt per call.
+    """
+
+    def __init__(
+            self,
+            fixed,
+            moving,
+            dvoxel=1.0,
+            fixed_corner=(0, 0, 0),
+            moving_corner=(0, 0, 0),
+            max_points=20000,
+            surface_points=5000,
+            seed=0,
+            ):
+        rng = np.random.default_rng(seed)
+        self.fixed = fixed
+        self.dvoxel = float(dvoxel)
+        self.fixed_corner = np.array(fixed_corner, dtype=np.float64)
+        self.fixed_count = np.count_nonzero(fixed)
+        self.moving_count = np.count_nonzero(moving)
+        self.points = nonzero_points(moving, moving_corner, dvoxel, max_points, rng)
+        self.center = rotation_center(moving, moving_corner, dvoxel)
+        fixed_surface = surface_voxels(fixed, fixed_corner, dvoxel)
+        moving_surface = surface_voxels(moving, moving_corner, dvoxel)
+        self.fixed_tree = cKDTree(fixed_surface)
+        self.moving_tree = cKDTree(moving_surface)
+        def sample(points):
+            if len(points) > surface_points:
+                points = points[rng.choice(len(points), surface_points, replace=False)]
+            return points
+        self.fixed_surface = sample(fixed_surface)
+        self.moving_surface = sample(moving_surface)
+
+    def __call__(self, roll, pitch, yaw, translation):
+        """
+        dict(dice, iou, mean_surface_distance, surface_distance_95) for the transform;
+        distances are in physical units (symmetric: both surfaces to the other).
+        """
+        moved = transform_points(self.points, self.center, roll, pitch, yaw, translation)
+        indices = np.floor((moved - self.fixed_corner) / self.dvoxel).astype(np.int64)
+        inside = np.all((indices >= 0) & (indices < np.array(self.fixed.shape)), axis=1)
+        indices = indices[inside]
+        hits = np.count_nonzero(self.fixed[indices[:, 0], indices[:, 1], indices[:, 2]])
+        intersection = hits / max(1, len(self.points)) * self.moving_count
+        total = self.fixed_count + self.moving_count
+        # moving surface samples into the fixed frame; fixed samples back into the moving frame.
+        R = volume_rotation_matrix(roll, pitch, yaw)
+        center = self.center
+        offset = center + np.asarray(translation)
+        to_fixed = (self.moving_surface - center) @ R.T + offset
+        to_moving = (self.fixed_surface - offset) @ R + center
+        (distances1, _) = self.fixed_tree.query(to_fixed)
+        (distances2, _) = self.moving_tree.query(to_moving)
+        distances = np.concatenate([distances1, distances2])
+        return dict(
+            dice=float(2 * intersection / max(1, total)),
+            iou=float(intersection / max(1, total - intersection)),
+            mean_surface_distance=float(distances.mean()),
+            surface_distance_95=float(np.percentile(distances, 95)),
+        )
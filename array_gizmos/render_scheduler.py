@@ -0,0 +1,119 @@
+"""
+Coalescing render scheduler for slider driven gizmos.
+
+Slider and AircraftAxes callbacks fire much faster than a volume can be
+re-rendered.  Instead of rendering every event synchronously, a gizmo
+asks the scheduler to render the current parameters.  The scheduler
+
+- keeps only the newest pending parameters (older pending requests are dropped),
+- runs the NumPy work in a worker thread off the H5Gizmos event loop,
+- shows results on the event loop thread, skipping any result that is older
+  than one already shown.
+
+So after the user stops moving, the display catches up within at most one
+render in flight plus one render of the final parameters.
+
+ProgressiveScheduler additionally renders coarse previews while the
+parameters are changing and refines to full resolution when they settle.
+"""
+
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+class RenderScheduler:
+
+    def __init__(self, compute, show, executor=None):
+        """
+        compute(parameters) -> result runs in a worker thread and should only do array work.
+        show(result) runs on the event loop thread and updates the display.
+        At most one compute runs at a time per scheduler.
+        """
+        self.compute = compute
+        self.show = show
+        self.executor = executor
+        self.pending = None
+        self.has_pending = False
+        self.running = False
+        self.requested = 0  # sequence number of the newest request
+        self.shown = 0  # sequence number of the newest result shown
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        return self.executor
+
+    def request(self, parameters):
+        """
+        Ask for parameters to be rendered.  Without a running event loop (headless use)
+        render synchronously.
+        """
+        self.requested += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self.show_result(self.requested, self.compute(parameters))
+            return
+        self.pending = parameters
+        self.has_pending = True
+        if not self.running:
+            self.running = True
+            loop.create_task(self.run(loop))
+
+    async def run(self, loop):
+        try:
+            while self.has_pending:
+                parameters = self.pending
+                sequence = self.requested
+                self.pending = None
+                self.has_pending = False
+                try:
+                    result = await loop.run_in_executor(self.get_executor(), self.compute, parameters)
+                except Exception:
+                    print("render failed for", repr(parameters)[:200])
+                    traceback.print_exc()
+                    continue
+                self.show_result(sequence, result)
+        finally:
+            self.running = False
+
+    def show_result(self, sequence, result):
+        if sequence <= self.shown:
+            return  # stale: something newer is already displayed.
+        self.shown = sequence
+        self.show(result)
+
+    def busy(self):
+        return self.running or self.has_pending
+
+class ProgressiveScheduler(RenderScheduler):
+
+    """
+    While requests keep arriving render a coarse preview for each one, then render
+    the full resolution image once no new request has arrived for refine_delay seconds.
+    compute is called with (parameters, coarse) where coarse is True for previews.
+    """
+
+    def __init__(self, compute, show, refine_delay=0.3, executor=None):
+        super().__init__(compute, show, executor)
+        self.refine_delay = refine_delay
+        self.refine_timer = None
+
+    def request(self, parameters):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            # headless: no previews.
+            return super().request((parameters, False))
+        if self.refine_timer is not None:
+            self.refine_timer.cancel()
+        super().request((parameters, True))
+        self.refine_timer = loop.call_later(self.refine_delay, self.refine, parameters)
+
+    def refine(self, parameters):
+        self.refine_timer = None
+        super().request((parameters, False))
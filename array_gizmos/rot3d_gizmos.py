@@ -7,6 +7,7 @@ from . import operations3d
 from H5Gizmos import Stack, Slider, Image, Shelf, Button, Text, RangeSlider, DropDownSelect
 from . import colorizers
 from . import color_list
+from . import render_scheduler
 from jp_doodle import gz_aircraft_axes
 
 def adjusted_labels_and_image(labels, image, width=600, adjustment="reduce"):
@@ -88,7 +89,11 @@ class LabelsAndImage:
         
 class AdjustableLabelsAndImage:
 
-    def __init__(self, labels, image, width=600, title="Image and Labels"):
+    def __init__(self, labels, image, width=600, title="Image and Labels", preview_factor=2, refine_delay=0.3):
+        """
+        While the rotation is being dragged, previews are rendered from buffers strided
+        by preview_factor; full resolution follows after refine_delay idle seconds.
+        """
         if image is not None:
             assert labels.shape == image.shape, "shapes don't match: " + repr([labels.shape, image.shape])
         self.title = title
@@ -100,6 +105,10 @@ class AdjustableLabelsAndImage:
         if image is not None:
             self.simage = operations3d.slice3(image, slicing)
         self.multi_resolution = False
+        self.selected_labels = set()
+        self.preview_factor = preview_factor
+        self.renderer = render_scheduler.ProgressiveScheduler(
+            self.compute_images, self.show_images, refine_delay=refine_delay)
 
     def info(self, msg):
         self.info_area.text(msg)
@@ -223,19 +232,28 @@ class AdjustableLabelsAndImage:
         buffer = operations3d.rotation_buffer(truncated)
         return buffer
 
+    def coarsen(self, buffer):
+        "Preview buffer sharing the geometry of the full rotation buffer at lower resolution."
+        f = self.preview_factor
+        if f <= 1:
+            return buffer
+        return np.ascontiguousarray(buffer[::f, ::f, ::f])
+
     def setup_images(self, *ignored):
         size = self.get_resolution()
         self.info("... Setting image resolution: " + repr(size))
         self.labels_buffer = self.chunk(self.slabels)
+        self.coarse_labels_buffer = self.coarsen(self.labels_buffer)
         if self.image is not None:
             self.image_buffer = self.chunk(self.simage)
+            self.coarse_image_buffer = self.coarsen(self.image_buffer)
         #self.tlabels = operations3d.specific_shape(self.slabels, size)
         #self.timage = operations3d.specific_shape(self.simage, size)
         #self.image_buffer = operations3d.rotation_buffer(self.timage)
         #self.labels_buffer = operations3d.rotation_buffer(self.tlabels)
         #self.info("drawing images at resolution: " + repr(size))
         self.labels_display.on_pixel(self.pixel_callback)
-        self.selected_label = None
+        self.selected_labels = set()
         self.draw_image()
 
     def draw_image(self, *ignored):
@@ -245,30 +263,50 @@ class AdjustableLabelsAndImage:
         yaw = self.rotations.yaw
         pitch = self.rotations.pitch
         self.info("rotating: " + repr([roll, pitch, yaw]))
+        buffers = (self.labels_buffer, None)
+        coarse_buffers = (self.coarse_labels_buffer, None)
         if self.image is not None:
-            rotated_img = operations3d.rotate3d(self.image_buffer, roll, -pitch, -yaw)
-        rotated_labels = operations3d.rotate3d(self.labels_buffer, roll, -pitch, -yaw)
-        self.info("projection: " + repr(self.labels_buffer.shape))
-        if self.image is not None:
-            proj_img = rotated_img.max(axis=0)
+            buffers = (self.labels_buffer, self.image_buffer)
+            coarse_buffers = (self.coarse_labels_buffer, self.coarse_image_buffer)
+        parameters = (roll, pitch, yaw, buffers, coarse_buffers, sorted(self.selected_labels))
+        self.renderer.request(parameters)
+
+    def compute_images(self, request):
+        "Rotate and project the full or preview buffers (in the render worker thread)."
+        (parameters, coarse) = request
+        (roll, pitch, yaw, buffers, coarse_buffers, selected) = parameters
+        (labels_buffer, image_buffer) = buffers
+        if coarse:
+            (labels_buffer, image_buffer) = coarse_buffers
+        rotated_labels = operations3d.rotate3d(labels_buffer, roll, -pitch, -yaw)
         proj_labels = operations3d.extrude0(rotated_labels)
-        self.proj_labels = proj_labels
-        if self.image is not None:
-            scale_img = colorizers.scale256(proj_img)
         color_labels = colorizers.colorize_array(proj_labels)
-        self.proj_labels = proj_labels
-        if self.image is not None:
+        color_image = None
+        if image_buffer is not None:
+            rotated_img = operations3d.rotate3d(image_buffer, roll, -pitch, -yaw)
+            proj_img = rotated_img.max(axis=0)
+            scale_img = colorizers.scale256(proj_img)
             #color_image = colorizers.pseudo_colorize(scale_img)
             color_image = colorizers.to_rgb(scale_img, scaled=False)
-            label = self.selected_label
-            if label:
-                boundary = colorizers.boundary_image(label, proj_labels)
-                color = color_list.indexed_color(label-1)
+            if selected:
+                boundary = colorizers.selected_boundaries(proj_labels, selected)
+                label_colors = {label: color_list.indexed_color(label-1) for label in selected}
+                highlight = colorizers.label_overlay_layer(boundary, label_colors)
+                (indices, _) = highlight
                 white = [255,255,255]
-                color_image = colorizers.overlay_color(color_image, boundary, color)
-                color_labels = colorizers.overlay_color(color_labels, boundary, white)
-                self.info("highlighting: " + repr(label))
-            # xxx mark selected label...
+                color_image = colorizers.overlay(color_image, [highlight])
+                color_labels = colorizers.overlay(color_labels, [(indices, white)])
+        return (proj_labels, color_labels, color_image, selected, labels_buffer.shape, coarse)
+
+    def show_images(self, images):
+        (proj_labels, color_labels, color_image, selected, shape, coarse) = images
+        if not coarse:
+            # pixel clicks refer to the full resolution labels.
+            self.proj_labels = proj_labels
+        self.info("projection: " + repr(shape))
+        if color_image is not None:
+            if selected:
+                self.info("highlighting: " + repr(selected))
             self.image_display.change_array(color_image)
         self.labels_display.change_array(color_labels)
 
@@ -279,7 +317,11 @@ class AdjustableLabelsAndImage:
         label = labels[row, column]
         self.info("clicked label: " + repr(label))
         if label:
-            self.selected_label = label
+            # shift click toggles the label in a multiple selection
+            if event.get("shiftKey", False):
+                self.selected_labels ^= {int(label)}
+            else:
+                self.selected_labels = {int(label)}
             self.draw_image()
 
     def reset_click(self, *ignored):
@@ -330,6 +372,7 @@ class OverlayedLabels:
             [255,0,0],
             [0,255,255]
         ], dtype=np.ubyte)
+        self.renderer = render_scheduler.RenderScheduler(self.compute_image, self.show_image)
 
     def sample_arrays(self):
         resolution = self.resolution
@@ -386,12 +429,21 @@ class OverlayedLabels:
         roll1 = self.rotations1.roll
         yaw1 = self.rotations1.yaw
         pitch1 = self.rotations1.pitch
-        rot_labels1 = operations3d.rotate3d(self.splabels1, roll, -pitch, -yaw)
-        rot_labels2 = operations3d.rotate3d(self.splabels2, roll, -pitch, -yaw)
+        parameters = (roll, pitch, yaw, roll1, pitch1, yaw1, self.splabels1, self.splabels2)
+        self.renderer.request(parameters)
+
+    def compute_image(self, parameters):
+        "Rotate, combine and project the sampled labels (in the render worker thread)."
+        (roll, pitch, yaw, roll1, pitch1, yaw1, splabels1, splabels2) = parameters
+        rot_labels1 = operations3d.rotate3d(splabels1, roll, -pitch, -yaw)
+        rot_labels2 = operations3d.rotate3d(splabels2, roll, -pitch, -yaw)
         assert rot_labels1.shape == rot_labels2.shape
         rot_labels2 = operations3d.rotate3d(rot_labels2, roll1, -pitch1, -yaw1)
         assert rot_labels1.shape == rot_labels2.shape
         combined = np.where(rot_labels1, rot_labels1, rot_labels2)
         projected = operations3d.extrude0(combined)
         colored = colorizers.colorize_array(projected, self.colors)
+        return colored
+
+    def show_image(self, colored):
         self.labels_display.change_array(colored)
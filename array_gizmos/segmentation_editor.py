@@ -9,10 +9,14 @@ Shift + Click: change selected label.
 Ctrl + Click: Update region with selected label.
 """
 
+import asyncio
 import numpy as np
 import H5Gizmos as h5
 from . import color_list
 from . import colorizers
+from . import edit_journal
+from . import viewports
+from . import caches
 
 def print(*args, **kwargs):
     from H5Gizmos.python.gizmo_server import force_print
@@ -27,6 +31,36 @@ def whiten(array1d, divisor=3):
     array1d[:] = r.reshape(array1d.shape)
     return array1d # modified in place
 
+def stroke_centers(points):
+    """
+    Integer positions along the polyline through points (an (n, 3) array), at most
+    one voxel apart along every axis so stamped brushes leave no gaps.
+    """
+    points = np.asarray(points, dtype=np.int64)
+    if len(points) < 2:
+        return points
+    starts = points[:-1]
+    deltas = np.diff(points, axis=0)
+    steps = np.maximum(1, np.abs(deltas).max(axis=1))
+    # parameter t in [0, 1) for each sample of each segment, computed in one pass.
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = offsets / steps[segment]
+    centers = np.rint(starts[segment] + t[:, None] * deltas[segment]).astype(np.int64)
+    centers = np.concatenate([centers, points[-1:]])
+    return np.unique(centers, axis=0)
+
+def stamp_box(centers, widths, shape):
+    """
+    Voxel positions (an (m, 3) array, no duplicates) covered by a box brush of
+    half widths widths stamped at each center, clipped to shape.
+    """
+    ranges = [np.arange(-w, w + 1) for w in widths]
+    footprint = np.stack(np.meshgrid(*ranges, indexing="ij"), axis=-1).reshape(-1, 3)
+    ijk = (np.asarray(centers)[:, None, :] + footprint[None, :, :]).reshape(-1, 3)
+    inside = np.all((ijk >= 0) & (ijk < np.array(shape)), axis=1)
+    return np.unique(ijk[inside], axis=0)
+
 class VolumeMix:
     def __init__(
             self, 
@@ -37,26 +71,42 @@ class VolumeMix:
             dJ=1, 
             dK=1,
             zoom=1.0,
-            dw=5,):
+            dw=5,
+            viewport=None,):
+        """
+        viewport is an optional (rows, cols) display size per panel: panels then show
+        a pannable, zoomable window of their slice instead of the whole slice.
+        """
         self.zoom = zoom
         self.volumeImage = volumeImage
+        # edits are journaled in place: they reach the caller's mask whatever its layout.
         self.volumeMask = volumeMask
+        self.journal = edit_journal.EditJournal(volumeMask)
         print("VolumeMix initialized with shapes:", volumeImage.shape, volumeMask.shape)
         self.dI = dI
         self.dJ = dJ
         self.dK = dK
         self.dw = dw
+        # paint stroke state: positions waiting for the next frame, and the last painted position.
+        self.frame_interval = 1.0 / 30
+        self.stroke_pending = []
+        self.stroke_last = None
+        self.stroke_timer = None
         if maxLabel is None:
             self.maxLabel = volumeMask.max()
         else:
             self.maxLabel = maxLabel
         color_choices = [(0,0,0)] + color_list.get_colors(self.maxLabel)
         self.color_mapping_array = np.array(color_choices, dtype=np.ubyte)
+        # one intensity scale for all three panels
+        self.normalizer = colorizers.shared_normalizer(volumeImage)
+        # the panels slice their uint8 images from one shared copy of the volume.
+        self.scaled_volume = colorizers.ScaledVolume(volumeImage, self.normalizer)
         self.shape = np.array(volumeImage.shape)
         self.IJK = self.shape[:3] // 2
-        mixJK = imageMix(maxLabel=self.maxLabel, dI=dJ, dJ=dK, volumeIndices=(1, 2), parent=self, dw=dw)
-        mixJI = imageMix(maxLabel=self.maxLabel, dI=dI, dJ=dJ, volumeIndices=(1, 0), parent=self, dw=dw)
-        mixIK = imageMix(maxLabel=self.maxLabel, dI=dI, dJ=dK, volumeIndices=(0, 2), parent=self, dw=dw)
+        mixJK = imageMix(maxLabel=self.maxLabel, dI=dJ, dJ=dK, volumeIndices=(1, 2), parent=self, dw=dw, viewport=viewport)
+        mixJI = imageMix(maxLabel=self.maxLabel, dI=dI, dJ=dJ, volumeIndices=(1, 0), parent=self, dw=dw, viewport=viewport)
+        mixIK = imageMix(maxLabel=self.maxLabel, dI=dI, dJ=dK, volumeIndices=(0, 2), parent=self, dw=dw, viewport=viewport)
         self.mixes = {
             "JK": mixJK,
             "JI": mixJI,
@@ -65,31 +115,100 @@ class VolumeMix:
         self.positionMixes()
         self.selectedLabel = 0  # Default selected label
 
+    def brush_widths(self):
+        "Half widths of the paint brush box in voxels along I, J, K."
+        dw = self.dw
+        return np.array([
+            max(0, dw // self.dI - 1),
+            max(0, dw // self.dJ - 1),
+            max(0, dw // self.dK - 1),
+        ])
+
+    def check_selected_label(self):
+        if self.selectedLabel < 0 or self.selectedLabel >= len(self.color_mapping_array):
+            raise ValueError("Selected label out of range: " + str(self.selectedLabel))
+
     def paint(self, IJK):
         """
         Paint the selected label at the specified IJK position.
         """
-        if self.selectedLabel < 0 or self.selectedLabel >= len(self.color_mapping_array):
-            raise ValueError("Selected label out of range: " + str(self.selectedLabel))
+        self.check_selected_label()
         print("Painting label", self.selectedLabel, "at position", IJK)
-        mask = self.volumeMask
-        shape = np.array(mask.shape)
-        I, J, K = IJK
-        si, sj, sk = shape[:3]
-        dw = self.dw
-        wI = max(0, dw // self.dI - 1)
-        wJ = max(0, dw // self.dJ - 1)
-        wK = max(0, dw // self.dK - 1)
-        i1 = max(0, I - wI)
-        i2 = min(si - 1, I + wI)
-        j1 = max(0, J - wJ)
-        j2 = min(sj - 1, J + wJ)
-        k1 = max(0, K - wK)
-        k2 = min(sk - 1, K + wK)
-        self.volumeMask[i1:i2+1, j1:j2+1, k1:k2+1] = self.selectedLabel
-        #for mix in self.mixes.values():
-        #    mix.slice_volumes(self.volumeImage, self.volumeMask, IJK)
-        return self.positionMixes(IJK)
+        shape = np.array(self.volumeMask.shape[:3])
+        IJK = np.asarray(IJK)
+        widths = self.brush_widths()
+        low = np.maximum(0, IJK - widths)
+        high = np.minimum(shape - 1, IJK + widths) + 1
+        dirty = tuple(zip(low.tolist(), high.tolist()))
+        self.journal.paint_box(dirty, self.selectedLabel)
+        return self.positionMixes(IJK, dirty=dirty)
+
+    def stroke_to(self, IJK):
+        """
+        Extend the current paint stroke to IJK.  Positions are collected and painted
+        together at most once per frame (immediately when there is no event loop).
+        The whole stroke becomes one journal entry at end_stroke.
+        """
+        self.check_selected_label()
+        if self.stroke_last is None and not self.stroke_pending:
+            self.journal.begin_group()
+        self.stroke_pending.append(np.array(IJK, dtype=np.int64))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            return self.flush_stroke()
+        if self.stroke_timer is None:
+            self.stroke_timer = loop.call_later(self.frame_interval, self.flush_stroke)
+        return None
+
+    def end_stroke(self):
+        "Paint any pending stroke positions, journal the stroke as one edit, and start afresh."
+        label = self.flush_stroke()
+        self.stroke_last = None
+        self.journal.end_group()
+        return label
+
+    def flush_stroke(self):
+        """
+        Paint the polyline through the pending stroke positions (joined to the end of
+        the previous flush) as one write to the mask and one redraw of the panels.
+        """
+        if self.stroke_timer is not None:
+            self.stroke_timer.cancel()
+            self.stroke_timer = None
+        pending = self.stroke_pending
+        if not pending:
+            return None
+        self.stroke_pending = []
+        points = pending
+        if self.stroke_last is not None:
+            points = [self.stroke_last] + pending
+        self.stroke_last = pending[-1]
+        centers = stroke_centers(np.array(points))
+        shape = self.volumeMask.shape[:3]
+        ijk = stamp_box(centers, self.brush_widths(), shape)
+        flat = np.ravel_multi_index(tuple(ijk.T), shape)
+        self.journal.paint_indices(flat, self.selectedLabel)
+        dirty = tuple(zip(ijk.min(axis=0).tolist(), (ijk.max(axis=0) + 1).tolist()))
+        return self.positionMixes(self.stroke_last, dirty=dirty)
+
+    def undo(self, *ignored):
+        "Revert the last paint operation."
+        edit = self.journal.undo()
+        if edit is not None:
+            self.positionMixes(self.IJK, dirty=edit.bounds(self.volumeMask.shape))
+
+    def redo(self, *ignored):
+        "Reapply the last undone paint operation."
+        edit = self.journal.redo()
+        if edit is not None:
+            self.positionMixes(self.IJK, dirty=edit.bounds(self.volumeMask.shape))
+
+    def save_edits(self, path):
+        "Autosave the edit session; replay later with edit_journal.replay_edits(base_mask, path)."
+        self.journal.save(path)
 
     def selectedColor(self):
         return self.color_mapping_array[self.selectedLabel]
@@ -107,7 +226,11 @@ class VolumeMix:
             "backgroundColor": color_list.rgbhtml(self.selectedColor()),
         })
 
-    def positionMixes(self, IJK=None):
+    def positionMixes(self, IJK=None, dirty=None):
+        """
+        Move the panels to IJK.  dirty is an optional ((i1, i2), (j1, j2), (k1, k2)) box
+        of the mask that changed, so panels can refresh just that region.
+        """
         #p(("========= Positioning mixes with IJK:", IJK)
         shape = self.shape
         if IJK is None:
@@ -117,7 +240,7 @@ class VolumeMix:
         selectedLabel = self.volumeMask[IJK[0], IJK[1], IJK[2]]
         #self.changeLabel(selectedLabel) # not needed here, done in click
         for mix in self.mixes.values():
-            mix.slice_volumes(self.volumeImage, self.volumeMask, self.IJK)
+            mix.slice_volumes(self.volumeImage, self.volumeMask, self.IJK, dirty=dirty)
         return selectedLabel
 
     def gizmo(self):
@@ -142,7 +265,10 @@ class VolumeMix:
             ],
             [
                 self.mixes["IK"].gizmo(zoom),
-                self.colorDiv,
+                [
+                    self.colorDiv,
+                    [h5.Button("Undo", on_click=self.undo), h5.Button("Redo", on_click=self.redo)],
+                ],
             ],
         ])
         return display
@@ -156,7 +282,8 @@ class imageMix:
             dI=1, dJ=1, 
             volumeIndices=None,
             parent=None,
-            dw=1):
+            dw=1,
+            viewport=None):
         self.volumeIndices = volumeIndices
         self.image = image
         self.mask = mask
@@ -168,11 +295,34 @@ class imageMix:
             self.maxLabel = mask.max()
         else:
             self.maxLabel = maxLabel
-        color_choices = [(0,0,0)] + color_list.get_colors(self.maxLabel)
-        self.color_mapping_array = np.array(color_choices, dtype=np.ubyte)
+        if parent is not None:
+            # one palette for all panels of the volume.
+            self.color_mapping_array = parent.color_mapping_array
+        else:
+            color_choices = [(0,0,0)] + color_list.get_colors(self.maxLabel)
+            self.color_mapping_array = np.array(color_choices, dtype=np.ubyte)
         self.selected_color = (255,255,255)  # Default selected color
         self.selected_label = 0  # default to background
         self.lamda = 0.5  # default blending factor
+        self.blender = colorizers.FixedPointBlender()
+        self.region_blender = colorizers.FixedPointBlender()
+        # cached images for the current slice plane
+        self.plane = None
+        self.sliced_from = (None, None)
+        self.colorized = None
+        self.scaled = None
+        self.scaled_source = None
+        self.base = None
+        self.base_lamda = None
+        self.display_buffer = None
+        # optional viewport: (rows, cols) display size, with rendered tiles cached per plane.
+        if viewport is not None and np.isscalar(viewport):
+            viewport = (viewport, viewport)
+        self.viewport_display = viewport
+        self.viewport = None
+        self.tiles = caches.LRUCache(max_bytes=64 * 2**20)
+        self.tiles_lamda = None
+        self.window_buffer = None
         self.mousePosition = None
         self.display = None
         self.IJK = [0, 0, 0]  # Default IJK position
@@ -207,13 +357,42 @@ class imageMix:
         [i1, i2] = self.volumeIndices
         return i1 > i2
 
-    def slice_volumes(self, volumeImage, volumeMask, IJK):
+    def slice_volumes(self, volumeImage, volumeMask, IJK, dirty=None):
         """
         Slice the image and mask volumes at the specified IJK indices.
+        If the slice plane is unchanged only the dirty box (if it intersects the plane)
+        is recomputed, and nothing is redrawn if the cursor did not move either.
         """
         slicedIndex = self.slicedIndex()
+        plane = IJK[slicedIndex]
+        mousePosition = self.projection2d(IJK)
         self.IJK = IJK
-        self.mousePosition = self.projection2d(IJK)
+        (fromImage, fromMask) = self.sliced_from
+        same_volumes = (fromImage is volumeImage and fromMask is volumeMask)
+        if not same_volumes:
+            self.tiles.clear()
+        elif dirty is not None:
+            self.forget_tiles(dirty)
+        if self.viewport is not None and not self.viewport.visible(*mousePosition):
+            # keep the cursor in view.
+            self.viewport.center_on(*mousePosition)
+        cached = self.base is not None or self.viewport is not None
+        if cached and plane == self.plane and same_volumes:
+            changed = False
+            if dirty is not None:
+                (low, high) = dirty[slicedIndex]
+                if low <= plane < high:
+                    [index0, index1] = self.volumeIndices
+                    self.refresh_region(dirty[index0], dirty[index1])
+                    changed = True
+            if changed or not np.array_equal(mousePosition, self.mousePosition):
+                self.mousePosition = mousePosition
+                if self.display is not None:
+                    self.update(self.lamda)
+            return
+        self.plane = plane
+        self.sliced_from = (volumeImage, volumeMask)
+        self.mousePosition = mousePosition
         #p("Slicing volumes at IJK:", IJK, "slicedIndex:", slicedIndex, self.volumeIndices)
         def slice_volume(volume, IJK):
             [I, J, K] = IJK
@@ -230,13 +409,19 @@ class imageMix:
             return result
         image_slice = slice_volume(volumeImage, IJK)
         mask_slice = slice_volume(volumeMask, IJK)
+        scaled_slice = None
+        if self.parent is not None and volumeImage is self.parent.volumeImage:
+            scaled_slice = self.parent.scaled_volume.get_slice(slicedIndex, plane)
+            if self.transposed():
+                scaled_slice = scaled_slice.T
         #p()
         #p("Indices:", IJK, "VolumeIndices", self.volumeIndices, "Sliced index:", slicedIndex)
         #p("From volumes:", volumeImage.shape, volumeMask.shape)
         #p("Sliced image shape:", image_slice.shape, "Sliced mask shape:", mask_slice.shape)
-        return self.change_images(image_slice, mask_slice)
+        return self.change_images(image_slice, mask_slice, scaled_slice)
 
-    def change_images(self, image, mask):
+    def change_images(self, image, mask, scaled=None):
+        "Show new image and mask slices; scaled is an optional precomputed uint8 version of image."
         imsh = image.shape
         msh = mask.shape
         assert imsh == msh, "Image and mask shapes must match: " + repr((imsh, msh))
@@ -244,14 +429,132 @@ class imageMix:
             raise ValueError("Image and mask must be 2D slices, got shapes: " + repr((imsh, msh)))
         self.image = image
         self.mask = mask
+        self.scaled_source = scaled
+        if self.viewport_display is not None:
+            if self.viewport is None or self.viewport.data_shape != imsh:
+                display = tuple(min(d, n) for (d, n) in zip(self.viewport_display, imsh))
+                self.viewport = viewports.Viewport(imsh, display, center=self.mousePosition)
+                self.tiles.clear()
+        self.invalidate()
+        if self.display is not None:
+            self.update(self.lamda)
+
+    def invalidate(self):
+        "Forget the cached colorized, scaled and blended images of the slice."
+        self.colorized = None
+        self.scaled = None
+        self.base = None
+
+    def base_image(self, lamda):
+        "Blended image without cursor decorations, cached until the slice, mask or lamda changes."
+        if self.colorized is None:
+            self.colorized = self.colorized_mask()
+        if self.scaled is None:
+            self.scaled = self.scaled_image()
+        if self.base is None or self.base_lamda != lamda:
+            # lamda weights the image, so the label colors get 1 - lamda
+            self.base = self.blender.blend(self.colorized, self.scaled, 1 - lamda, mask=(self.mask != 0))
+            self.base_lamda = lamda
+        return self.base
+
+    def refresh_region(self, rows, cols):
+        "Recolor and reblend only the (start, end) rows and cols after the mask changed there."
+        if self.base is None or self.viewport is not None:
+            return  # everything (or the affected tiles) is recomputed on the next draw anyway.
+        (r0, r1) = rows
+        (c0, c1) = cols
+        mask = self.mask[r0:r1, c0:c1]
+        colors = colorizers.colorize_array(mask, self.color_mapping_array)
+        self.colorized[r0:r1, c0:c1] = colors
+        scaled = self.scaled[r0:r1, c0:c1]
+        lamda = self.base_lamda
+        self.base[r0:r1, c0:c1] = self.region_blender.blend(colors, scaled, 1 - lamda, mask=(mask != 0))
+
+    def window_image(self, lamda):
+        "Blended image of the viewport window, assembled from cached tiles."
+        viewport = self.viewport
+        if self.tiles_lamda != lamda:
+            self.tiles.clear()
+            self.tiles_lamda = lamda
+        window_shape = viewport.window_shape() + (3,)
+        if self.window_buffer is None or self.window_buffer.shape != window_shape:
+            self.window_buffer = np.empty(window_shape, dtype=np.ubyte)
+        window = self.window_buffer
+        window[...] = 0  # padding past the edge of the slice
+        visible = set(viewport.tiles())
+        # neighbouring tiles are rendered too, so small pans hit the cache.
+        for (tr, tc) in viewport.tiles(margin=1):
+            key = (self.plane, viewport.step(), tr, tc)
+            tile = self.tiles.get_or_compute(key, lambda: self.tile_image(tr, tc, lamda))
+            if (tr, tc) in visible:
+                viewport.paste(window, tile, tr, tc)
+        return window
+
+    def tile_image(self, tile_row, tile_col, lamda):
+        "Blended rgb tile of the (subsampled) slice."
+        if self.scaled is None:
+            self.scaled = self.scaled_image()
+        selection = self.viewport.tile_slices(tile_row, tile_col)
+        mask = self.mask[selection]
+        colors = colorizers.colorize_array(mask, self.color_mapping_array)
+        # the blender reuses its output buffer, so keep a copy.
+        return self.region_blender.blend(colors, self.scaled[selection], 1 - lamda, mask=(mask != 0)).copy()
+
+    def forget_tiles(self, dirty):
+        "Drop cached tiles that overlap the dirty ((i1, i2), (j1, j2), (k1, k2)) box of the mask."
+        if len(self.tiles) == 0:
+            return
+        (plow, phigh) = dirty[self.slicedIndex()]
+        [index0, index1] = self.volumeIndices
+        (rows, cols) = (dirty[index0], dirty[index1])
+        viewport = self.viewport
+        for key in list(self.tiles.entries):
+            (plane, step, tr, tc) = key
+            if not (plow <= plane < phigh):
+                continue
+            # extents for the tile's own zoom level
+            T = viewport.tile_size * step
+            if tr * T < rows[1] and rows[0] < (tr + 1) * T and tc * T < cols[1] and cols[0] < (tc + 1) * T:
+                self.tiles.discard(key)
+
+    def zoom_in(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.zoom_by(2))
+
+    def zoom_out(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.zoom_by(0.5))
+
+    def pan_up(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.pan(-0.5, 0))
+
+    def pan_down(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.pan(0.5, 0))
+
+    def pan_left(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.pan(0, -0.5))
+
+    def pan_right(self, *ignored):
+        self.change_viewport(lambda viewport: viewport.pan(0, 0.5))
+
+    def change_viewport(self, change):
+        if self.viewport is None:
+            return
+        change(self.viewport)
         if self.display is not None:
             self.update(self.lamda)
 
     def colorized_mask(self):
         return colorizers.colorize_array(self.mask, self.color_mapping_array)
     
+    def scaled_image(self):
+        "The image as uint8, scaled by the shared volume normalizer if there is a parent."
+        if self.scaled_source is not None:
+            return self.scaled_source
+        if self.parent is not None:
+            return self.parent.normalizer(self.image)
+        return colorizers.scale256(self.image)
+
     def rgb_image(self):
-        return colorizers.to_rgb(self.image)
+        return colorizers.to_rgb(self.scaled_image(), scaled=False)
     
     def combined(self, lamda=0.5, mousePosition=None, selectedColor=None):
         """
@@ -262,9 +565,20 @@ class imageMix:
             selectedColor = self.selected_color
         if mousePosition is None:
             mousePosition = self.mousePosition
-        colorized_mask = self.colorized_mask()
-        rgb_image = self.rgb_image()
-        combined_image = (lamda * rgb_image + (1 - lamda) * colorized_mask).astype(np.ubyte)
+        step = 1
+        if self.viewport is None:
+            base = self.base_image(lamda)
+        else:
+            base = self.window_image(lamda)
+            step = self.viewport.step()
+            if mousePosition is not None:
+                # None (no cursor) if the cursor is outside the window.
+                mousePosition = self.viewport.to_window(*mousePosition)
+        # draw the cursor on a copy so the cached blend stays clean.
+        if self.display_buffer is None or self.display_buffer.shape != base.shape:
+            self.display_buffer = np.empty_like(base)
+        combined_image = self.display_buffer
+        np.copyto(combined_image, base)
         (rows, cols,) = combined_image.shape[:2]
         #p("mousePosition:", mousePosition, "selectedColor:", selectedColor, "shape:", combined_image.shape)
         if mousePosition is not None and selectedColor is not None:
@@ -275,11 +589,11 @@ class imageMix:
                 # draw a di/dj box around the mouse position
                 dw = self.dw
                 if self.transposed():
-                    wI = max(1, dw // self.dI)
-                    wJ = max(1, dw // self.dJ)
+                    wI = max(1, dw // self.dI // step)
+                    wJ = max(1, dw // self.dJ // step)
                 else:
-                    wI = max(1, dw // self.dJ)
-                    wJ = max(1, dw // self.dI)
+                    wI = max(1, dw // self.dJ // step)
+                    wJ = max(1, dw // self.dI // step)
                 x1 = max(0, x - wI)
                 x2 = min(cols-1, x + wI)
                 y1 = max(0, y - wJ)
@@ -300,7 +614,7 @@ class imageMix:
                 whiten(combined_image[y, x2:cols, :])
             else:
                 print("Mouse position out of bounds:", mousePosition, "for image shape:", combined_image.shape)
-        else:
+        elif self.viewport is None:
             print("No mousePosition or selectedColor provided, skipping drawing box.")
         return combined_image
     
@@ -310,6 +624,9 @@ class imageMix:
         """
         combined_image = self.combined()
         shape = combined_image.shape
+        if self.viewport is not None:
+            # the element keeps the display size; zoomed in windows are enlarged to fill it.
+            shape = self.viewport.display_shape
         #p("for", self.volumeIndices, "shape:", shape, "dI:", self.dI, "dJ:", self.dJ)
         [I, J] = shape[:2]
         if (self.transposed()):
@@ -319,7 +636,7 @@ class imageMix:
             height = int(I * self.dI)
             width = int(J * self.dJ)
         self.panel = h5.Image(
-            array=combined_image,
+            array=combined_image.copy(), # the blender reuses its buffer
             width=width * zoom,
             height=height * zoom,
             pixelated=True,
@@ -337,8 +654,17 @@ class imageMix:
             on_change=self.update
         )
         self.lSlider.resize(width=width * 0.5)
-        self.display = h5.Stack([
-            self.lSlider,
+        controls = [self.lSlider]
+        if self.viewport is not None:
+            controls.append([
+                h5.Button("+", on_click=self.zoom_in),
+                h5.Button("-", on_click=self.zoom_out),
+                h5.Button("<", on_click=self.pan_left),
+                h5.Button(">", on_click=self.pan_right),
+                h5.Button("^", on_click=self.pan_up),
+                h5.Button("v", on_click=self.pan_down),
+            ])
+        self.display = h5.Stack(controls + [
             self.panel,
         ])
         return self.display
@@ -358,6 +684,7 @@ class imageMix:
         shifted = event.get("shiftKey", False)
         if shifted:
             print("Shifted click painting at ", self.IJK)
+            self.parent.end_stroke()
             self.parent.paint(self.IJK)
             self.tracking = False # stop tracking after painting
         elif label is not None:
@@ -373,13 +700,19 @@ class imageMix:
         row = event["pixel_row"]
         #print("Click at row, col:", row, column, self.volumeIndices)
         mousePosition = (row, column)
+        if self.viewport is not None:
+            mousePosition = self.viewport.to_data(row, column)
+            if mousePosition is None:
+                return None  # in the padding past the edge of the slice
         IJK = self.position3d(self.IJK, mousePosition)
         #print("Click at IJK:", IJK)
         if self.parent is not None:
             #oldIJK = self.parent.IJK
             if shifted:
-                return self.parent.paint(IJK)
+                # paint positions are batched into a stroke, drawn once per frame.
+                return self.parent.stroke_to(IJK)
             else:
+                self.parent.end_stroke()
                 label = self.parent.positionMixes(IJK)
                 return label
 
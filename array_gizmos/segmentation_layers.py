@@ -4,6 +4,7 @@ View source image and segmentation layers paired and mixed.
 
 from . import colorizers
 from . import loaders
+from . import volume_colorizers
 import numpy as np
 import H5Gizmos as gz
 
@@ -53,23 +54,48 @@ class SegmentationLayers:
         self.current_layer = self.max_layer // 2
         (self.width, self.height) = labelVolume.shape[1:]
         self.mix_lambda = 0.5
+        self.blender = colorizers.FixedPointBlender()
+        self.normalizer = colorizers.shared_normalizer(imageVolume)
+        self.precolorized = None
         #self.get_images()
 
+    def precolorize(self, path=None, memory_budget=256 * 2**20, workers=4):
+        """
+        Colorize and mix the whole volume at the current mix setting ahead of time
+        (memory mapped to a .npy file at path if given) so layer changes are slice lookups.
+        """
+        colorizer = volume_colorizers.VolumeColorizer(
+            self.labelVolume,
+            self.imageVolume,
+            color_mapping_array=self.color_mapping_array,
+            mix_lambda=self.mix_lambda,
+            speckle=speckle,
+            normalizer=self.normalizer,
+            memory_budget=memory_budget,
+            workers=workers,
+        )
+        self.precolorized = colorizer.colorize(path)
+        self.precolorized_lambda = self.mix_lambda
+        return self.precolorized
+
     def get_images(self):
         layer = self.current_layer
+        if self.precolorized is not None and self.precolorized_lambda == self.mix_lambda:
+            self.mixed_image = self.precolorized[layer]
+            return
         label_layer = self.labelVolume[layer]
         image_layer = self.imageVolume[layer]
         colorized_labels = colorizers.colorize_array(label_layer, self.color_mapping_array)
         if speckle:
-            colorized_labels = colorizers.speckle_background(colorized_labels, label_layer)
-        ilayer = colorizers.scale256(image_layer)
-        gray_image = np.stack([ilayer, ilayer, ilayer], axis=-1)
+            colorized_labels = colorizers.speckle_background(colorized_labels, label_layer, copy=False)
+        ilayer = self.normalizer(image_layer)
         self.label_image = colorized_labels
-        self.intensity_image = ilayer.astype(np.ubyte)
-        self.mixed_image = (
-            (self.mix_lambda * colorized_labels) + 
-            ((1.0 - self.mix_lambda) * gray_image)
-        ).astype(np.ubyte)
+        self.intensity_image = ilayer
+        # speckles live outside the labels so blend everywhere when speckling
+        mask = None
+        if not speckle:
+            mask = (label_layer != 0)
+        self.mixed_image = self.blender.blend(colorized_labels, ilayer, self.mix_lambda, mask)
 
     def update_image(self):
         self.get_images()
@@ -0,0 +1,126 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from array_gizmos import align_volumes, registration
+import numpy as np
+
+def volume(shape, corner, marker, seed):
+    rng = np.random.default_rng(seed)
+    array = (rng.random(shape) < 0.3).astype(np.uint8) * marker
+    return align_volumes.Volume3D(array, np.array(corner, dtype=float), (1.0, 1.0, 1.0))
+
+class Test_CombinationCanvas(unittest.TestCase):
+
+    def test_matches_fresh_combination(self):
+        fixed = volume((10, 12, 8), (0, 0, 0), 1, 0)
+        canvas = align_volumes.CombinationCanvas((20, 20, 20))
+        buffer = canvas.buffer
+        for (n, shift) in enumerate([(0, 0, 0), (3, -2, 1), (-4, 5, 0), (1, 1, 1)]):
+            moving = volume((9, 7, 11), shift, 2, n + 1)
+            expected = moving.combine_nonzeros(fixed)
+            combined = moving.combine_nonzeros(fixed, canvas)
+            self.assertTrue(np.allclose(combined.corner000, expected.corner000))
+            self.assertTrue(np.array_equal(combined.array, expected.array))
+        # within the reserved size the buffer is reused and nothing outside the result is left dirty.
+        self.assertIs(canvas.buffer, buffer)
+        outside = buffer.copy()
+        outside[:combined.array.shape[0], :combined.array.shape[1], :combined.array.shape[2]] = 0
+        self.assertEqual(outside.max(), 0)
+
+    def test_grows(self):
+        canvas = align_volumes.CombinationCanvas((4, 4, 4))
+        fixed = volume((10, 10, 10), (0, 0, 0), 1, 0)
+        moving = volume((10, 10, 10), (5, 5, 5), 2, 1)
+        combined = fixed.combine_nonzeros(moving, canvas)
+        self.assertEqual(canvas.buffer.shape, combined.array.shape)
+        self.assertTrue(np.array_equal(combined.array, fixed.combine_nonzeros(moving).array))
+
+class Test_derived_cache(unittest.TestCase):
+
+    def make_volume(self, **options):
+        g = np.indices((16, 16, 16)) - 8
+        array = ((g ** 2).sum(axis=0) < 40).astype(np.uint8)
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), lambda ts: array)
+        return align_volumes.TimeStampVolume(1, sequence, array, 1.0, **options)
+
+    def test_toggling_reuses_volumes(self):
+        volume = self.make_volume()
+        rotatable = volume.rotatable
+        volume.speckle(0.5, 1)
+        first = volume.speckled
+        volume.speckle(0.1, 2)
+        self.assertIsNot(volume.speckled, first)
+        volume.speckle(0.5, 1)
+        self.assertIs(volume.speckled, first)
+        volume.rectify(1.0)
+        self.assertIs(volume.rotatable, rotatable)
+        # seeded speckles are reproducible and differ between seeds.
+        volume.speckle(0.5, 1, seed=3)
+        self.assertFalse(np.array_equal(volume.speckled.array, first.array))
+        self.assertTrue(np.array_equal(first.array, rotatable.speckle(0.5, 1, 0).array))
+
+    def test_budget(self):
+        volume = self.make_volume(cache_bytes=3 * self.make_volume().rotatable.nbytes)
+        for ratio in (0.5, 0.2, 0.1, 0.05):
+            volume.speckle(ratio)
+        self.assertLessEqual(volume.derived.total_bytes, volume.derived.max_bytes)
+        self.assertNotIn(("speckled", 1.0, 0.5, 1, 0), volume.derived)
+
+class Test_TimeStampPair_metrics(unittest.TestCase):
+
+    def test_frames_carry_metrics(self):
+        g = np.indices((20, 20, 20)) - 10
+        array = ((g ** 2).sum(axis=0) < 50).astype(np.uint8)
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), lambda ts: array)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        parameters = (0, 0, 0, 0, 0, 0, (2.0, 0, 0), (1.0, 1))
+        for coarse in (True, False):
+            (colored, metrics) = pair.compute_image((parameters, coarse))
+            self.assertEqual(colored.shape[-1], 3)
+            self.assertTrue(0.5 < metrics["dice"] < 1.0, repr(metrics))
+        self.assertAlmostEqual(pair.json_parameters()["metrics"]["dice"], 1.0)
+
+    def test_metrics_reused(self):
+        g = np.indices((20, 20, 20)) - 10
+        array = ((g ** 2).sum(axis=0) < 50).astype(np.uint8)
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), lambda ts: array)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        # concurrent first uses build a single engine.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            engines = list(executor.map(lambda n: pair.get_metrics_engine(), range(4)))
+        self.assertTrue(all(engine is engines[0] for engine in engines))
+        parameters = (0, 0, 0, 0.0, 0.0, 0.0, (2.0, 0.0, 0.0), (1.0, 1))
+        (_, metrics) = pair.compute_image((parameters, False))
+        (pair.roll, pair.pitch, pair.yaw, pair.translation) = (0.0, 0.0, 0.0, (2.0, 0.0, 0.0))
+        self.assertIs(pair.json_parameters()["metrics"], metrics)
+
+class Test_anisotropic_rotatable(unittest.TestCase):
+
+    def setUp(self):
+        g = np.indices((20, 40, 36)) - np.array([10, 20, 18])[:, None, None, None]
+        shape = ((g / np.array([7, 16, 10])[:, None, None, None]) ** 2).sum(axis=0) < 1
+        self.volume = align_volumes.Volume3D(shape.astype(np.uint8), (0, 0, 0), (2.0, 1.0, 1.0))
+
+    def test_matches_rectified(self):
+        old = self.volume.rectify(1.0).rotatable()
+        new = self.volume.rotatable(1.0)
+        self.assertEqual(new.array.shape, old.array.shape)
+        self.assertTrue(np.allclose(new.corner000, old.corner000))
+        self.assertTrue(np.array_equal(new.array, old.array))
+
+    def test_rotation_folded_in(self):
+        angles = (0.3, -0.2, 0.25)
+        buffer = self.volume.rotatable(1.0).array
+        rotated = self.volume.rotatable(1.0, *angles).array
+        # exact nearest voxel rotation of the buffer about its center, as rotate3d approximates it.
+        N = buffer.shape[0]
+        R = registration.volume_rotation_matrix(*angles)
+        indices = np.indices(buffer.shape).reshape((3, -1)).T
+        source = np.rint((indices - 0.5 * N) @ R + 0.5 * N).astype(int)
+        inside = np.all((source >= 0) & (source < N), axis=1)
+        expected = np.zeros(len(indices), dtype=buffer.dtype)
+        expected[inside] = buffer[tuple(source[inside].T)]
+        mismatched = np.count_nonzero(rotated != expected.reshape(buffer.shape))
+        self.assertTrue(mismatched < 0.01 * np.count_nonzero(buffer), repr(mismatched))
+
+if __name__ == "__main__":
+    unittest.main()
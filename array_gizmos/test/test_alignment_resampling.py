@@ -0,0 +1,79 @@
+import os
+import json
+import tempfile
+import unittest
+from array_gizmos import alignment_resampling, label_overlaps, align_volumes
+from array_gizmos.test.test_label_overlaps import cells, parameters
+import numpy as np
+
+class Test_AlignmentResampler(unittest.TestCase):
+
+    def test_shift_labels(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = np.roll(labels1, 3, axis=0)
+        resampler = alignment_resampling.AlignmentResampler(
+            parameters((-6.0, 0, 0), (2.0, 1.0, 1.0)), labels1, labels2, memory_budget=2000)
+        tiles = resampler.tiles(labels2.dtype.itemsize)
+        self.assertTrue(len(tiles) > 1)
+        for box in tiles:
+            self.assertLessEqual(resampler.tile_bytes(box, labels2.dtype.itemsize), 2000)
+        resampled = resampler.resample(labels2)
+        self.assertEqual(resampled.dtype, labels2.dtype)
+        self.assertTrue(np.array_equal(resampled, labels1))
+
+    def test_matches_aligned_contingency(self):
+        labels1 = cells((24, 22, 20), 20, 0)
+        labels2 = cells((24, 22, 20), 25, 1)
+        saved = parameters((1.0, -2.0, 0.5))
+        saved.update(roll=0.2, pitch=-0.1, yaw=0.15)
+        resampled = alignment_resampling.AlignmentResampler(saved, labels1, labels2).resample(labels2)
+        direct = label_overlaps.contingency(labels1, resampled)
+        aligned = label_overlaps.aligned_contingency(labels1, labels2, saved)
+        # the two nearest voxel roundings only differ at exact ties.
+        self.assertTrue(abs(direct[2].sum() - aligned[2].sum()) < 0.01 * aligned[2].sum())
+
+    def test_rotated_tiles_fit_budget(self):
+        # at 40 degrees the source block of a whole slab spans most of the source.
+        labels1 = cells((24, 40, 40), 30, 0)
+        labels2 = cells((24, 40, 40), 30, 1)
+        saved = parameters((0.5, -1.0, 0.0))
+        saved.update(yaw=0.7)
+        whole = alignment_resampling.AlignmentResampler(saved, labels1, labels2, memory_budget=2**30)
+        self.assertEqual(len(whole.tiles(labels2.dtype.itemsize)), 1)
+        budget = 16 * 2**10
+        tiled = alignment_resampling.AlignmentResampler(saved, labels1, labels2, memory_budget=budget)
+        tiles = tiled.tiles(labels2.dtype.itemsize)
+        slab = ((0, tiles[0][0][1]), (0, 40), (0, 40))
+        self.assertGreater(tiled.tile_bytes(slab, labels2.dtype.itemsize), budget)
+        for box in tiles:
+            self.assertLessEqual(tiled.tile_bytes(box, labels2.dtype.itemsize), budget)
+        covered = np.zeros(labels1.shape, dtype=int)
+        for box in tiles:
+            covered[tuple(slice(low, high) for (low, high) in box)] += 1
+        self.assertTrue(np.all(covered == 1))
+        self.assertTrue(np.array_equal(tiled.resample(labels2), whole.resample(labels2)))
+
+    def test_linear_intensities(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = labels1.copy()
+        ramp = np.indices(labels2.shape).sum(axis=0).astype(np.float32)
+        resampler = alignment_resampling.AlignmentResampler(parameters((-0.5, 0, 0)), labels1, labels2)
+        resampled = resampler.resample(ramp, labels=False)
+        # moving the image by -0.5 samples it half a voxel further along I.
+        self.assertTrue(np.allclose(resampled[2:-2, 2:-2, 2:-2], ramp[2:-2, 2:-2, 2:-2] + 0.5))
+
+    def test_memory_mapped_file(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = np.roll(labels1, (1, 2, 0), axis=(0, 1, 2))
+        saved = parameters((-1.0, -2.0, 0))
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, "alignment.json")
+            with open(json_path, "w") as f:
+                json.dump(saved, f)
+            out_path = os.path.join(directory, "resampled.npy")
+            alignment_resampling.apply_alignment(
+                json_path, labels1, labels2, to_path=out_path, memory_budget=3000)
+            self.assertTrue(np.array_equal(np.load(out_path), labels1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import unittest
+import json
+import os
+import tempfile
+from array_gizmos import batch_alignment, align_volumes
+import numpy as np
+
+class NpzVolumes:
+    "Picklable reader of test volumes saved as ts<N>.npz in a directory."
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, ts):
+        return os.path.join(self.directory, "ts%s.npz" % ts)
+
+    def __call__(self, ts):
+        return np.load(self.path(ts))["a"]
+
+def write_volumes(directory, count):
+    g = np.indices((24, 24, 24)).transpose(1, 2, 3, 0) - 12
+    for ts in range(count):
+        center = np.array([ts, 0, -ts])
+        array = (((g - center) / np.array([8, 5, 3])) ** 2).sum(axis=-1) < 1
+        np.savez(os.path.join(directory, "ts%s.npz" % ts), a=array.astype(np.uint8))
+
+class Test_BatchAligner(unittest.TestCase):
+
+    def make_sequence(self, directory):
+        volumes = NpzVolumes(directory)
+        return align_volumes.VolumeSequence((1.0, 1.0, 1.0), volumes, volumes.path)
+
+    def test_runs_and_skips(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_volumes(directory, 3)
+            sequence = self.make_sequence(directory)
+            output = os.path.join(directory, "out")
+            options = dict(workers=None, verbose=False, factors=(2, 1), angle_range=0.1, angle_step=0.1)
+            records = batch_alignment.align_sequence(sequence, range(3), 1.0, output, **options)
+            self.assertEqual([r["status"] for r in records], ["aligned", "aligned"])
+            with open(records[0]["path"]) as f:
+                saved = json.load(f)
+            self.assertEqual(saved["volume2"]["timestamp_number"], 1)
+            self.assertEqual(len(saved["translation"]), 3)
+            records = batch_alignment.align_sequence(sequence, range(3), 1.0, output, **options)
+            self.assertEqual([r["status"] for r in records], ["skipped", "skipped"])
+            # a newer input makes its pairs out of date.
+            later = os.path.getmtime(records[1]["path"]) + 10
+            os.utime(sequence.get_path_for_ts(2), (later, later))
+            records = batch_alignment.align_sequence(sequence, range(3), 1.0, output, **options)
+            self.assertEqual([r["status"] for r in records], ["skipped", "aligned"])
+
+    def test_process_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_volumes(directory, 3)
+            sequence = self.make_sequence(directory)
+            aligner = batch_alignment.BatchAligner(
+                sequence, 1.0, directory, workers=2, memory_per_worker=2 * 2**30, verbose=False,
+                factors=(2,), angle_range=0.1, angle_step=0.1)
+            with contextlib.redirect_stderr(io.StringIO()):
+                records = aligner.run([(0, 1), (1, 2), (2, 5)])
+            self.assertEqual([r["status"] for r in records][:2], ["aligned", "aligned"])
+            self.assertTrue(records[2]["status"].startswith("failed"))
+            self.assertFalse(os.path.exists(records[2]["path"]))
+            # the worker's own traceback comes back with the record.
+            self.assertIn("ts5.npz", records[2]["traceback"])
+            self.assertIn("align_one", records[2]["traceback"])
+
+    def test_failed_save_leaves_no_partial(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_volumes(directory, 2)
+            sequence = self.make_sequence(directory)
+            # a directory in the way makes the final rename fail after the json is written.
+            os.mkdir(batch_alignment.output_path(directory, 0, 1))
+            for workers in (None, 2):
+                aligner = batch_alignment.BatchAligner(
+                    sequence, 1.0, directory, workers=workers, force=True, verbose=False,
+                    factors=(2,), angle_range=0.1, angle_step=0.1)
+                with contextlib.redirect_stderr(io.StringIO()):
+                    [record] = aligner.run([(0, 1)])
+                self.assertTrue(record["status"].startswith("failed"), record["status"])
+                self.assertIn("os.replace", record["traceback"])
+                self.assertFalse(os.path.exists(record["path"] + ".partial"))
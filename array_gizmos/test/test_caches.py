@@ -0,0 +1,36 @@
+import unittest
+from array_gizmos import caches
+import numpy as np
+
+class Test_LRUCache(unittest.TestCase):
+
+    def test_item_limit(self):
+        cache = caches.LRUCache(max_items=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+
+    def test_byte_limit(self):
+        cache = caches.LRUCache(max_bytes=250)
+        for i in range(4):
+            cache.put(i, np.zeros(100, dtype=np.ubyte))
+        self.assertEqual(sorted(cache.entries), [2, 3])
+        self.assertEqual(cache.total_bytes, 200)
+        # values larger than the budget are returned but not kept
+        big = cache.put("big", np.zeros(1000, dtype=np.ubyte))
+        self.assertEqual(big.shape, (1000,))
+        self.assertNotIn("big", cache)
+
+    def test_get_or_compute(self):
+        cache = caches.LRUCache(max_items=3)
+        calls = []
+        def compute():
+            calls.append(1)
+            return len(calls)
+        self.assertEqual(cache.get_or_compute("k", compute), 1)
+        self.assertEqual(cache.get_or_compute("k", compute), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
@@ -0,0 +1,179 @@
+import unittest
+from array_gizmos import colorizers
+import numpy as np
+
+class Test_FixedPointBlender(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(17)
+        self.colors = rng.integers(0, 256, (7, 5, 3)).astype(np.ubyte)
+        self.image = rng.integers(0, 256, (7, 5, 3)).astype(np.ubyte)
+
+    def expected(self, colors, image, lamda):
+        return lamda * colors.astype(float) + (1 - lamda) * image.astype(float)
+
+    def test_unmasked(self):
+        blender = colorizers.FixedPointBlender()
+        for lamda in (0, 0.25, 0.5, 0.73, 1):
+            blended = blender.blend(self.colors, self.image, lamda)
+            self.assertEqual(blended.dtype, np.ubyte)
+            diff = np.abs(blended - self.expected(self.colors, self.image, lamda))
+            self.assertTrue(diff.max() <= 1, repr((lamda, diff.max())))
+
+    def test_grey_image(self):
+        blender = colorizers.FixedPointBlender()
+        grey = self.image[:, :, 0]
+        blended = blender.blend(self.colors, grey, 0.4)
+        expected = self.expected(self.colors, grey[:, :, np.newaxis], 0.4)
+        self.assertTrue(np.abs(blended - expected).max() <= 1)
+
+    def test_masked(self):
+        blender = colorizers.FixedPointBlender()
+        mask = np.zeros(self.colors.shape[:2], dtype=bool)
+        mask[2:5, 1:3] = True
+        colors = self.colors.copy()
+        colors[~mask] = 0
+        unmasked = blender.blend(colors, self.image, 0.6).copy()
+        blended = blender.blend(colors, self.image, 0.6, mask=mask)
+        self.assertTrue(np.array_equal(blended, unmasked))
+
+    def test_buffer_reuse(self):
+        blender = colorizers.FixedPointBlender()
+        first = blender.blend(self.colors, self.image, 0.5)
+        second = blender.blend(self.image, self.colors, 0.5)
+        self.assertIs(first, second)
+
+class Test_speckle(unittest.TestCase):
+
+    def test_deterministic(self):
+        source = np.zeros((13, 11), dtype=np.int32)
+        source[3:6, 4:9] = 2
+        colors = colorizers.colorize_array(source)
+        speckled1 = colorizers.speckle_background(colors, source)
+        speckled2 = colorizers.speckle_background(colors, source)
+        self.assertTrue(np.array_equal(speckled1, speckled2))
+        # labelled pixels are untouched and the original is not modified
+        self.assertTrue(np.array_equal(speckled1[3:6, 4:9], colors[3:6, 4:9]))
+        self.assertEqual(colors[source == 0].max(), 0)
+        grey = (speckled1[source == 0] == colorizers.speckle_grey).all(axis=-1)
+        self.assertTrue(0 < grey.sum() < grey.size)
+
+    def test_mask_cache_is_bounded(self):
+        first = colorizers.speckle_mask((5, 7))
+        for n in range(40):
+            colorizers.speckle_mask((3, n + 1))
+        self.assertLessEqual(len(colorizers.speckle_masks), colorizers.speckle_masks.max_items)
+        # evicted patterns are regenerated identically.
+        self.assertTrue(np.array_equal(colorizers.speckle_mask((5, 7)), first))
+
+class Test_overlay(unittest.TestCase):
+
+    def test_matches_overlay_color(self):
+        rng = np.random.default_rng(3)
+        img = rng.integers(0, 256, (9, 8, 3)).astype(np.ubyte)
+        mask = rng.integers(0, 2, (9, 8)).astype(np.ubyte)
+        color = [10, 20, 30]
+        mask3 = np.zeros(mask.shape + (3,), dtype=np.ubyte)
+        mask3[:] = mask.reshape(mask.shape + (1,))
+        expected = np.choose(mask3, [img, color])
+        self.assertTrue(np.array_equal(colorizers.overlay_color(img, mask, color), expected))
+        # in place with flat indices
+        colorizers.overlay(img, [(np.flatnonzero(mask), color)])
+        self.assertTrue(np.array_equal(img, expected))
+
+    def test_label_layers(self):
+        labels = np.array([
+            [0, 1, 1, 2],
+            [3, 3, 2, 2],
+            [0, 7, 0, 1],
+        ])
+        img = np.zeros(labels.shape + (3,), dtype=np.ubyte)
+        label_colors = {1: (255, 0, 0), 2: (0, 255, 0)}
+        layer = colorizers.label_overlay_layer(labels, label_colors)
+        colorizers.overlay(img, [layer])
+        for (label, color) in label_colors.items():
+            self.assertTrue((img[labels == label] == color).all())
+        self.assertEqual(img[~np.isin(labels, [1, 2])].max(), 0)
+
+    def test_selected_boundaries(self):
+        labels = np.zeros((10, 10), dtype=int)
+        labels[2:5, 2:5] = 4
+        labels[7:9, 7:9] = 5
+        boundary = colorizers.selected_boundaries(labels, [4, 5])
+        self.assertEqual(boundary[3, 3], 0)
+        self.assertEqual(boundary[2, 2], 4)
+        self.assertEqual(boundary[1, 1], 4)
+        self.assertEqual(boundary[7, 9], 5)
+        self.assertEqual(boundary[0, 9], 0)
+        expected4 = colorizers.boundary_image(labels, 4)
+        self.assertTrue(np.array_equal(boundary == 4, expected4 != 0))
+
+class Test_VolumeNormalizer(unittest.TestCase):
+
+    def check(self, volume, **parameters):
+        normalizer = colorizers.VolumeNormalizer(volume, **parameters)
+        m = float(volume.min())
+        D = float(volume.max()) - m
+        for layer in volume:
+            expected = (255.0 * (layer.astype(float) - m) / D)
+            scaled = normalizer(layer)
+            self.assertEqual(scaled.dtype, np.ubyte)
+            self.assertTrue(np.abs(scaled - expected).max() <= 1.0)
+        return normalizer
+
+    def test_lookup_table(self):
+        rng = np.random.default_rng(5)
+        self.check(rng.integers(100, 3000, (4, 6, 7)).astype(np.uint16))
+        self.check(rng.integers(-300, 3000, (4, 6, 7)).astype(np.int16))
+
+    def test_multiply_shift(self):
+        rng = np.random.default_rng(5)
+        self.check(rng.integers(-10**6, 10**7, (4, 6, 7)).astype(np.int64))
+
+    def test_constant_int32(self):
+        volume = np.full((3, 4, 5), 7, dtype=np.int32)
+        normalizer = colorizers.VolumeNormalizer(volume)
+        self.assertIsNone(normalizer.multiplier)
+        self.assertTrue(np.array_equal(normalizer(volume[0]), np.zeros((4, 5), dtype=np.ubyte)))
+
+    def test_explicit_limits_clip(self):
+        volume = np.array([[[-2**40, -5, 0, 50, 100, 2**40]]], dtype=np.int64)
+        normalizer = colorizers.VolumeNormalizer(volume, minimum=0, maximum=100)
+        self.assertIsNotNone(normalizer.multiplier)
+        self.assertEqual(normalizer(volume[0]).tolist(), [[0, 0, 0, 127, 255, 255]])
+        volume32 = np.array([[[-2**31, 0, 100, 2**31 - 1]]], dtype=np.int32)
+        normalizer = colorizers.VolumeNormalizer(volume32, minimum=0, maximum=100)
+        self.assertEqual(normalizer(volume32[0]).tolist(), [[0, 0, 255, 255]])
+
+    def test_float_and_streamed(self):
+        rng = np.random.default_rng(5)
+        volume = rng.normal(size=(5, 6, 7))
+        exact = self.check(volume)
+        streamed = self.check(volume, slab=2)
+        self.assertEqual(exact.limits(), streamed.limits())
+
+    def test_shared(self):
+        volume = np.arange(24).reshape((2, 3, 4))
+        normalizer = colorizers.shared_normalizer(volume)
+        self.assertIs(colorizers.shared_normalizer(volume), normalizer)
+        self.assertIsNot(colorizers.shared_normalizer(volume.copy()), normalizer)
+
+class Test_ScaledVolume(unittest.TestCase):
+
+    def test_eager_and_lazy_slices(self):
+        rng = np.random.default_rng(3)
+        volume = rng.random((5, 6, 7))
+        normalizer = colorizers.VolumeNormalizer(volume)
+        eager = colorizers.ScaledVolume(volume, normalizer, slab=2)
+        lazy = colorizers.ScaledVolume(volume, normalizer, max_bytes=100)
+        self.assertIsNotNone(eager.scaled)
+        self.assertIsNone(lazy.scaled)
+        for axis in range(3):
+            for index in (0, 4):
+                selection = [slice(None)] * 3
+                selection[axis] = index
+                expected = normalizer(volume[tuple(selection)])
+                self.assertTrue(np.array_equal(eager.get_slice(axis, index), expected))
+                self.assertTrue(np.array_equal(lazy.get_slice(axis, index), expected))
+        lazy.get_slice(2, 4)
+        self.assertTrue(lazy.slices.hits > 0)
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from array_gizmos import edit_journal
+import numpy as np
+
+class Test_EditJournal(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.volume = rng.integers(0, 3, (10, 12, 14)).astype(np.uint16)
+        self.original = self.volume.copy()
+
+    def edit(self, journal):
+        journal.paint_box(((2, 5), (3, 7), (4, 9)), 7)
+        after_box = self.volume.copy()
+        journal.paint_indices([5, 17, 17, 900], [8, 1, 9, 8])
+        return after_box
+
+    def test_rle(self):
+        values = np.array([1, 1, 2, 2, 2, 0, 1])
+        (runs, lengths) = edit_journal.rle_encode(values)
+        self.assertEqual(runs.tolist(), [1, 2, 0, 1])
+        self.assertEqual(edit_journal.rle_decode(runs, lengths).tolist(), values.tolist())
+
+    def test_undo_redo(self):
+        journal = edit_journal.EditJournal(self.volume)
+        after_box = self.edit(journal)
+        self.assertEqual(self.volume.flat[17], 9)
+        after_all = self.volume.copy()
+        journal.undo()
+        self.assertTrue(np.array_equal(self.volume, after_box))
+        box_edit = journal.undo()
+        self.assertEqual(box_edit.bounds(self.volume.shape), ((2, 5), (3, 7), (4, 9)))
+        self.assertTrue(np.array_equal(self.volume, self.original))
+        self.assertIsNone(journal.undo())
+        journal.redo()
+        journal.redo()
+        self.assertTrue(np.array_equal(self.volume, after_all))
+        self.assertFalse(journal.can_redo())
+
+    def test_non_contiguous_volume(self):
+        # edits reach a strided view of the volume in place, in C order over the view's shape.
+        view = self.volume.transpose(2, 0, 1)[:, ::2]
+        expected = np.ascontiguousarray(view)
+        journal = edit_journal.EditJournal(view)
+        journal.paint_box(((1, 3), (0, 4), (2, 6)), 7)
+        journal.paint_indices([5, 17, 300], [8, 9, 8])
+        expected[1:3, 0:4, 2:6] = 7
+        expected.reshape(-1)[[5, 17, 300]] = [8, 9, 8]
+        self.assertTrue(np.array_equal(self.volume.transpose(2, 0, 1)[:, ::2], expected))
+        journal.undo()
+        journal.undo()
+        self.assertTrue(np.array_equal(self.volume, self.original))
+
+    def test_group(self):
+        journal = edit_journal.EditJournal(self.volume)
+        journal.paint_box(((0, 1), (0, 1), (0, 1)), 5)
+        before = self.volume.copy()
+        journal.begin_group()
+        self.edit(journal)
+        # repaint a voxel of the box: undo must still restore its original value.
+        journal.paint_indices([1000, 1001, 565], 6)
+        after = self.volume.copy()
+        merged = journal.end_group()
+        self.assertEqual(len(journal.done), 2)
+        self.assertIsNone(merged.box)
+        self.assertTrue(np.array_equal(self.volume, after))
+        self.assertEqual(merged.bounds(self.volume.shape), ((0, 6), (0, 12), (3, 9)))
+        journal.undo()
+        self.assertTrue(np.array_equal(self.volume, before))
+        journal.redo()
+        self.assertTrue(np.array_equal(self.volume, after))
+        self.assertTrue(np.array_equal(journal.replay(self.original.copy()), after))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "edits.npz")
+            journal.save(path)
+            replayed = edit_journal.replay_edits(self.original.copy(), path)
+        self.assertTrue(np.array_equal(replayed, after))
+
+    def test_group_stays_sparse(self):
+        # a diagonal stroke across a large volume costs about its painted voxels, not its bounding box.
+        volume = np.zeros((128, 128, 128), dtype=np.uint16)
+        volume[64:] = 3
+        journal = edit_journal.EditJournal(volume)
+        journal.begin_group()
+        stamp = np.stack(np.meshgrid(*[np.arange(3)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+        for n in range(0, 125, 2):
+            # overlapping stamps, as painted by a stroke.
+            journal.paint_indices(np.ravel_multi_index(tuple((stamp + n).T), volume.shape), 5)
+        parts = sum(edit.nbytes() for edit in journal.done)
+        merged = journal.end_group()
+        self.assertEqual(len(journal.done), 1)
+        self.assertLessEqual(merged.nbytes(), parts)
+        self.assertEqual(journal.total_bytes, merged.nbytes())
+        journal.undo()
+        self.assertEqual(np.count_nonzero(volume != 3 * (np.arange(128) >= 64)[:, None, None]), 0)
+
+    def test_memory_cap(self):
+        journal = edit_journal.EditJournal(self.volume, max_bytes=1)
+        self.edit(journal)
+        self.assertEqual(len(journal.done), 1)
+        self.assertEqual(journal.forgotten, 1)
+
+    def test_save_and_replay(self):
+        journal = edit_journal.EditJournal(self.volume)
+        self.edit(journal)
+        self.assertTrue(np.array_equal(journal.replay(self.original.copy()), self.volume))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "edits.npz")
+            journal.save(path)
+            replayed = edit_journal.replay_edits(self.original.copy(), path)
+        self.assertTrue(np.array_equal(replayed, self.volume))
@@ -0,0 +1,83 @@
+import unittest
+from array_gizmos import label_overlaps, align_volumes
+from array_gizmos.test.test_registration import blob, moved_blob
+import numpy as np
+
+def cells(shape, count, seed):
+    "Label volume of blocky cells 1..count inside a zero border."
+    rng = np.random.default_rng(seed)
+    labels = np.zeros(shape, dtype=np.uint16)
+    interior = tuple(slice(4, n - 4) for n in shape)
+    coarse = rng.integers(0, count + 1, size=tuple(-(-(n - 8) // 3) for n in shape))
+    fine = coarse.repeat(3, 0).repeat(3, 1).repeat(3, 2)
+    labels[interior] = fine[tuple(slice(0, n - 8) for n in shape)]
+    return labels
+
+def brute_force(labels1, labels2, include_zero=False):
+    table = {}
+    for (a, b) in zip(labels1.ravel().tolist(), labels2.ravel().tolist()):
+        if include_zero or (a and b):
+            table[(a, b)] = table.get((a, b), 0) + 1
+    return table
+
+def as_dict(table):
+    (first, second, counts) = table
+    return {(int(a), int(b)): int(c) for (a, b, c) in zip(first, second, counts)}
+
+def parameters(translation, dIJK=(1.0, 1.0, 1.0)):
+    volume = dict(source_dimensions=list(dIJK), dvoxel=1.0)
+    return dict(volume1=volume, volume2=volume, roll=0, pitch=0, yaw=0, translation=list(translation))
+
+class Test_contingency(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = cells((20, 18, 16), 40, 1)
+        for include_zero in (False, True):
+            expected = brute_force(labels1, labels2, include_zero)
+            # bincount and chunked unique paths
+            for max_bins in (2**24, 10):
+                table = label_overlaps.contingency(
+                    labels1, labels2, include_zero, chunk_size=1000, max_bins=max_bins)
+                self.assertEqual(as_dict(table), expected)
+        matrix = label_overlaps.contingency_matrix(*label_overlaps.contingency(labels1, labels2))
+        self.assertEqual(matrix[3, 5], expected.get((3, 5), 0))
+
+    def test_identity_alignment(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = cells((20, 18, 16), 40, 1)
+        plain = label_overlaps.contingency(labels1, labels2)
+        aligned = label_overlaps.aligned_contingency(labels1, labels2, parameters((0, 0, 0)), chunk_size=500)
+        self.assertEqual(as_dict(aligned), as_dict(plain))
+
+    def test_shift_alignment(self):
+        labels1 = cells((20, 18, 16), 30, 0)
+        labels2 = np.roll(labels1, 3, axis=0)
+        # 3 voxels along I is 6 physical units with dI = 2.
+        found = as_dict(label_overlaps.aligned_contingency(
+            labels1, labels2, parameters((-6.0, 0, 0), (2.0, 1.0, 1.0))))
+        self.assertEqual(found, {(a, a): n for ((a, b), n) in brute_force(labels1, labels1).items() if a == b})
+
+    def test_snapped_pair(self):
+        labels1 = cells((24, 24, 24), 20, 2)
+        labels2 = np.roll(labels1, (2, -3, 1), axis=(0, 1, 2))
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), {1: labels1, 2: labels2}.get)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        pair.snap_translation()
+        (first, second, counts) = label_overlaps.aligned_contingency(labels1, labels2, pair.json_parameters())
+        same = counts[first == second].sum()
+        self.assertTrue(same > 0.95 * counts.sum(), repr((same, counts.sum())))
+
+    def test_rotated_pair(self):
+        shape = blob(40)
+        g = np.indices(shape.shape)
+        labels1 = (shape * (1 + (g[0] > 20) + 2 * (g[1] > 19) + 4 * (g[2] > 22))).astype(np.uint8)
+        labels2 = moved_blob(labels1, 0.3, -0.2, 0.25, (2.0, -3.0, 1.0))
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), {1: labels1, 2: labels2}.get)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        aligned = pair.auto_align(factors=(2, 1))
+        (first, second, counts) = label_overlaps.aligned_contingency(labels1, labels2, aligned)
+        self.assertTrue(counts[first == second].sum() > 0.95 * counts.sum())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -80,3 +80,43 @@ class Test_rectify(unittest.TestCase):
                 for k in range(6):
                     k0 = k // 3
                     self.assertEqual(Asp[i,j,k], A[i0,j0,k0])
+
+class Test_suffix_projections(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        A = rng.integers(0, 4, (6, 5, 4))
+        A[A < 2] = 0
+        A[:, 0, 0] = 0
+        self.A = A
+
+    def test_last_hits(self):
+        A = self.A
+        (index, value) = operations3d.last_hits(A)
+        self.assertEqual(index[0, 0], -1)
+        for i in range(A.shape[0]):
+            expected = operations3d.extrude0(A[i:])
+            extruded = np.where(index >= i, value, A[i])
+            self.assertTrue(np.array_equal(extruded, expected))
+
+    def test_suffix_max(self):
+        A = self.A
+        S = operations3d.suffix_max(A)
+        for i in range(A.shape[0]):
+            self.assertTrue(np.array_equal(S[i], A[i:].max(axis=0)))
+
+class Test_rotate3d_matrix(unittest.TestCase):
+
+    def test_matches_rotate3d(self):
+        N = 121
+        c = N // 2
+        offsets = np.array([[30, 0, 0], [0, 30, 0], [0, 0, 30], [-20, 15, 25]])
+        for angles in [(0.3, 0, 0), (0, 0.3, 0), (0, 0, 0.3), (0.3, 0.5, -0.4)]:
+            array = np.zeros((N, N, N), dtype=np.uint8)
+            array[tuple((offsets + c).T)] = np.arange(1, len(offsets) + 1)
+            rotated = operations3d.rotate3d(array, *angles)
+            M = operations3d.rotate3d_matrix(*angles)
+            for (n, offset) in enumerate(offsets):
+                found = np.argwhere(rotated == n + 1).mean(axis=0) - c
+                # rotate3d shears in whole voxels, so allow a few voxels of slop.
+                self.assertTrue(np.abs(found - M @ offset).max() < 4, repr((angles, found, M @ offset)))
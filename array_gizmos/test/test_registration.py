@@ -0,0 +1,176 @@
+import asyncio
+import unittest
+from array_gizmos import registration, align_volumes
+import numpy as np
+
+def blob(N=48):
+    "Asymmetric test shape: two overlapping ellipsoids."
+    g = np.indices((N, N, N)).transpose(1, 2, 3, 0) - N / 2
+    array = ((g / np.array([14, 9, 6])) ** 2).sum(axis=-1) < 1
+    array |= (((g - np.array([8, 6, 0])) / np.array([4, 4, 9])) ** 2).sum(axis=-1) < 1
+    return array.astype(np.uint8)
+
+class RecordingText:
+    "Stands in for the gz.Text info area."
+
+    value = None
+
+    def text(self, value):
+        self.value = value
+
+def moved_blob(fixed, roll, pitch, yaw, translation):
+    "The moving volume that the registration transform maps onto fixed."
+    indices = np.indices(fixed.shape).reshape((3, -1)).T
+    center = registration.rotation_center(fixed, (0, 0, 0), 1.0)
+    target = registration.transform_points(indices + 0.5, center, roll, pitch, yaw, translation)
+    target = np.floor(target).astype(int)
+    inside = np.all((target >= 0) & (target < fixed.shape[0]), axis=1)
+    result = np.zeros(len(indices), dtype=np.uint8)
+    result[inside] = fixed[tuple(target[inside].T)]
+    return result.reshape(fixed.shape)
+
+class Test_RigidAlignment(unittest.TestCase):
+
+    def test_block_occupancy(self):
+        array = np.zeros((5, 6, 7), dtype=np.uint8)
+        array[4, 0, 6] = 1
+        grid = registration.block_occupancy(array, 2)
+        self.assertEqual(grid.shape, (3, 3, 4))
+        self.assertEqual(np.argwhere(grid).tolist(), [[2, 0, 3]])
+
+    def test_recovers_transform(self):
+        fixed = blob()
+        (roll, pitch, yaw, translation) = (0.2, -0.15, 0.1, (2.0, -3.0, 1.0))
+        moving = moved_blob(fixed, roll, pitch, yaw, translation)
+        found = registration.RigidAlignment(fixed, moving).search()
+        self.assertTrue(found["overlap"] > 0.9)
+        found_angles = [found["roll"], found["pitch"], found["yaw"]]
+        self.assertTrue(np.abs(np.array(found_angles) - [roll, pitch, yaw]).max() < 0.06, repr(found))
+        self.assertTrue(np.abs(np.array(found["translation"]) - translation).max() < 1.0, repr(found))
+
+    def test_process_pool_matches_serial(self):
+        fixed = blob(32)
+        moving = moved_blob(fixed, 0.1, 0, 0, (1.0, 0, 0))
+        options = dict(factors=(2, 1), angle_range=0.1, angle_step=0.1)
+        serial = registration.RigidAlignment(fixed, moving, **options).search()
+        pooled = registration.RigidAlignment(fixed, moving, workers=2, **options).search()
+        self.assertEqual(serial, pooled)
+
+class Test_align_pair(unittest.TestCase):
+
+    def test_json_schema(self):
+        fixed = blob(32)
+        volumes = {1: fixed, 2: moved_blob(fixed, 0, 0.1, 0, (0, 1.0, 0))}
+        sequence = align_volumes.VolumeSequence((2.0, 1.0, 1.0), volumes.get)
+        parameters = align_volumes.align_pair(sequence, 1, 2, 1.0, factors=(2, 1))
+        self.assertEqual(
+            sorted(parameters.keys()),
+            ["description", "metrics", "pitch", "roll", "translation", "volume1", "volume2", "yaw"])
+        self.assertEqual(parameters["volume2"]["timestamp_number"], 2)
+        self.assertEqual(len(parameters["translation"]), 3)
+
+class Test_correlation_translation(unittest.TestCase):
+
+    def test_subvoxel_shift(self):
+        N = 32
+        g = np.indices((N, N, N)).transpose(1, 2, 3, 0).astype(np.float64)
+        def gaussian(center):
+            return np.exp(-((g - center) ** 2).sum(axis=-1) / (2 * 4.0 ** 2))
+        fixed = gaussian(np.array([16.0, 14.0, 17.0]))
+        moving = gaussian(np.array([13.7, 15.4, 17.0]))
+        (translation, _) = registration.correlation_translation(
+            fixed, moving, dvoxel=2.0, fixed_corner=(1, 0, 0), moving_corner=(0, 0, 0.5))
+        expected = np.array([1, 0, -0.5]) + 2.0 * np.array([2.3, -1.4, 0])
+        self.assertTrue(np.abs(translation - expected).max() < 0.1, repr(translation))
+
+    def test_max_shift(self):
+        fixed = blob(32)
+        moving = np.roll(fixed, (5, 0, 0), axis=(0, 1, 2))
+        (free, _) = registration.correlation_translation(fixed, moving)
+        self.assertTrue(np.abs(free - [-5, 0, 0]).max() < 0.5, repr(free))
+        (limited, _) = registration.correlation_translation(fixed, moving, max_shift=2)
+        # sub-voxel refinement may step up to half a voxel per axis past the limit.
+        self.assertTrue(np.sqrt((limited ** 2).sum()) <= 2 + 0.5 * np.sqrt(3), repr(limited))
+
+    def test_snap_translation(self):
+        fixed = blob(32)
+        volumes = {1: fixed, 2: np.roll(fixed, (3, -2, 0), axis=(0, 1, 2))}
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), volumes.get)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        for factor in (1, 2):
+            translation = pair.snap_translation(factor=factor)
+            self.assertTrue(np.abs(np.array(translation) - [-3, 2, 0]).max() < factor, repr(translation))
+        self.assertEqual(pair.json_parameters()["translation"], list(pair.translation))
+
+    def test_snap_in_background(self):
+        # the correlation runs on the render worker; the pair only changes on the event loop.
+        fixed = np.pad(blob(32), 4)
+        volumes = {1: fixed, 2: np.roll(fixed, (3, -2, 0), axis=(0, 1, 2))}
+        sequence = align_volumes.VolumeSequence((1.0, 1.0, 1.0), volumes.get)
+        pair = align_volumes.TimeStampPair(1, 2, sequence, 1.0)
+        pair.info_area = RecordingText()
+        drawn = []
+        pair.draw_image = lambda: drawn.append(pair.translation)
+        async def snap():
+            pair.snap_click()
+            self.assertEqual(pair.translation, (0.0, 0.0, 0.0))
+            while not drawn:
+                await asyncio.sleep(0.01)
+        asyncio.run(snap())
+        self.assertTrue(np.abs(np.array(drawn[0]) - [-3, 2, 0]).max() < 1, repr(drawn))
+        self.assertEqual(pair.initial[3], pair.translation)
+        self.assertIn("snapped", pair.info_area.value)
+        # the next frame moves the canvases to the new slider range.
+        frame = (0, 0, 0, 0, 0, 0, pair.translation, (1.0, 1))
+        pair.compute_image((frame, False))
+        self.assertEqual(pair.canvas_start, pair.translation)
+
+class Test_moment_alignment(unittest.TestCase):
+
+    def test_rotation_angles(self):
+        for angles in [(0.4, -0.3, 1.1), (-2.0, 0.2, 0.5)]:
+            R = registration.volume_rotation_matrix(*angles)
+            self.assertTrue(np.allclose(registration.rotation_angles(R), angles))
+
+    def test_large_rotation(self):
+        fixed = blob()
+        (roll, pitch, yaw, translation) = (1.2, -0.5, 0.8, (2.0, -1.0, 0.0))
+        moving = moved_blob(fixed, roll, pitch, yaw, translation)
+        found = registration.moment_alignment(fixed, moving, max_points=5000)
+        self.assertTrue(found["overlap"] > 0.85, repr(found))
+        R = registration.volume_rotation_matrix(found["roll"], found["pitch"], found["yaw"])
+        expected = registration.volume_rotation_matrix(roll, pitch, yaw)
+        self.assertTrue(np.abs(R - expected).max() < 0.15, repr(found))
+        self.assertTrue(np.abs(np.array(found["translation"]) - translation).max() < 1.5, repr(found))
+
+class Test_OverlapMetrics(unittest.TestCase):
+
+    def test_identity(self):
+        fixed = blob(32)
+        metrics = registration.OverlapMetrics(fixed, fixed)(0, 0, 0, (0, 0, 0))
+        self.assertAlmostEqual(metrics["dice"], 1.0)
+        self.assertAlmostEqual(metrics["iou"], 1.0)
+        self.assertEqual(metrics["surface_distance_95"], 0.0)
+
+    def test_shift(self):
+        fixed = np.pad(blob(32), 4)
+        moving = np.roll(fixed, 3, axis=0)
+        metrics = registration.OverlapMetrics(fixed, moving, dvoxel=2.0)
+        shifted = metrics(0, 0, 0, (0, 0, 0))
+        self.assertTrue(0.3 < shifted["iou"] < shifted["dice"] < 0.95, repr(shifted))
+        # surfaces at most 3 voxels apart.
+        self.assertTrue(0 < shifted["mean_surface_distance"] <= 6.0, repr(shifted))
+        self.assertTrue(shifted["surface_distance_95"] <= 6.0, repr(shifted))
+        aligned = metrics(0, 0, 0, (-6.0, 0, 0))
+        self.assertAlmostEqual(aligned["dice"], 1.0)
+        self.assertEqual(aligned["mean_surface_distance"], 0.0)
+
+    def test_recovered_transform_scores_better(self):
+        fixed = blob()
+        (roll, pitch, yaw, translation) = (0.2, -0.15, 0.1, (2.0, -3.0, 1.0))
+        moving = moved_blob(fixed, roll, pitch, yaw, translation)
+        metrics = registration.OverlapMetrics(fixed, moving)
+        before = metrics(0, 0, 0, (0, 0, 0))
+        after = metrics(roll, pitch, yaw, translation)
+        self.assertTrue(after["dice"] > 0.9 > before["dice"], repr((before, after)))
+        self.assertTrue(after["mean_surface_distance"] < 1.0 < before["mean_surface_distance"], repr((before, after)))
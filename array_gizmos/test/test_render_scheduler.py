@@ -0,0 +1,57 @@
+import asyncio
+import time
+import unittest
+from array_gizmos import render_scheduler
+
+class Test_RenderScheduler(unittest.TestCase):
+
+    def test_synchronous_without_loop(self):
+        shown = []
+        scheduler = render_scheduler.RenderScheduler(lambda p: p * 2, shown.append)
+        scheduler.request(3)
+        scheduler.request(4)
+        self.assertEqual(shown, [6, 8])
+
+    def test_coalesces_to_newest(self):
+        computed = []
+        shown = []
+        def compute(parameters):
+            time.sleep(0.02)
+            computed.append(parameters)
+            return parameters
+        scheduler = render_scheduler.RenderScheduler(compute, shown.append)
+        async def drag():
+            for i in range(20):
+                scheduler.request(i)
+                await asyncio.sleep(0.001)
+            while scheduler.busy():
+                await asyncio.sleep(0.01)
+        asyncio.run(drag())
+        # the final parameters always render, most intermediate ones never do.
+        self.assertEqual(shown[-1], 19)
+        self.assertEqual(computed[-1], 19)
+        self.assertTrue(len(computed) < 10, repr(computed))
+        self.assertEqual(shown, sorted(shown))
+
+class Test_ProgressiveScheduler(unittest.TestCase):
+
+    def test_preview_then_refine(self):
+        shown = []
+        scheduler = render_scheduler.ProgressiveScheduler(
+            lambda request: request, shown.append, refine_delay=0.05)
+        async def drag():
+            for i in range(5):
+                scheduler.request(i)
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.2)
+        asyncio.run(drag())
+        # previews while dragging, one full resolution render at the end.
+        self.assertTrue(all(coarse for (_, coarse) in shown[:-1]))
+        self.assertEqual(shown[-1], (4, False))
+        self.assertEqual(len([s for s in shown if not s[1]]), 1)
+
+    def test_headless_full_resolution(self):
+        shown = []
+        scheduler = render_scheduler.ProgressiveScheduler(lambda request: request, shown.append)
+        scheduler.request("p")
+        self.assertEqual(shown, [("p", False)])
@@ -0,0 +1,161 @@
+import unittest
+from array_gizmos import segmentation_editor
+import numpy as np
+
+class RecordingPanel:
+    "Stands in for the h5.Image panel, remembering the last array shown."
+
+    def change_array(self, array):
+        self.array = array.copy()
+
+def live_volume_mix(image, mask, maxLabel):
+    mix = segmentation_editor.VolumeMix(image, mask, maxLabel=maxLabel)
+    for panel in mix.mixes.values():
+        panel.display = True
+        panel.panel = RecordingPanel()
+        panel.update(panel.lamda)
+    return mix
+
+class Test_incremental_paint(unittest.TestCase):
+
+    def test_matches_full_redraw(self):
+        rng = np.random.default_rng(1)
+        image = rng.random((12, 15, 17))
+        mask = rng.integers(0, 4, image.shape)
+        incremental = live_volume_mix(image, mask.copy(), 5)
+        full = live_volume_mix(image, mask.copy(), 5)
+        incremental.selectedLabel = full.selectedLabel = 5
+        for IJK in [(6, 7, 8), (6, 8, 10), (7, 8, 10), (6, 7, 8)]:
+            IJK = np.array(IJK)
+            incremental.paint(IJK)
+            full.paint(IJK)
+            for panel in full.mixes.values():
+                panel.invalidate()
+                panel.update(panel.lamda)
+            for (name, panel) in incremental.mixes.items():
+                expected = full.mixes[name].panel.array
+                self.assertTrue(np.array_equal(panel.panel.array, expected), name)
+
+class Test_paint_undo(unittest.TestCase):
+
+    def test_undo_redo_paint(self):
+        rng = np.random.default_rng(4)
+        image = rng.random((8, 9, 10))
+        mask = rng.integers(0, 3, image.shape)
+        mix = live_volume_mix(image, mask.copy(), 4)
+        mix.selectedLabel = 4
+        mix.paint(np.array([4, 4, 4]))
+        painted = mix.volumeMask.copy()
+        shown = mix.mixes["JK"].panel.array.copy()
+        mix.undo()
+        self.assertTrue(np.array_equal(mix.volumeMask, mask))
+        mix.redo()
+        self.assertTrue(np.array_equal(mix.volumeMask, painted))
+        self.assertTrue(np.array_equal(mix.mixes["JK"].panel.array, shown))
+
+    def test_paints_callers_mask(self):
+        # a non-contiguous mask is edited in place, not through a private copy.
+        rng = np.random.default_rng(4)
+        image = rng.random((8, 9, 10))
+        storage = rng.integers(0, 3, (10, 9, 8))
+        mask = storage.transpose()
+        original = mask.copy()
+        mix = live_volume_mix(image, mask, 4)
+        self.assertIs(mix.volumeMask, mask)
+        mix.selectedLabel = 4
+        mix.paint(np.array([4, 4, 4]))
+        self.assertEqual(storage[4, 4, 4], 4)
+        mix.undo()
+        self.assertTrue(np.array_equal(mask, original))
+
+class Test_paint_strokes(unittest.TestCase):
+
+    def test_stroke_centers_have_no_gaps(self):
+        points = np.array([[0, 0, 0], [9, 3, -4], [9, 3, -4], [2, 11, 0]])
+        centers = segmentation_editor.stroke_centers(points)
+        for point in points:
+            self.assertTrue(np.any(np.all(centers == point, axis=1)))
+        # every center has a neighbour within one voxel along each axis.
+        for center in centers:
+            distances = np.abs(centers - center).max(axis=1)
+            self.assertTrue(np.sum(distances <= 1) > 1)
+
+    def test_stroke_matches_stamped_paint(self):
+        rng = np.random.default_rng(7)
+        image = rng.random((10, 20, 20))
+        mask = rng.integers(0, 3, image.shape)
+        stroked = live_volume_mix(image, mask.copy(), 4)
+        stamped = live_volume_mix(image, mask.copy(), 4)
+        stroked.selectedLabel = stamped.selectedLabel = 4
+        points = [(5, 1, 1), (5, 15, 18), (2, 18, 3)]
+        for point in points:
+            stroked.stroke_to(np.array(point))
+        stroked.end_stroke()
+        # the whole stroke is one sparse journal entry of the voxels it changed.
+        self.assertEqual(len(stroked.journal.done), 1)
+        ijk = np.argwhere(stroked.volumeMask != mask)
+        self.assertEqual(len(stroked.journal.done[0].indices), len(ijk))
+        box = stroked.journal.done[0].bounds(mask.shape)
+        for axis in range(3):
+            self.assertTrue(box[axis][0] <= ijk[:, axis].min() and ijk[:, axis].max() < box[axis][1])
+        centers = segmentation_editor.stroke_centers(np.array(points))
+        for center in centers:
+            stamped.paint(center)
+        stamped.positionMixes(np.array(points[-1]))
+        self.assertTrue(np.array_equal(stroked.volumeMask, stamped.volumeMask))
+        for (name, panel) in stroked.mixes.items():
+            expected = stamped.mixes[name].panel.array
+            self.assertTrue(np.array_equal(panel.panel.array, expected), name)
+        # a new stroke does not join to the end of the previous one.
+        self.assertIsNone(stroked.stroke_last)
+        painted = stroked.volumeMask.copy()
+        shown = stroked.mixes["JK"].panel.array.copy()
+        stroked.undo()
+        self.assertTrue(np.array_equal(stroked.volumeMask, mask))
+        stroked.redo()
+        self.assertTrue(np.array_equal(stroked.volumeMask, painted))
+        self.assertTrue(np.array_equal(stroked.mixes["JK"].panel.array, shown))
+        # a second stroke is a separate entry.
+        stroked.stroke_to(np.array((1, 1, 1)))
+        stroked.stroke_to(np.array((1, 5, 1)))
+        stroked.end_stroke()
+        self.assertEqual(len(stroked.journal.done), 2)
+        stroked.undo()
+        self.assertTrue(np.array_equal(stroked.volumeMask, painted))
+
+class Test_shared_volume_cache(unittest.TestCase):
+
+    def test_panels_share_palette_and_scaled_volume(self):
+        rng = np.random.default_rng(2)
+        image = rng.random((6, 7, 8))
+        mask = rng.integers(0, 3, image.shape)
+        mix = live_volume_mix(image, mask, 3)
+        for panel in mix.mixes.values():
+            self.assertIs(panel.color_mapping_array, mix.color_mapping_array)
+            self.assertTrue(np.array_equal(panel.scaled_image(), mix.normalizer(panel.image)))
+
+class Test_viewport_rendering(unittest.TestCase):
+
+    def test_window_matches_whole_slice(self):
+        rng = np.random.default_rng(5)
+        image = rng.random((6, 40, 50))
+        mask = rng.integers(0, 3, image.shape)
+        whole = live_volume_mix(image, mask.copy(), 4)
+        windowed = segmentation_editor.VolumeMix(image, mask.copy(), maxLabel=4, viewport=(16, 24))
+        panel = windowed.mixes["JK"]
+        reference = whole.mixes["JK"]
+        panel.viewport.tile_size = 8
+        panel.tiles.clear()
+        for (painted, zoom) in [(None, 1), (None, 0.5), ((3, 20, 25), 1)]:
+            if painted is not None:
+                whole.selectedLabel = windowed.selectedLabel = 4
+                whole.paint(np.array(painted))
+                windowed.paint(np.array(painted))
+                reference.invalidate()
+            panel.viewport.set_zoom(zoom)
+            window = panel.window_image(panel.lamda)
+            step = panel.viewport.step()
+            (r0, c0) = panel.viewport.origin()
+            base = reference.base_image(reference.lamda)[::step, ::step]
+            expected = base[r0:r0 + window.shape[0], c0:c0 + window.shape[1]]
+            self.assertTrue(np.array_equal(window[:expected.shape[0], :expected.shape[1]], expected))
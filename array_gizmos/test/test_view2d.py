@@ -0,0 +1,102 @@
+import unittest
+from array_gizmos import view2d
+import numpy as np
+
+def reference_overview(iod):
+    "Overview with outline drawn from scratch, as in the original implementation."
+    array = iod.array[::iod.stride, ::iod.stride]
+    colored = np.stack([array] * 3, axis=-1)
+    (i0, i1, j0, j1) = np.array(iod.detail_boundaries()) // iod.stride
+    colored[i0, j0:j1] = 255 - colored[i0, j0:j1]
+    colored[i1, j0:j1] = 255 - colored[i1, j0:j1]
+    colored[i0:i1, j0] = 255 - colored[i0:i1, j0]
+    colored[i0:i1, j1] = 255 - colored[i0:i1, j1]
+    return colored
+
+class Test_ImageOverviewAndDetail(unittest.TestCase):
+
+    def test_overview_outline_moves(self):
+        rng = np.random.default_rng(0)
+        array = rng.integers(0, 256, (300, 400)).astype(np.uint8)
+        iod = view2d.ImageOverviewAndDetail(array, width=100, histogram_height=20)
+        for focus in [(150, 200), (20, 30), (290, 390), (150, 210)]:
+            iod.focus = focus
+            (_, colored) = iod.overview()
+            self.assertTrue(np.array_equal(colored, reference_overview(iod)), repr(focus))
+
+    def test_sampled_histograms(self):
+        rng = np.random.default_rng(1)
+        array = rng.integers(0, 256, (300, 400)).astype(np.uint8)
+        iod = view2d.ImageOverviewAndDetail(array, width=100, histogram_height=20, max_samples=5000)
+        # the overview histogram estimates the whole array, within its bound.
+        histogram = iod.overview_histogram
+        exact = np.bincount(array.ravel(), minlength=256)
+        self.assertTrue(0 < histogram.error_bound)
+        self.assertTrue(np.abs(histogram.values - exact).max() <= histogram.error_bound)
+        exact = view2d.ImageOverviewAndDetail(array, width=100, histogram_height=20, max_samples=None)
+        self.assertTrue(np.array_equal(exact.overview_histogram.values, np.bincount(array.ravel(), minlength=256)))
+
+class Test_Histogram(unittest.TestCase):
+
+    def test_uint8_counts(self):
+        rng = np.random.default_rng(1)
+        array = rng.integers(3, 200, (50, 60)).astype(np.uint8)
+        histogram = view2d.Histogram(array, width=100, height=20)
+        self.assertEqual(len(histogram.values), 256)
+        expected, _ = np.histogram(array, bins=256, range=(0, 256))
+        self.assertTrue(np.array_equal(histogram.values, expected))
+        detail = array[10:20, 5:50]
+        self.assertTrue(np.array_equal(histogram.counts(detail, 256), np.histogram(detail, bins=256, range=(0, 256))[0]))
+
+class Test_VBars(unittest.TestCase):
+
+    def test_bars_match_loop(self):
+        values = np.array([0, 5, 100, 37, 64, 1])
+        bars = view2d.VBars(values, width=60, height=50)
+        bars.selected_column = 3
+        array = bars.array()
+        expected = np.full((50, len(values), 3), bars.background, dtype=np.ubyte)
+        for (i, value) in enumerate(values):
+            ylimit = int(value * 50 / values.max())
+            expected[50 - ylimit:, i] = 0
+        ylimit = int(values[3] * 50 / values.max())
+        expected[:, 3, 1] = 255
+        expected[:50 - ylimit, 3, 2] = bars.background // 2
+        expected[:50 - ylimit, 3, :2] = 255
+        self.assertTrue(np.array_equal(array, expected))
+
+class Test_approximate_histogram(unittest.TestCase):
+
+    def test_integer_fast_path(self):
+        rng = np.random.default_rng(2)
+        array = rng.integers(-40, 300, (70, 80))
+        histogram = view2d.Histogram(array, width=100, height=20)
+        expected, _ = np.histogram(array, bins=int(array.max() - array.min()) + 1)
+        self.assertTrue(np.array_equal(histogram.values, expected))
+        self.assertEqual(histogram.error_bound, 0)
+
+    def test_signed_narrow_full_range(self):
+        array = np.arange(-128, 128, dtype=np.int8).reshape((16, 16))
+        histogram = view2d.Histogram(array, width=100, height=20)
+        self.assertTrue(np.array_equal(histogram.values, np.ones(256, dtype=np.int64)))
+        wide = np.array([-32768, 0, 32767], dtype=np.int16)
+        counts = histogram.exact_counts(wide, 65536)
+        self.assertEqual((counts[0], counts[32768], counts[-1], counts.sum()), (1, 1, 1, 3))
+
+    def test_sampled_counts_within_bound(self):
+        rng = np.random.default_rng(3)
+        array = np.clip(rng.normal(100, 20, (1000, 1000)), 0, 255).astype(np.uint8)
+        exact = np.bincount(array.ravel(), minlength=256)
+        histogram = view2d.Histogram(array, width=100, height=20, max_samples=20000, sampling="random")
+        self.assertTrue(histogram.error_bound > 0)
+        self.assertAlmostEqual(histogram.values.sum(), exact.sum(), delta=256)
+        self.assertTrue(np.abs(histogram.values - exact).max() <= histogram.error_bound)
+        self.assertIn("+/-", histogram.column_info(100))
+
+    def test_strided_sample_has_no_bound(self):
+        # data periodic with the stride: the strided sample sees a single value.
+        array = np.tile(np.arange(8, dtype=np.uint8), (800, 100))
+        histogram = view2d.Histogram(array, width=100, height=20, max_samples=10000)
+        self.assertIsNone(histogram.error_bound)
+        self.assertIn("approximate", histogram.column_info(0))
+        self.assertEqual(np.count_nonzero(histogram.values), 1)
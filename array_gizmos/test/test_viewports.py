@@ -0,0 +1,44 @@
+import unittest
+from array_gizmos import viewports
+import numpy as np
+
+class Test_Viewport(unittest.TestCase):
+
+    def test_window_and_coordinates(self):
+        viewport = viewports.Viewport((300, 200), (100, 80), center=(150, 100), tile_size=32)
+        self.assertEqual(viewport.window_shape(), (100, 80))
+        self.assertEqual(viewport.origin(), (100, 60))
+        self.assertEqual(viewport.to_data(0, 0), (100, 60))
+        self.assertEqual(viewport.to_window(150, 100), (50, 40))
+        self.assertIsNone(viewport.to_window(0, 0))
+        viewport.zoom_by(2)
+        self.assertEqual(viewport.window_shape(), (50, 40))
+        viewport.zoom_by(1.0 / 8)
+        self.assertEqual(viewport.step(), 4)
+        self.assertEqual(viewport.grid_shape(), (75, 50))
+        # zoomed out past the slice the window is padded.
+        self.assertEqual(viewport.origin(), (0, 0))
+        self.assertIsNone(viewport.to_data(90, 10))
+        self.assertEqual(viewport.to_data(10, 10), (40, 40))
+
+    def test_tiles_cover_window(self):
+        data = np.arange(300 * 200).reshape((300, 200))
+        viewport = viewports.Viewport(data.shape, (100, 80), center=(40, 170), tile_size=32)
+        for zoom in (1, 0.5, 2):
+            viewport.set_zoom(zoom)
+            window = np.zeros(viewport.window_shape(), dtype=data.dtype)
+            for (tr, tc) in viewport.tiles():
+                viewport.paste(window, data[viewport.tile_slices(tr, tc)], tr, tc)
+            step = viewport.step()
+            (r0, c0) = viewport.origin()
+            (rows, cols) = window.shape
+            expected = data[::step, ::step][r0:r0 + rows, c0:c0 + cols]
+            self.assertTrue(np.array_equal(window[:expected.shape[0], :expected.shape[1]], expected))
+            self.assertTrue(len(viewport.tiles(margin=1)) > len(viewport.tiles()))
+
+    def test_pan_clamps_to_slice(self):
+        viewport = viewports.Viewport((300, 200), (100, 80))
+        for _ in range(10):
+            viewport.pan(-0.5, 0.5)
+        self.assertEqual(viewport.center, (0, 199))
+        self.assertEqual(viewport.origin(), (0, 120))
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+from array_gizmos import volume_colorizers, colorizers
+import numpy as np
+
+class Test_VolumeColorizer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.labels = rng.integers(0, 6, (9, 7, 5))
+        self.image = rng.normal(size=(9, 7, 5))
+
+    def layerwise(self, colorizer):
+        normalizer = colorizers.VolumeNormalizer(self.image)
+        blender = colorizers.FixedPointBlender()
+        for (labels, image) in zip(self.labels, self.image):
+            colors = colorizers.colorize_array(labels, colorizer.color_mapping_array)
+            mask = labels != 0
+            yield blender.blend(colors, normalizer(image), colorizer.mix_lambda, mask).copy()
+
+    def test_slabs_match_layers(self):
+        # tiny budget forces one layer per slab
+        colorizer = volume_colorizers.VolumeColorizer(
+            self.labels, self.image, mix_lambda=0.3, memory_budget=1, workers=3)
+        self.assertEqual(len(colorizer.slabs()), 9)
+        colorizer.colorize()
+        for (layer, expected) in enumerate(self.layerwise(colorizer)):
+            self.assertTrue(np.array_equal(colorizer.get_layer(layer), expected))
+
+    def test_memory_mapped(self):
+        colorizer = volume_colorizers.VolumeColorizer(self.labels, speckle=True)
+        in_memory = colorizer.colorize().copy()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "colorized.npy")
+            colorizer.colorize(path)
+            loaded = np.load(path)
+            self.assertTrue(np.array_equal(loaded, in_memory))
@@ -58,9 +58,10 @@ class VBars:
         array_width = len(self.values)
         bw_array = np.full((array_height, array_width, 3), background, dtype=np.ubyte)
         height_factor = array_height / max(values)
-        for i, value in enumerate(values):
-            ylimit = int(value * height_factor)
-            bw_array[array_height-ylimit:, i] = 0
+        # bars: one comparison of a row index ramp against the bar tops.
+        ylimits = (np.asarray(values) * height_factor).astype(np.int64)
+        rows = np.arange(array_height)[:, np.newaxis]
+        bw_array[rows >= (array_height - ylimits)[np.newaxis, :]] = 0
         selected = self.selected_column
         if selected is not None:
             bw_array[:, selected, 1] = 255
@@ -116,17 +117,84 @@ def test_vbars():
       
 class Histogram(VBars):
 
-    def __init__(self, array, width=600, height=200):
-        M = int(array.max() - array.min())
-        if (M > 1000):
-            bins = 1000
+    """
+    Histogram bars for an array.  If max_samples is given, arrays larger than that
+    are histogrammed approximately from a strided (or random) subsample and the
+    counts are scaled up.  For random samples error_bound holds a 95% confidence
+    bound on the count error of every bin; a strided sample has no such guarantee
+    (periodic data can alias with the stride), so error_bound is None and the
+    counts are only marked approximate.
+    """
+
+    def __init__(self, array, width=600, height=200, max_samples=None, sampling="strided", seed=0):
+        assert sampling in ("strided", "random"), "unknown sampling: " + repr(sampling)
+        self.max_samples = max_samples
+        self.sampling = sampling
+        self.rng = np.random.default_rng(seed)
+        self.error_bound = 0
+        sample = self.sample(array)
+        if array.dtype == np.uint8:
+            bins = 256
         else:
-            bins = M + 1
-        values, _ = np.histogram(array, bins=bins)
+            M = int(sample.max()) - int(sample.min())
+            if (M > 1000):
+                bins = 1000
+            else:
+                bins = M + 1
+        values = self.counts(array, bins)
         super().__init__(values, width, height)
 
+    def sample(self, array):
+        "The array itself, or a subsample of at most about max_samples values."
+        size = array.size
+        max_samples = self.max_samples
+        if max_samples is None or size <= max_samples:
+            return array
+        if self.sampling == "random":
+            return array.flat[self.rng.integers(0, size, max_samples)]
+        # stride every axis to avoid copying the whole array.
+        stride = int(np.ceil((size / max_samples) ** (1.0 / array.ndim)))
+        return array[(slice(None, None, stride),) * array.ndim]
+
+    def counts(self, array, bins):
+        sample = self.sample(array)
+        values = self.exact_counts(sample, bins)
+        if sample.size < array.size:
+            n = sample.size
+            values = np.rint(values * (array.size / n)).astype(np.int64)
+            if self.sampling == "random":
+                # Dvoretzky-Kiefer-Wolfowitz (i.i.d. samples): the sampled CDF is within eps
+                # everywhere with 95% confidence, so each bin is within 2 * eps of its true fraction.
+                eps = np.sqrt(np.log(2 / 0.05) / (2 * n))
+                self.error_bound = int(np.ceil(2 * eps * array.size))
+            else:
+                self.error_bound = None
+        else:
+            self.error_bound = 0
+        return values
+
+    def exact_counts(self, array, bins):
+        if array.dtype == np.uint8:
+            # one bin per byte value: a single pass, much faster than np.histogram.
+            return np.bincount(array.ravel(), minlength=256)
+        if np.issubdtype(array.dtype, np.integer) and array.size > 0:
+            m = array.min()
+            if int(array.max()) - int(m) + 1 == bins:
+                # one bin per integer value, same as np.histogram with these bins.
+                return np.bincount(array.ravel().astype(np.intp) - int(m), minlength=bins)
+        values, _ = np.histogram(array, bins=bins)
+        return values
+
+    def column_info(self, column):
+        info = super().column_info(column)
+        if self.error_bound is None:
+            info += " (approximate)"
+        elif self.error_bound:
+            info += " (+/- %s)" % self.error_bound
+        return info
+
     def change_array(self, array):
-        values, _ = np.histogram(array, bins=len(self.values))
+        values = self.counts(array, len(self.values))
         self.values = values
         self._array = self.array()
         self.image.change_array(self._array)
@@ -158,8 +226,14 @@ class ImageOverviewAndDetail:
     def __init__(self, array, 
                  width=600, 
                  histogram_height=200,
-                 title="Image Overview and Detail"):
+                 title="Image Overview and Detail",
+                 max_samples=2**20):
+        """
+        The histograms are computed from at most about max_samples random samples
+        (None for exact counts): the overview histogram covers the whole array.
+        """
         self.title = title
+        self.max_samples = max_samples
         # scale the array to 0..255 as np.uint8
         m = array.min()
         M = array.max()
@@ -175,6 +249,11 @@ class ImageOverviewAndDetail:
         self.focus = (I // 2, J // 2)
         self.height = I // self.stride
         self.histogram_height = histogram_height
+        # the strided grey overview is colored once; the outline is drawn on a reusable copy.
+        self.overview_array = array[::self.stride, ::self.stride]
+        self.overview_base = self.colored_overview(self.overview_array)
+        self.overview_buffer = self.overview_base.copy()
+        self.outline = []
         self.dashboard = self.dash()
 
     def detail_boundaries(self):
@@ -200,8 +279,7 @@ class ImageOverviewAndDetail:
         #array[:, -1] = 0
         return (detail, array)
     
-    def overview(self):
-        array = self.array[::self.stride, ::self.stride]
+    def colored_overview(self, array):
         if len(array.shape) == 2:
             colored_array = np.zeros(array.shape + (3,), dtype=array.dtype)
             colored_array[:, :, 0] = array
@@ -210,14 +288,27 @@ class ImageOverviewAndDetail:
         else:
             assert len(array.shape) == 3
             colored_array = array.copy()
+        return colored_array
+
+    def overview(self):
+        array = self.overview_array
+        colored_array = self.overview_buffer
+        base = self.overview_base
+        # restore the pixels under the previous outline
+        for selection in self.outline:
+            colored_array[selection] = base[selection]
         # draw a inverted outline around focus
         bounds = self.detail_boundaries()
         # adjust the bounds to the overview array using numpy with stride
         (i0, i1, j0, j1) = np.array(bounds) // self.stride
-        colored_array[i0, j0:j1] = 255 - colored_array[i0, j0:j1]
-        colored_array[i1, j0:j1] = 255 - colored_array[i1, j0:j1]
-        colored_array[i0:i1, j0] = 255 - colored_array[i0:i1, j0]
-        colored_array[i0:i1, j1] = 255 - colored_array[i0:i1, j1]
+        self.outline = [
+            (i0, slice(j0, j1)),
+            (i1, slice(j0, j1)),
+            (slice(i0, i1), j0),
+            (slice(i0, i1), j1),
+        ]
+        for selection in self.outline:
+            colored_array[selection] = 255 - colored_array[selection]
         # make edges of array black
         #colored_array[0, :] = 0
         #colored_array[-1, :] = 0
@@ -227,18 +318,19 @@ class ImageOverviewAndDetail:
 
     def dash(self):
         (arr_detail, disp_detail) = self.detail()
-        (arr_overview, c_overview) = self.overview()
+        (_, c_overview) = self.overview()
         title_text = h5.Text(self.title)
         overview_text = h5.Text("Overview")
         detail_text = h5.Text("Detail")
         image_detail = h5.Image(array=disp_detail, width=self.width, pixelated=True, scale=False)
-        image_overview = h5.Image(array=c_overview, width=self.width, pixelated=True, scale=False)
+        # the overview buffer is reused, so the image gets a copy.
+        image_overview = h5.Image(array=c_overview.copy(), width=self.width, pixelated=True, scale=False)
         image_overview.on_pixel(self.focus_click, "click")
         image_overview.on_pixel(self.focus_move, "mousemove")
         image_overview.css({"border": "5px solid red"})
         image_detail.css({"border": "5px solid red"})
-        detail_histogram = Histogram(arr_detail, self.width, self.histogram_height)
-        overview_histogram = Histogram(arr_overview, self.width, self.histogram_height)
+        detail_histogram = self.histogram(arr_detail)
+        overview_histogram = self.histogram(self.array)
         dashboard = h5.Stack([
             title_text,
             [
@@ -254,6 +346,10 @@ class ImageOverviewAndDetail:
         self.overview_text = overview_text
         return dashboard
     
+    def histogram(self, array):
+        return Histogram(
+            array, self.width, self.histogram_height, max_samples=self.max_samples, sampling="random")
+
     def focus_click(self, event):
         self.clicked = not self.clicked
         #print("clicked", self.clicked, event["type"])
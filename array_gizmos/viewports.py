@@ -0,0 +1,141 @@
+"""
+Viewport (center plus zoom) over a 2d slice, so viewers render only the
+visible window at display resolution.
+
+Zooming in ships fewer data pixels which the browser enlarges (pixelated);
+zooming out subsamples the slice by an integer step.  Either way the
+shipped window is at most the display size.  The (subsampled) slice is
+split into fixed size tiles so renderers can cache tiles around the window
+and reuse them while panning.
+"""
+
+import numpy as np
+
+class Viewport:
+
+    def __init__(self, data_shape, display_shape, center=None, zoom=1.0, tile_size=128, max_zoom=16.0):
+        "data_shape and display_shape are (rows, cols); zoom levels are powers of 2."
+        self.data_shape = tuple(int(n) for n in data_shape[:2])
+        self.display_shape = tuple(int(n) for n in display_shape[:2])
+        self.tile_size = int(tile_size)
+        self.max_zoom = max_zoom
+        # zoomed all the way out the whole slice fits in the display.
+        fit = min(d / n for (d, n) in zip(self.display_shape, self.data_shape))
+        self.min_zoom = min(1.0, 2.0 ** np.floor(np.log2(fit)))
+        if center is None:
+            center = (self.data_shape[0] // 2, self.data_shape[1] // 2)
+        self.center = (0, 0)
+        self.center_on(*center)
+        self.zoom = 1.0
+        self.set_zoom(zoom)
+
+    def set_zoom(self, zoom):
+        zoom = 2.0 ** np.round(np.log2(zoom))
+        self.zoom = float(min(self.max_zoom, max(self.min_zoom, zoom)))
+
+    def zoom_by(self, factor):
+        self.set_zoom(self.zoom * factor)
+
+    def center_on(self, row, col):
+        (rows, cols) = self.data_shape
+        self.center = (int(min(rows - 1, max(0, row))), int(min(cols - 1, max(0, col))))
+
+    def pan(self, row_fraction, col_fraction):
+        "Move the center by fractions of the window size."
+        (wrows, wcols) = self.window_shape()
+        step = self.step()
+        (row, col) = self.center
+        self.center_on(row + int(row_fraction * wrows * step), col + int(col_fraction * wcols * step))
+
+    def step(self):
+        "Subsampling step of the slice at this zoom level."
+        if self.zoom >= 1:
+            return 1
+        return int(round(1.0 / self.zoom))
+
+    def grid_shape(self):
+        "Shape of the slice subsampled by step."
+        step = self.step()
+        return tuple(-(-n // step) for n in self.data_shape)
+
+    def window_shape(self):
+        "Shape of the shipped window (at most the display shape)."
+        if self.zoom <= 1:
+            return self.display_shape
+        return tuple(max(1, int(np.ceil(d / self.zoom))) for d in self.display_shape)
+
+    def origin(self):
+        "Grid (row, col) of the window's upper left corner."
+        step = self.step()
+        result = []
+        for (c, w, g) in zip(self.center, self.window_shape(), self.grid_shape()):
+            result.append(int(min(max(0, c // step - w // 2), max(0, g - w))))
+        return tuple(result)
+
+    def to_data(self, row, col):
+        "Slice position of a window pixel, or None if it is in the padding past the slice."
+        step = self.step()
+        (r0, c0) = self.origin()
+        (grows, gcols) = self.grid_shape()
+        (gr, gc) = (r0 + row, c0 + col)
+        if not (0 <= gr < grows and 0 <= gc < gcols):
+            return None
+        return (gr * step, gc * step)
+
+    def to_window(self, row, col):
+        "Window pixel showing a slice position, or None if it is not visible."
+        step = self.step()
+        (r0, c0) = self.origin()
+        (wrows, wcols) = self.window_shape()
+        (wr, wc) = (row // step - r0, col // step - c0)
+        if not (0 <= wr < wrows and 0 <= wc < wcols):
+            return None
+        return (int(wr), int(wc))
+
+    def visible(self, row, col):
+        return self.to_window(row, col) is not None
+
+    def tiles(self, margin=0):
+        "(tile_row, tile_col) of the tiles covering the window, plus margin tiles around it."
+        T = self.tile_size
+        ranges = []
+        for (o, w, g) in zip(self.origin(), self.window_shape(), self.grid_shape()):
+            ntiles = -(-g // T)
+            first = max(0, o // T - margin)
+            last = min(ntiles - 1, (min(o + w, g) - 1) // T + margin)
+            ranges.append(range(first, last + 1))
+        return [(tr, tc) for tr in ranges[0] for tc in ranges[1]]
+
+    def tile_extent(self, tile_row, tile_col):
+        "((row_start, row_end), (col_start, col_end)) of a tile in grid coordinates."
+        T = self.tile_size
+        (grows, gcols) = self.grid_shape()
+        return (
+            (tile_row * T, min(grows, (tile_row + 1) * T)),
+            (tile_col * T, min(gcols, (tile_col + 1) * T)),
+        )
+
+    def tile_slices(self, tile_row, tile_col):
+        "Slices selecting a tile from the full resolution slice."
+        step = self.step()
+        ((r0, r1), (c0, c1)) = self.tile_extent(tile_row, tile_col)
+        return (slice(r0 * step, r1 * step, step), slice(c0 * step, c1 * step, step))
+
+    def data_extent(self, tile_row, tile_col):
+        "((row_start, row_end), (col_start, col_end)) of the slice region under a tile."
+        step = self.step()
+        ((r0, r1), (c0, c1)) = self.tile_extent(tile_row, tile_col)
+        return ((r0 * step, r1 * step), (c0 * step, c1 * step))
+
+    def paste(self, window, tile, tile_row, tile_col):
+        "Copy the visible part of a rendered tile into the window array."
+        (o0, o1) = self.origin()
+        ((r0, r1), (c0, c1)) = self.tile_extent(tile_row, tile_col)
+        (wrows, wcols) = window.shape[:2]
+        wr0 = max(r0, o0)
+        wr1 = min(r1, o0 + wrows)
+        wc0 = max(c0, o1)
+        wc1 = min(c1, o1 + wcols)
+        if wr0 >= wr1 or wc0 >= wc1:
+            return
+        window[wr0 - o0:wr1 - o0, wc0 - o1:wc1 - o1] = tile[wr0 - r0:wr1 - r0, wc0 - c0:wc1 - c0]
@@ -0,0 +1,131 @@
+"""
+Colorize whole 3d label (and image) volumes ahead of time, slab by slab.
+
+The result is an RGB volume of shape (depth, rows, cols, 3) so a viewer
+can serve layer changes as a plain slice lookup, and the colorized stack
+can be exported for use elsewhere.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import colorizers
+from . import color_list
+
+# rough bytes of working memory per voxel while colorizing one slab:
+# labels, rgb colors, uint16 blend scratch, mask and output.
+working_bytes_per_voxel = 24
+
+def slab_depth(shape, memory_budget, workers=1, bytes_per_voxel=working_bytes_per_voxel):
+    "Number of layers per slab so that all workers together stay under memory_budget bytes."
+    layer_bytes = int(np.prod(shape[1:3])) * bytes_per_voxel * max(1, workers)
+    return int(max(1, min(shape[0], memory_budget // layer_bytes)))
+
+class VolumeColorizer:
+
+    """
+    Precolorize a label volume, optionally blended with a grey image volume,
+    using the same colorizing steps as the interactive viewers.
+    """
+
+    def __init__(
+            self,
+            labelVolume,
+            imageVolume=None,
+            color_mapping_array=None,
+            mix_lambda=0.5,
+            speckle=False,
+            normalizer=None,
+            memory_budget=256 * 2**20,
+            workers=4,
+            ):
+        assert len(labelVolume.shape) == 3, "label volume must be 3d: " + repr(labelVolume.shape)
+        if imageVolume is not None:
+            assert imageVolume.shape == labelVolume.shape, (
+                "label and image volumes must have same shape " +
+                repr(labelVolume.shape) + " " + repr(imageVolume.shape))
+            if normalizer is None:
+                normalizer = colorizers.shared_normalizer(imageVolume)
+        if color_mapping_array is None:
+            max_label = labelVolume.max()
+            color_choices = [(0,0,0)] + color_list.get_colors(max_label)
+            color_mapping_array = np.array(color_choices, dtype=np.ubyte)
+        self.labelVolume = labelVolume
+        self.imageVolume = imageVolume
+        self.color_mapping_array = color_mapping_array
+        self.mix_lambda = mix_lambda
+        self.speckle = speckle
+        self.normalizer = normalizer
+        self.memory_budget = memory_budget
+        self.workers = max(1, workers)
+        self.shape = labelVolume.shape
+        self.depth = slab_depth(self.shape, memory_budget, self.workers)
+        self.colorized = None
+
+    def slabs(self):
+        "(start, end) layer ranges covering the volume."
+        (D, depth) = (self.shape[0], self.depth)
+        return [(start, min(D, start + depth)) for start in range(0, D, depth)]
+
+    def colorize_slab(self, start, end, out):
+        "Colorize layers start..end of the volume into out[start:end]."
+        labels = np.asarray(self.labelVolume[start:end])
+        colors = colorizers.colorize_array(labels, self.color_mapping_array)
+        if self.speckle:
+            for (layer_colors, layer_labels) in zip(colors, labels):
+                colorizers.speckle_background(layer_colors, layer_labels, copy=False)
+        if self.imageVolume is None:
+            out[start:end] = colors
+            return
+        grey = self.normalizer(np.asarray(self.imageVolume[start:end]))
+        mask = None
+        if not self.speckle:
+            mask = (labels != 0)
+        # one blender per slab: the blender buffers are not shared between threads.
+        blender = colorizers.FixedPointBlender()
+        out[start:end] = blender.blend(colors, grey, self.mix_lambda, mask)
+
+    def allocate(self, path=None):
+        "Output rgb volume in memory, or memory mapped to a .npy file at path."
+        shape = tuple(self.shape) + (3,)
+        if path is None:
+            return np.empty(shape, dtype=np.ubyte)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.ubyte, shape=shape)
+
+    def colorize(self, path=None, verbose=False):
+        """
+        Colorize the whole volume slab by slab, in parallel threads
+        (the NumPy kernels release the GIL), and return the rgb volume.
+        """
+        out = self.allocate(path)
+        slabs = self.slabs()
+        def work(slab):
+            (start, end) = slab
+            self.colorize_slab(start, end, out)
+            if verbose:
+                print("colorized layers", start, "to", end, "of", self.shape[0])
+        if self.workers == 1 or len(slabs) == 1:
+            for slab in slabs:
+                work(slab)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # list() re-raises any worker exception here.
+                list(executor.map(work, slabs))
+        if path is not None:
+            out.flush()
+        self.colorized = out
+        return out
+
+    def get_layer(self, layer):
+        "Slice lookup into the precolorized volume."
+        assert self.colorized is not None, "colorize the volume first."
+        return self.colorized[layer]
+
+def export_tiff(colorized, tiff_path):
+    "Save a precolorized rgb volume as a multipage tiff file."
+    try:
+        import tifffile
+    except ImportError:
+        print ("The tifffile package is required for tiff file export.")
+        print ("  pip install tifffile")
+        raise
+    tifffile.imwrite(tiff_path, np.asarray(colorized), photometric="rgb")
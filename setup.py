@@ -24,6 +24,7 @@ setup(
         "tifffile",
         ],
     scripts = [
+        "bin/apply_alignment",
         "bin/compare_npz_labels",
         "bin/view_volume_layers",
     ],